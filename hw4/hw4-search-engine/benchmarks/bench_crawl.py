@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Compare the sequential, asynchronous and pipelined crawl loops against a
+local synthetic site, and check that they all produce the same graph,
+index and page info.
+
+Usage:
+    python benchmarks/bench_crawl.py [num_pages] [latency_seconds]
+"""
+
+import contextlib
+import io
+import sys
+import time
+
+from synthetic_site import SyntheticSite, LocalCrawler
+
+
+def run(site, num_pages, mode):
+    crawler = LocalCrawler(seed_url=site.url, max_pages=num_pages)
+    start = time.perf_counter()
+    # The crawler prints one line per page; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == 'sync':
+            crawler.crawl(delay=0)
+        elif mode == 'async':
+            crawler.crawl_async(delay=0, concurrency=16, per_host=16)
+        else:
+            crawler.crawl_pipelined(delay=0, fetch_workers=16)
+    elapsed = time.perf_counter() - start
+    print(f"{mode:>8}: {len(crawler.visited)} pages in {elapsed:.2f}s "
+          f"({len(crawler.visited) / elapsed:.1f} pages/sec)")
+    return crawler
+
+
+def url_results(crawler):
+    """The graph and positional index with URLs instead of page IDs, which depend on crawl order"""
+    urls = crawler.urls
+    index = {word: postings.sorted_items(key=urls.__getitem__)
+             for word, postings in crawler.index.items()}
+    graph = {urls[page_id]: sorted(urls[target] for target in targets)
+             for page_id, targets in crawler.graph.items()}
+    return graph, index
+
+
+def same_results(a, b):
+    return url_results(a) == url_results(b) and a.page_info == b.page_info
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    with SyntheticSite(num_pages=num_pages, latency=latency) as site:
+        print(f"Synthetic site: {num_pages} pages, {latency * 1000:.0f}ms latency\n")
+        sync = run(site, num_pages, 'sync')
+        async_ = run(site, num_pages, 'async')
+        pipeline = run(site, num_pages, 'pipeline')
+
+    print(f"\nIdentical results: async {same_results(sync, async_)}, "
+          f"pipeline {same_results(sync, pipeline)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+CPU benchmark for HTML extraction: the previous per-page pipeline (link
+parsing with MyHTMLParser, ~20 regex passes in extract_text_from_html and a
+separate title regex) against the single-pass indexer.extract_page().
+
+The fixture corpus is generated from the synthetic site, with a share of
+pages padded out to a few hundred KB, since large pages are where the
+regex passes hurt most.
+
+Usage:
+    python benchmarks/bench_extract.py [num_pages]
+"""
+
+import html
+import random
+import re
+import sys
+import time
+
+from synthetic_site import make_page
+
+from src import fetcher
+from src.indexer import extract_page, tokenize
+
+
+def legacy_extract_text_from_html(html_content):
+    """extract_text_from_html() as it was before extract_page(), for comparison."""
+    if not html_content:
+        return ""
+
+    html_content = re.sub(r'<script[^>]*>.*?</script>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
+    html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
+    html_content = re.sub(r'<noscript[^>]*>.*?</noscript>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
+    html_content = re.sub(r'<svg[^>]*>.*?</svg>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
+
+    title_match = re.search(r'<title[^>]*>(.*?)</title>', html_content, re.IGNORECASE | re.DOTALL)
+    title = title_match.group(1) if title_match else ""
+    if title:
+        title = re.sub(r'<[^>]+>', '', title)
+        title = html.unescape(title)
+        title = re.sub(r'\s+', ' ', title).strip()
+
+    body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.IGNORECASE | re.DOTALL)
+    body_content = body_match.group(1) if body_match else html_content
+
+    body_content = re.sub(r'<nav[^>]*>.*?</nav>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
+    body_content = re.sub(r'<header[^>]*>.*?</header>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
+    body_content = re.sub(r'<footer[^>]*>.*?</footer>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
+    body_content = re.sub(r'<aside[^>]*>.*?</aside>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
+
+    text_parts = []
+    for level in [1, 2, 3, 4, 5, 6]:
+        headings = re.findall(rf'<h{level}[^>]*>(.*?)</h{level}>', body_content, re.IGNORECASE | re.DOTALL)
+        for heading in headings:
+            heading_text = html.unescape(re.sub(r'<[^>]+>', '', heading).strip())
+            if heading_text:
+                text_parts.append(heading_text)
+                text_parts.append(heading_text)
+
+    main_content = re.findall(r'<main[^>]*>(.*?)</main>', body_content, re.IGNORECASE | re.DOTALL)
+    article_content = re.findall(r'<article[^>]*>(.*?)</article>', body_content, re.IGNORECASE | re.DOTALL)
+    section_content = re.findall(r'<section[^>]*>(.*?)</section>', body_content, re.IGNORECASE | re.DOTALL)
+    paragraphs = re.findall(r'<p[^>]*>(.*?)</p>', body_content, re.IGNORECASE | re.DOTALL)
+    list_items = re.findall(r'<li[^>]*>(.*?)</li>', body_content, re.IGNORECASE | re.DOTALL)
+
+    for part in main_content + article_content + section_content + paragraphs + list_items:
+        part_text = html.unescape(re.sub(r'<[^>]+>', ' ', part).strip())
+        if part_text:
+            text_parts.append(part_text)
+
+    if not text_parts:
+        body_text = html.unescape(re.sub(r'<[^>]+>', ' ', body_content).strip())
+        if body_text:
+            text_parts.append(body_text)
+
+    body_text = re.sub(r'\s+', ' ', ' '.join(text_parts)).strip()
+    return f"{title} {title} {title} {body_text}" if title else body_text
+
+
+def legacy_pipeline(content, url):
+    """Links, text, title and snippet the way the crawler used to get them."""
+    parser = fetcher.MyHTMLParser()
+    parser.feed(content)
+    parser.close()
+    links = parser.get_links(url)
+
+    text = legacy_extract_text_from_html(content)
+    words = tokenize(text)
+
+    title_match = re.search(r'<title[^>]*>(.*?)</title>', content, re.IGNORECASE | re.DOTALL)
+    if title_match:
+        title = html.unescape(re.sub(r'<[^>]+>', '', title_match.group(1)))
+        title = re.sub(r'\s+', ' ', title).strip()
+    else:
+        title = url
+    snippet = re.sub(r'\s+', ' ', text[:300].strip())
+    return links, title[:100], snippet, words
+
+
+def single_pass_pipeline(content, url):
+    page = extract_page(content, url)
+    return page['links'], page['title'], page['snippet'], tokenize(page['text'])
+
+
+def make_corpus(num_pages, seed=144):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(num_pages):
+        page = make_page(i, num_pages, rng)
+        if i % 10 == 0:
+            # Pad every tenth page with a large body
+            filler = ''.join(f'<section><h3>Part {j}</h3><p>{"caltech research " * 40}'
+                             f'<a href="/page/{j}">more</a></p></section>\n' for j in range(400))
+            page = page.replace('</main>', filler + '</main>')
+        corpus.append((f'http://127.0.0.1/page/{i}', page))
+    return corpus
+
+
+def bench(name, pipeline, corpus, rounds=3):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.process_time()
+        results = [pipeline(content, url) for url, content in corpus]
+        best = min(best, time.process_time() - start)
+    megabytes = sum(len(content) for _, content in corpus) / 1e6
+    print(f"{name:>12}: {len(corpus) / best:8.1f} pages/sec  {megabytes / best:6.1f} MB/sec")
+    return results, best
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    corpus = make_corpus(num_pages)
+    megabytes = sum(len(content) for _, content in corpus) / 1e6
+    print(f"Fixture corpus: {len(corpus)} pages, {megabytes:.1f} MB\n")
+
+    legacy, legacy_time = bench('legacy', legacy_pipeline, corpus)
+    single, single_time = bench('single pass', single_pass_pipeline, corpus)
+    print(f"\nSpeedup: {legacy_time / single_time:.2f}x")
+
+    # Sanity check: both pipelines should agree on links, titles and vocabulary
+    same_links = sum(set(a[0]) == set(b[0]) for a, b in zip(legacy, single))
+    same_titles = sum(a[1] == b[1] for a, b in zip(legacy, single))
+    same_words = sum(set(a[3]) == set(b[3]) for a, b in zip(legacy, single))
+    print(f"Identical links: {same_links}/{len(corpus)}, titles: {same_titles}/{len(corpus)}, "
+          f"vocabularies: {same_words}/{len(corpus)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Compare the scoring backends of SearchEngine (see SCORING_BACKEND in
+ranking_config.py) on a synthetic index, and check that they return exactly
+the same results.
+
+The corpus has a large vocabulary of rare words plus a few words that occur
+in most pages, so queries range from small candidate sets to nearly every
+page in the index.
+
+Usage:
+    python benchmarks/bench_search.py [num_pages]
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the project root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import search_util
+from src.doc_store import DOCS_FILE, DocStoreWriter
+from src.index_builder import IndexBuilder, write_index
+from src.postings import term_positions
+from src.search_util import SearchEngine
+
+COMMON_WORDS = ['the', 'of', 'and', 'caltech', 'research']
+
+
+def make_data(data_dir, num_pages, seed=0, texts=False):
+    """
+    Write the JSON data files of a random corpus of num_pages pages, and
+    with texts, the page texts (docs.bin).
+    """
+    rng = random.Random(seed)
+    vocabulary = [f'word{i}' for i in range(20000)]
+    builder = IndexBuilder(None)
+    docs = DocStoreWriter()
+    lengths = []
+    for page_id in range(num_pages):
+        words = rng.choices(vocabulary, k=rng.randint(50, 300))
+        # Common words are in most pages, more often in some than in others
+        for word, share in zip(COMMON_WORDS, (0.95, 0.9, 0.8, 0.6, 0.4)):
+            if rng.random() < share:
+                words += [word] * rng.randint(1, 8)
+        rng.shuffle(words)
+        builder.add(page_id, term_positions(words), len(words))
+        lengths.append(len(words))
+        if texts:
+            docs.add(page_id, ' '.join(words))
+    write_index(data_dir, builder.merged(), lengths)
+    if texts:
+        docs.write(f'{data_dir}/{DOCS_FILE}')
+    docs.close()
+
+    urls = [f'https://www.caltech.edu/page/{page_id}' for page_id in range(num_pages)]
+    with open(f'{data_dir}/urls.json', 'w') as f:
+        json.dump(urls, f)
+    with open(f'{data_dir}/page_info.json', 'w') as f:
+        json.dump({url: {'title': f'Page {page_id}', 'snippet': ''}
+                   for page_id, url in enumerate(urls)}, f)
+    # A few distinct PageRank values, so that ties are common
+    with open(f'{data_dir}/pagerank.json', 'w') as f:
+        json.dump({url: rng.choice((0.1, 0.2, 0.3, 1.0, 5.0)) / num_pages for url in urls}, f)
+
+
+def run(engine, queries, backend, scorer, repeat=3):
+    """Time the queries with one backend; returns (seconds per query, results)."""
+    search_util.SCORING_BACKEND = backend
+    search_util.TEXT_SCORER = scorer
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            results[query] = [(result['url'], result['score']) for result in engine.search(query)]
+    return (time.perf_counter() - start) / (repeat * len(queries)), results
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    data_dir = tempfile.mkdtemp(prefix='bench-search-')
+    try:
+        print(f"Building a synthetic index of {num_pages} pages...")
+        make_data(data_dir, num_pages)
+        with contextlib.redirect_stderr(io.StringIO()):
+            engine = SearchEngine(data_dir, cache_size=0)
+
+        rng = random.Random(1)
+        query_sets = {
+            'rare words': [f'word{rng.randrange(20000)} word{rng.randrange(20000)}'
+                           for _ in range(20)],
+            'rare + common': [f'word{rng.randrange(20000)} {rng.choice(COMMON_WORDS)}'
+                              for _ in range(20)],
+            'common words': [' '.join(rng.sample(COMMON_WORDS, rng.randint(1, 3)))
+                             for _ in range(20)],
+        }
+
+        print(f"\n{'scorer':>6} {'queries':>14} {'topk':>10} {'numpy':>10} {'speedup':>8}  identical")
+        for scorer in ('match', 'bm25'):
+            for name, queries in query_sets.items():
+                topk_time, topk_results = run(engine, queries, 'topk', scorer)
+                numpy_time, numpy_results = run(engine, queries, 'numpy', scorer)
+                print(f"{scorer:>6} {name:>14} {topk_time * 1000:8.2f}ms {numpy_time * 1000:8.2f}ms "
+                      f"{topk_time / numpy_time:7.1f}x  {topk_results == numpy_results}")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput and memory of the search service (serve.py) with
+different numbers of worker processes, on a synthetic index.
+
+Queries are sent by client processes over keep-alive connections, with the
+result cache disabled so every query is searched. Memory is the
+proportional set size (PSS) of the server processes together: pages of the
+memory-mapped index that several workers share are counted once overall,
+so it only grows by what each worker adds on top of the shared index.
+
+Usage:
+    python benchmarks/bench_service.py [num_pages] [max_processes]
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the project root importable when run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_search import COMMON_WORDS, make_data
+from src.index_store import sync_store
+from src.search_service import SearchClient
+
+CLIENTS = 8
+DURATION = 5.0
+
+
+def server_pss(pid):
+    """The PSS of a process and its children, in MB (Linux only)."""
+    pids = [pid]
+    with contextlib.suppress(OSError):
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    total = 0
+    for process in pids:
+        with open(f'/proc/{process}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    total += int(line.split()[1])
+    return total / 1024
+
+
+def client(url, seed, deadline, counts):
+    rng = random.Random(seed)
+    search = SearchClient(url)
+    done = 0
+    while time.time() < deadline:
+        search.search(f'word{rng.randrange(20000)} {rng.choice(COMMON_WORDS)}')
+        done += 1
+    search.close()
+    counts[seed] = done
+
+
+def wait_until_ready(url, timeout=60.0):
+    search = SearchClient(url)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return search.stats()
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+        finally:
+            search.close()
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    data_dir = tempfile.mkdtemp(prefix='bench-service-')
+    try:
+        print(f"Building a synthetic index of {num_pages} pages...")
+        make_data(data_dir, num_pages)
+        with contextlib.redirect_stdout(io.StringIO()):
+            sync_store(data_dir)
+
+        print(f"\n{'processes':>9} {'queries/s':>10} {'p50':>8} {'p99':>8} {'memory (PSS)':>13}")
+        port = 8150
+        processes = 1
+        while processes <= max_processes:
+            port += 1
+            url = f'http://127.0.0.1:{port}'
+            server = subprocess.Popen(
+                [sys.executable, 'serve.py', '--data-dir', data_dir, '--port', str(port),
+                 '--processes', str(processes), '--cache-size', '0'],
+                cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_ready(url)
+                with multiprocessing.Manager() as manager:
+                    counts = manager.dict()
+                    deadline = time.time() + DURATION
+                    clients = [multiprocessing.Process(target=client, args=(url, seed, deadline, counts))
+                               for seed in range(CLIENTS)]
+                    for process in clients:
+                        process.start()
+                    for process in clients:
+                        process.join()
+                    queries = sum(counts.values())
+                memory = server_pss(server.pid)
+                latency = wait_until_ready(url)['latency_seconds']
+                print(f"{processes:>9} {queries / DURATION:>10.0f} {latency['p50'] * 1000:>6.1f}ms "
+                      f"{latency['p99'] * 1000:>6.1f}ms {memory:>10.0f} MB")
+            finally:
+                server.terminate()
+                server.wait()
+            processes *= 2
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare searching a single index with searching it split into shards
+(see src/shards.py) on a synthetic index, and check that both return
+exactly the same results.
+
+The shards of one engine share a process, and with it the GIL, so their
+searches are only concurrent: the measured times do not drop with more
+shards. The "slowest shard" times are what a query would take with each
+shard searched in a process (or on a host) of its own: the time outside
+the shards plus, for every scatter, the time of the slowest shard.
+
+Usage:
+    python benchmarks/bench_shards.py [num_pages] [max_shards]
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the project root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import COMMON_WORDS, make_data
+from src import search_util
+from src.search_util import SearchEngine
+from src.shards import ShardedSearchEngine
+
+
+class TimedShards(ShardedSearchEngine):
+    """
+    A ShardedSearchEngine that searches its shards one after the other and
+    adds up the time the query would take with every shard searched in
+    parallel (see the module docstring).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parallel_time = 0.0
+
+    def _scatter(self, function, *iterables):
+        results = []
+        times = []
+        for arguments in zip(*iterables):
+            start = time.perf_counter()
+            results.append(function(*arguments))
+            times.append(time.perf_counter() - start)
+        self.parallel_time -= sum(times) - max(times, default=0.0)
+        return results
+
+
+def run(engine, queries, repeat=3):
+    """Time the queries; returns (seconds per query, results)."""
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            results[query] = [(result['url'], result['score']) for result in engine.search(query)]
+    return (time.perf_counter() - start) / (repeat * len(queries)), results
+
+
+def run_slowest_shard(engine, queries, repeat=3):
+    """
+    The seconds per query of a TimedShards engine with every shard searched
+    in parallel.
+    """
+    engine.parallel_time = 0.0
+    seconds, _ = run(engine, queries, repeat)
+    return seconds + engine.parallel_time / (repeat * len(queries))
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_shards = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    data_dir = tempfile.mkdtemp(prefix='bench-shards-')
+    try:
+        print(f"Building a synthetic index of {num_pages} pages...")
+        make_data(data_dir, num_pages)
+        rng = random.Random(1)
+        queries = ([f'word{rng.randrange(20000)} {rng.choice(COMMON_WORDS)}' for _ in range(20)]
+                   + [' '.join(rng.sample(COMMON_WORDS, rng.randint(1, 3))) for _ in range(20)])
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            engines = {1: SearchEngine(data_dir, cache_size=0)}
+            timed = {}
+            num_shards = 2
+            while num_shards <= max_shards:
+                # A directory of its own, as resharding replaces the shards of a directory
+                shard_dir = os.path.join(data_dir, f'{num_shards}-shards')
+                shutil.copytree(data_dir, shard_dir,
+                                ignore=lambda path, names: [name for name in names
+                                                            if not name.endswith('.json')])
+                engines[num_shards] = ShardedSearchEngine(shard_dir, num_shards, cache_size=0)
+                timed[num_shards] = TimedShards(shard_dir, num_shards, cache_size=0)
+                num_shards *= 2
+
+        labels = ['1 index'] + [f'{k} shards' for k in list(engines)[1:]]
+        print(f"\n{'scorer':>6} {'backend':>7} {'':>14} " + ' '.join(f'{label:>11}' for label in labels)
+              + "  identical")
+        for scorer in ('match', 'bm25'):
+            for backend in ('topk', 'numpy'):
+                search_util.TEXT_SCORER = scorer
+                search_util.SCORING_BACKEND = backend
+                times, results = zip(*(run(engine, queries) for engine in engines.values()))
+                slowest = [times[0]] + [run_slowest_shard(engine, queries) for engine in timed.values()]
+                print(f"{scorer:>6} {backend:>7} {'measured':>14} "
+                      + ' '.join(f'{seconds * 1000:9.2f}ms' for seconds in times)
+                      + f"  {all(result == results[0] for result in results)}")
+                print(f"{'':>6} {'':>7} {'slowest shard':>14} "
+                      + ' '.join(f'{seconds * 1000:9.2f}ms' for seconds in slowest))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
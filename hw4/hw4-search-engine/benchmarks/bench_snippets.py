@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of query-dependent snippets (see src/snippets.py) on a
+synthetic index: the time a search spends making the snippets of its
+results, reading page texts from the block-compressed document store (see
+src/doc_store.py), against the time of the whole search.
+
+It is measured twice: with the synthetic pages as they are (a few KB of
+text each), and with every page as long as the store keeps
+(MAX_TEXT_LENGTH characters), the worst case. Snippets of random texts
+and of edge cases (e.g. a query word longer than a snippet) are checked
+first: they must fit in SNIPPET_LENGTH and highlight only query words. So
+is the page content snippets are made from: each passage of a page with
+nested markup must be in it exactly once, in page order.
+
+Usage:
+    python benchmarks/bench_snippets.py [num_pages]
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the project root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import COMMON_WORDS, make_data
+from src.doc_store import DOCS_FILE, MAX_TEXT_LENGTH, DocStore, DocStoreWriter
+from src.indexer import extract_page
+from src.search_util import SearchEngine
+from src.snippets import ELLIPSIS, SNIPPET_LENGTH, make_snippet
+
+QUERIES = 200
+CHECKS = 2000
+
+
+def check_snippets():
+    """Check make_snippet() on edge cases and random texts; returns the number of snippets checked."""
+    long_word = 'x' * (SNIPPET_LENGTH + 1)
+    cases = [
+        ('see ' + long_word + ' end', [long_word]),
+        (long_word * 3, [long_word * 3]),
+        (long_word + ' foo', ['foo', long_word]),
+        ('', ['foo']),
+        ('no match here', ['foo']),
+        ('the of and', ['the']),
+    ]
+    rng = random.Random(2)
+    vocabulary = ['foo', 'bar', 'baz', 'the', 'of', 'x' * 50, 'y' * 300]
+    for _ in range(CHECKS):
+        text = ' '.join(rng.choice(vocabulary) for _ in range(rng.randrange(200)))
+        cases.append((text, rng.sample(vocabulary, rng.randrange(1, 4))))
+
+    for text, query_words in cases:
+        snippet, highlights = make_snippet(text, query_words)
+        assert len(snippet) <= SNIPPET_LENGTH + 2 * len(ELLIPSIS), (text, query_words)
+        for start, end in highlights:
+            assert snippet[start:end].lower() in query_words, (text, query_words)
+    return len(cases)
+
+
+def check_content():
+    """
+    Check that extract_page() puts each passage of pages with nested markup
+    in the content once, in page order; returns the number of pages checked.
+    """
+    cases = [
+        ('<main><h1>Head one</h1><section><p>alpha beta.</p><p>gamma delta.</p></section>'
+         '<ul><li>item one</li></ul></main>',
+         ['Head one', 'alpha beta.', 'gamma delta.', 'item one']),
+        ('<article><section><h2>Sub head</h2><p>first para<p>second para</section>'
+         '<ol><li>one<li><p>two</p></ol></article>',
+         ['Sub head', 'first para', 'second para', 'one', 'two']),
+        ('<body><section>loose text <b>bold</b><p>inner</p>after</section></body>',
+         ['loose text bold', 'inner', 'after']),
+        ('<body><div>no semantic <i>markup</i> at all</div></body>',
+         ['no semantic markup at all']),
+    ]
+    for html, passages in cases:
+        content = extract_page(html)['content']
+        assert content == ' '.join(passages), (html, content)
+    return len(cases)
+
+
+def lengthen_texts(data_dir):
+    """Repeat the text of every page up to MAX_TEXT_LENGTH characters."""
+    path = os.path.join(data_dir, DOCS_FILE)
+    store = DocStore.open(path)
+    writer = DocStoreWriter()
+    try:
+        for doc_id in list(store.doc_ids):
+            text = store.get(doc_id)
+            writer.add(doc_id, (text + ' ') * (MAX_TEXT_LENGTH // (len(text) + 1) + 1))
+    finally:
+        store.close()
+    writer.write(path)
+    writer.close()
+
+
+def measure(data_dir, queries):
+    with contextlib.redirect_stderr(io.StringIO()):
+        engine = SearchEngine(data_dir, cache_size=0)
+    start = time.perf_counter()
+    for query in queries:
+        engine.search(query)
+    search_seconds = (time.perf_counter() - start) / len(queries)
+    stats = engine.snippet_stats()
+    seconds = stats['seconds']
+    print(f"{stats['characters'] / max(stats['snippets'], 1):>14.0f} "
+          f"{search_seconds * 1000:>10.2f}ms {seconds['mean'] * 1000:>10.2f}ms "
+          f"{seconds['p99'] * 1000:>9.2f}ms {seconds['mean'] / search_seconds:>9.0%}")
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"Checked {check_snippets()} snippets")
+    print(f"Checked the content of {check_content()} pages with nested markup")
+
+    data_dir = tempfile.mkdtemp(prefix='bench-snippets-')
+    try:
+        print(f"Building a synthetic index of {num_pages} pages...")
+        make_data(data_dir, num_pages, texts=True)
+        rng = random.Random(1)
+        queries = [f'word{rng.randrange(20000)} {rng.choice(COMMON_WORDS)}' for _ in range(QUERIES)]
+        print(f"\nSnippets of the top 10 results, {QUERIES} queries:")
+        print(f"{'chars per page':>14} {'search':>12} {'snippets':>12} {'p99 (<=)':>11} {'share':>9}")
+        measure(data_dir, queries)
+        lengthen_texts(data_dir)
+        measure(data_dir, queries)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
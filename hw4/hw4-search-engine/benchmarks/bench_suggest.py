@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Measure how long it takes to compute the autocomplete suggestions (see
+src/suggest.py) of a synthetic index and to look up completions, and check
+the completions against a scan of the whole vocabulary.
+
+Usage:
+    python benchmarks/bench_suggest.py [num_pages]
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the project root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import make_data
+from src.search_util import SearchEngine
+
+LOOKUPS = 20000
+
+
+def scan(suggester, prefix, n):
+    """The completions of prefix found by scoring every word, best first."""
+    matches = [(-float(suggester.scores[i]), i) for i in range(len(suggester))
+               if suggester.words.word(i).startswith(prefix)]
+    return [suggester.words.word(i) for _, i in sorted(matches)[:n]]
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    data_dir = tempfile.mkdtemp(prefix='bench-suggest-')
+    try:
+        print(f"Building a synthetic index of {num_pages} pages...")
+        make_data(data_dir, num_pages)
+        with contextlib.redirect_stderr(io.StringIO()):
+            engine = SearchEngine(data_dir, cache_size=0)
+            start = time.perf_counter()
+            engine.suggest('')
+            build = time.perf_counter() - start
+        suggester = engine._suggester
+        size = os.path.getsize(os.path.join(data_dir, 'suggestions.npz'))
+        print(f"Suggestions of {len(suggester)} words computed in {build:.2f}s "
+              f"({size / 1024:.0f} KB on disk)")
+
+        start = time.perf_counter()
+        engine._suggester = None
+        engine.suggest('')
+        print(f"Loaded from disk in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        rng = random.Random(1)
+        words = [suggester.words.word(i) for i in range(len(suggester))]
+        print(f"\n{'prefix length':>13} {'mean':>9} {'p99':>9}  same as scan")
+        for length in range(0, 6):
+            prefixes = [rng.choice(words)[:length] for _ in range(LOOKUPS // 6)]
+            times = []
+            for prefix in prefixes:
+                start = time.perf_counter()
+                engine.suggest(prefix)
+                times.append(time.perf_counter() - start)
+            times.sort()
+            same = all([suggestion['word'] for suggestion in engine.suggest(prefix)]
+                       == scan(suggester, prefix, 10) for prefix in prefixes[:20])
+            print(f"{length:>13} {sum(times) / len(times) * 1e6:>7.1f}us "
+                  f"{times[int(len(times) * 0.99)] * 1e6:>7.1f}us  {same}")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+A synthetic website served from localhost, for exercising the crawler
+without touching the real Caltech servers.
+
+The site is deterministic for a given number of pages and seed: every page
+has a title, headings, navigation, paragraphs and list items drawn from a
+small vocabulary, and links to a handful of other pages on the site.
+"""
+
+import gzip
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Make the project root importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import Crawler
+
+VOCABULARY = (
+    "caltech research student faculty physics biology chemistry engineering "
+    "computer science mathematics seminar lecture course admissions campus "
+    "laboratory graduate undergraduate institute pasadena astronomy network "
+    "pagerank graph search engine theory systems data learning"
+).split()
+
+
+def make_page(i, num_pages, rng):
+    """Generate the HTML for page `i` of the site."""
+    def sentence(n):
+        return ' '.join(rng.choice(VOCABULARY) for _ in range(n)).capitalize() + '.'
+
+    links = sorted(set(rng.randrange(num_pages) for _ in range(rng.randint(2, 8))))
+    link_html = '\n'.join(f'<li><a href="/page/{j}">{sentence(3)}</a></li>' for j in links)
+    paragraphs = '\n'.join(f'<p>{sentence(rng.randint(20, 60))}</p>' for _ in range(rng.randint(3, 10)))
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<title>Page {i} &amp; {sentence(4)}</title>
+<style>body {{ font-family: sans-serif; }}</style>
+<script>var page = {i};</script>
+</head>
+<body>
+<nav><a href="/page/0">Home</a> <a href="/page/{(i + 1) % num_pages}">Next</a></nav>
+<main>
+<h1>{sentence(5)}</h1>
+<section>
+<h2>{sentence(3)}</h2>
+{paragraphs}
+</section>
+<ul>
+{link_html}
+</ul>
+</main>
+<footer>Copyright {sentence(4)}</footer>
+</body>
+</html>
+"""
+
+
+class SyntheticSite:
+    """
+    Serve `num_pages` generated pages at http://127.0.0.1:<port>/page/<i>.
+    `latency` seconds are added to every response to mimic a remote server.
+
+    The server speaks HTTP/1.1 with keep-alive, gzip-compresses responses
+    when asked to, and answers conditional requests with ETags. It counts
+    requests, connections and body bytes sent. If `robots` is given it is
+    served as /robots.txt.
+    """
+
+    def __init__(self, num_pages=200, latency=0.0, seed=144, robots=None):
+        rng = random.Random(seed)
+        self.pages = [make_page(i, num_pages, rng).encode('utf-8') for i in range(num_pages)]
+        self.latency = latency
+        self.robots = robots
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self.not_modified = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/page/0"
+
+    def start(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this, Nagle's
+            # algorithm stalls every keep-alive response on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                site.connections += 1
+
+            def do_GET(self):
+                site.requests += 1
+                if site.latency:
+                    time.sleep(site.latency)
+                if self.path == '/robots.txt' and site.robots is not None:
+                    body = site.robots.encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                try:
+                    i = int(self.path.rstrip('/').rsplit('/', 1)[1])
+                    body = site.pages[i]
+                except (ValueError, IndexError):
+                    self.send_error(404)
+                    return
+
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    site.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('ETag', etag)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                site.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class LocalCrawler(Crawler):
+    """A Crawler that stays on the synthetic site instead of caltech.edu."""
+
+    def normalize_url(self, url):
+        # Keep the plain-http scheme, since the local server has no TLS
+        url = url.split('#')[0].rstrip('/')
+        if not url.startswith('http://') and not url.startswith('https://'):
+            url = 'http://' + url
+        return url
+
+    def is_valid_caltech_url(self, url):
+        return urlparse(url).netloc == urlparse(self.seed).netloc
+
+
+if __name__ == "__main__":
+    # Serve the site until interrupted, e.g. to point crawl experiments at it
+    with SyntheticSite(num_pages=int(sys.argv[1]) if len(sys.argv) > 1 else 200) as site:
+        print(f"Serving {len(site.pages)} pages at {site.url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -3,12 +3,16 @@
 Compute PageRank scores for the crawled web graph and save them.
 
 Run this after crawling to compute PageRank scores for all pages.
-The scores will be saved to data/pagerank.json for use by the search engine.
+The scores will be saved to data/pagerank.json, and copied into the
+segmented search index in data/index/ (which is built from the other data
+files first if needed) for use by the search engine.
 """
 
 import json
 import sys
 from src import compute_pagerank
+from src.url_table import load_graph
+from src.index_store import INDEX_DIR, sync_store
 
 
 def main():
@@ -16,10 +20,10 @@ def main():
 
     print("Loading web graph...")
     try:
-        with open(f"{data_dir}/graph.json", "r") as f:
-            graph = json.load(f)
+        # graph.json stores page IDs; map them back to URLs via urls.json
+        graph = load_graph(data_dir)
     except FileNotFoundError:
-        print(f"Error: {data_dir}/graph.json not found!")
+        print(f"Error: {data_dir}/graph.json or {data_dir}/urls.json not found!")
         print("Please run the crawler first to generate the web graph.")
         print("  python crawl.py")
         sys.exit(1)
@@ -55,6 +59,11 @@ def main():
         tot_score += score
     print(f"Total score: {tot_score}")
 
+    # Update the index the search engine reads
+    print()
+    sync_store(data_dir, log=print)
+    print(f"Search index saved to {data_dir}/{INDEX_DIR}/")
+
 
 
 if __name__ == "__main__":
@@ -4,34 +4,151 @@ Run the web crawler to build the web graph.
 
 This script crawls the Caltech domain and saves the resulting graph
 to data/graph.json for use by the search engine.
+
+Usage:
+    python crawl.py [seed_url] [max_pages]
+    python crawl.py --async --concurrency 32 --per-host 4
+    python crawl.py --pipeline --concurrency 32 --processes 8
+    python crawl.py --resume            # continue an interrupted crawl
+    python crawl.py --recrawl           # refresh pages that are due for a check
+    python crawl.py --reindex           # rebuild the index from the page cache
 """
 
+import argparse
 import sys
-from src import Crawler
+from src import Crawler, build_index_files
+from src.metrics import CrawlMetrics
+from src.url_table import load_graph
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl the Caltech domain.")
+    parser.add_argument('seed_url', nargs='?', default="http://www.caltech.edu/")
+    parser.add_argument('max_pages', nargs='?', type=int, default=None,
+                        help="pages to crawl (default 5000), or to recheck with --recrawl "
+                             "(default: all that are due)")
+    parser.add_argument('--delay', type=float, default=0.1,
+                        help="minimum seconds between requests to the same host")
+    parser.add_argument('--ignore-robots', action='store_true',
+                        help="do not check robots.txt (disallowed paths and Crawl-delay)")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help="fetch many pages concurrently instead of one at a time")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="fetch on threads and parse on a pool of processes")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="maximum requests in flight (async and pipeline modes)")
+    parser.add_argument('--per-host', type=int, default=2,
+                        help="maximum requests in flight per host (async mode)")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="parse processes (pipeline and reindex modes, default: one per core)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="do not keep fetched pages in data/cache")
+    parser.add_argument('--max-page-size', type=float, default=5.0, metavar='MB',
+                        help="skip pages larger than this (after decompression)")
+    parser.add_argument('--index-memory', type=float, default=256.0, metavar='MB',
+                        help="flush the in-memory index to a sorted segment on disk past this size")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="index near-duplicate pages instead of recording them as aliases")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the crawl recorded in data/crawl_log.jsonl")
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help="seconds between snapshots appended to data/crawl_metrics.jsonl")
+    parser.add_argument('--prometheus', metavar='PATH', default=None,
+                        help="also write metrics to PATH in the Prometheus text format")
+    parser.add_argument('--recrawl', action='store_true',
+                        help="refetch the pages in data/ that are due for a freshness check "
+                             "and update only what changed")
+    parser.add_argument('--reindex', action='store_true',
+                        help="rebuild the index and page info of the pages in data/ from the "
+                             "page cache, without crawling")
+    return parser.parse_args()
+
+
+def recrawl(args, data_dir):
+    crawler = Crawler(cache_dir=None if args.no_cache else f'{data_dir}/cache',
+                      respect_robots=not args.ignore_robots,
+                      max_page_size=int(args.max_page_size * 1024 * 1024))
+    try:
+        graph_changed = crawler.recrawl(data_dir, delay=args.delay, concurrency=args.concurrency,
+                                        max_pages=args.max_pages)
+    except KeyboardInterrupt:
+        print("\n\nRecrawl interrupted. No files were changed.")
+        sys.exit(1)
+
+    if graph_changed:
+        print("\nThe graph changed. Next step:")
+        print("  python compute_pagerank.py  (update PageRank scores)")
+
+
+def reindex(args, data_dir):
+    try:
+        graph = load_graph(data_dir)
+    except FileNotFoundError:
+        print(f"Error: {data_dir}/graph.json or {data_dir}/urls.json not found!")
+        print("Please run a crawl first.")
+        sys.exit(1)
+
+    build_index_files(graph, data_dir, use_cache=not args.no_cache,
+                      memory_budget=int(args.index_memory * 1024 * 1024),
+                      processes=args.processes)
+
+    print("\nReindexing complete! The search engine picks up the new index on its next start.")
 
 
 def main():
-    seed_url = "http://www.caltech.edu/"
-    max_pages = 5000
-    delay = 0.001
-    
-    # Accept command-line arguments for seed URL and max pages
-    if len(sys.argv) > 1:
-        seed_url = sys.argv[1]
-    if len(sys.argv) > 2:
-        max_pages = int(sys.argv[2])
-    
+    args = parse_args()
+    data_dir = 'data'
+
+    if args.recrawl:
+        recrawl(args, data_dir)
+        return
+    if args.reindex:
+        reindex(args, data_dir)
+        return
+    if args.max_pages is None:
+        args.max_pages = 5000
+
     print("=" * 80)
     print("Caltech Web Crawler")
     print("=" * 80)
-    print(f"Seed URL: {seed_url}")
-    print(f"Max pages: {max_pages}")
-    print(f"Delay: {delay}s\n")
-    
-    crawler = Crawler(seed_url=seed_url, max_pages=max_pages)
-    crawler.crawl(delay=delay)
-    crawler.save_results()
-    
+    print(f"Seed URL: {args.seed_url}")
+    print(f"Max pages: {args.max_pages}")
+    print(f"Delay: {args.delay}s per host")
+    if args.async_mode:
+        print(f"Mode: async (concurrency {args.concurrency}, per host {args.per_host})")
+    elif args.pipeline:
+        print(f"Mode: pipeline (fetch threads {args.concurrency})")
+    print()
+
+    crawler = Crawler(seed_url=args.seed_url, max_pages=args.max_pages, log_dir=data_dir,
+                      cache_dir=None if args.no_cache else f'{data_dir}/cache',
+                      respect_robots=not args.ignore_robots,
+                      detect_duplicates=not args.keep_duplicates,
+                      max_page_size=int(args.max_page_size * 1024 * 1024),
+                      index_memory=int(args.index_memory * 1024 * 1024),
+                      metrics=CrawlMetrics(f'{data_dir}/crawl_metrics.jsonl', args.prometheus,
+                                           interval=args.metrics_interval))
+    if args.resume:
+        if crawler.log.exists():
+            crawler.resume()
+        else:
+            print("No crawl log found, starting a new crawl.\n")
+
+    try:
+        if args.async_mode:
+            crawler.crawl_async(delay=args.delay, concurrency=args.concurrency,
+                                per_host=args.per_host)
+        elif args.pipeline:
+            crawler.crawl_pipelined(delay=args.delay, fetch_workers=args.concurrency,
+                                    parse_processes=args.processes)
+        else:
+            crawler.crawl(delay=args.delay)
+    except KeyboardInterrupt:
+        print("\n\nCrawl interrupted. Progress has been saved; continue with:")
+        print("  python crawl.py --resume")
+        sys.exit(1)
+    crawler.save_results(data_dir)
+
     print("\nCrawl and indexing complete! Next step:")
     print("  python compute_pagerank.py  (compute PageRank scores)")
 
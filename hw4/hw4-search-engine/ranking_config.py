@@ -17,8 +17,33 @@ Here are some suggestions for exploring the parameter space:
 4. Less distinction between meaningful and stop words:
     MEANINGFUL_WORD_WEIGHT = 2.0
     STOP_WORD_WEIGHT = 1.0
+5. Rank by BM25 instead of counting matched words:
+    TEXT_SCORER = 'bm25'
 """
 
+# TEXT SCORER
+# How text relevance is computed from the index:
+#   'match': the fraction of query words a page contains, with the word
+#            weights, bonuses and penalty below
+#   'bm25':  Okapi BM25, from how often each query word occurs in the page,
+#            how rare it is across pages and the length of the page
+TEXT_SCORER = 'match'
+
+# BM25 PARAMETERS (only used with TEXT_SCORER = 'bm25')
+# BM25_K1: how quickly repeated occurrences of a word stop adding to the score
+#          (0 = only presence counts; typical range 1.2 to 2.0)
+# BM25_B:  how much long pages are penalized (0 = not at all, 1 = fully)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# SCORING BACKEND
+# How the best results are found (both give exactly the same results):
+#   'topk':  walk the posting lists with a heap of the best pages so far,
+#            skipping pages that cannot make it (fastest for most queries)
+#   'numpy': score every page containing a query word at once with NumPy
+#            (faster when the query words occur in a large share of the pages)
+SCORING_BACKEND = 'topk'
+
 # WORD WEIGHTING
 # How much to weight meaningful (non-stop) words vs stop words
 # Higher values mean meaningful words have more impact on ranking
@@ -5,14 +5,19 @@ Command-line interface for the Bernoulli search engine.
 Usage:
     python search.py                    # Interactive mode
     python search.py "your query"       # Single query mode
+    python search.py --shards 4 ["your query"]
+                                        # Search an index split into 4 shards
+    python search.py --server http://127.0.0.1:8144 ["your query"]
+                                        # Query a running serve.py instead
 
 Remember that for extra credit, you may wish to build a
 user interface for the search engine.
 """
+import argparse
 import sys
 import re
 import os
-from src import SearchEngine
+from src.search_service import SearchClient, open_engine
 
 class Colors:
     HEADER = '\033[95m'
@@ -44,6 +49,18 @@ def highlight_text(text, query_words):
     return re.sub(f'({pattern})', highlight_match, text, flags=re.IGNORECASE)
 
 
+def highlight_spans(text, spans):
+    """Highlight the (start, end) spans of text that match the query, as found by the engine."""
+    parts = []
+    previous = 0
+    for start, end in spans:
+        parts.append(text[previous:start])
+        parts.append(f"{Colors.YELLOW}{Colors.BOLD}{text[start:end]}{Colors.END}")
+        previous = end
+    parts.append(text[previous:])
+    return ''.join(parts)
+
+
 def format_url(url, max_length=70):
     """Format URL, truncating if too long."""
     if len(url) <= max_length:
@@ -79,9 +96,12 @@ def print_results(results, query):
         # Snippet
         if result['snippet']:
             snippet = result['snippet']
-            if len(snippet) > 200:
-                snippet = snippet[:197] + "..."
-            snippet = highlight_text(snippet, query_words)
+            if result.get('highlights'):
+                snippet = highlight_spans(snippet, result['highlights'])
+            else:
+                if len(snippet) > 200:
+                    snippet = snippet[:197] + "..."
+                snippet = highlight_text(snippet, query_words)
             print(f"   {snippet}")
         
         # Score and PageRank
@@ -90,12 +110,41 @@ def print_results(results, query):
     print(f"\n{Colors.DIM}{'─' * 80}{Colors.END}\n")
 
 
+def enable_completion(engine):
+    """Complete the word being typed from the index vocabulary on Tab, if readline is available."""
+    try:
+        import readline
+    except ImportError:
+        return False
+    matches = []
+
+    def complete(text, state):
+        if state == 0:
+            matches[:] = []
+            if text:
+                try:
+                    matches.extend(suggestion['word'] for suggestion in engine.suggest(text))
+                except OSError:
+                    pass
+        return matches[state] if state < len(matches) else None
+
+    readline.set_completer(complete)
+    readline.set_completer_delims(' \t\n"')
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind('bind ^I rl_complete')
+    else:
+        readline.parse_and_bind('tab: complete')
+    return True
+
+
 def interactive_mode(engine):
     """Run Bernoulli in interactive mode."""
     print(f"\n{Colors.BOLD}{Colors.ORANGE}{'═' * 80}{Colors.END}")
     print(f"{Colors.BOLD}{Colors.ORANGE}  Bernoulli: Search Anything Caltech!{Colors.END}")
     print(f"{Colors.BOLD}{Colors.ORANGE}{'═' * 80}{Colors.END}")
     print(f"{Colors.DIM}Enter search queries (or 'quit'/'exit'/'q' to stop){Colors.END}")
+    if enable_completion(engine):
+        print(f"{Colors.DIM}Press Tab to complete a word{Colors.END}")
     print(f"{Colors.DIM}Press Ctrl+C to exit{Colors.END}\n")
     
     query_count = 0
@@ -116,10 +165,27 @@ def interactive_mode(engine):
                 print(f"\n{Colors.ORANGE}{Colors.BOLD}Help:{Colors.END}")
                 print(f"  {Colors.DIM}• Enter a search query to find pages{Colors.END}")
                 print(f"  {Colors.DIM}• Type 'quit', 'exit', or 'q' to exit{Colors.END}")
+                print(f"  {Colors.DIM}• Press Tab to complete the word you are typing{Colors.END}")
+                print(f"  {Colors.DIM}• Type 'stats' to see result cache hits and snippet timings{Colors.END}")
                 print(f"  {Colors.DIM}• Type 'help' or '?' for this message{Colors.END}")
                 print()
                 continue
             
+            # Result cache statistics
+            if query.lower() == 'stats':
+                stats = engine.cache_stats()
+                hit_rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else "-"
+                print(f"\n{Colors.ORANGE}{Colors.BOLD}Result cache:{Colors.END} "
+                      f"{stats['hits']} hits, {stats['misses']} misses ({hit_rate}), "
+                      f"{stats['entries']}/{stats['max_entries']} queries cached")
+                stats = engine.snippet_stats()
+                seconds = stats['seconds']
+                timing = (f", {seconds['mean'] * 1000:.2f}ms per search (p99 under "
+                          f"{seconds['p99'] * 1000:g}ms)" if seconds['count'] else "")
+                print(f"{Colors.ORANGE}{Colors.BOLD}Snippets:{Colors.END} "
+                      f"{stats['snippets']} made from {stats['characters']} characters{timing}\n")
+                continue
+            
             # Show searching indicator
             print(f"{Colors.DIM}Searching...{Colors.END}", end='', flush=True)
             
@@ -139,11 +205,46 @@ def interactive_mode(engine):
             break
 
 
+def run(engine, query_words):
+    """Run a command-line query, or interactive mode if there is none."""
+    if query_words:
+        query = " ".join(query_words)
+        print(f"{Colors.DIM}Searching...{Colors.END}", end='', flush=True)
+        results = engine.search(query)
+        print(f"\r{Colors.DIM}{' ' * 20}\r{Colors.END}", end='')
+        print_results(results, query)
+    else:
+        interactive_mode(engine)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Search the Caltech domain.")
+    parser.add_argument('query', nargs='*', help="query to run (default: interactive mode)")
+    parser.add_argument('--server', metavar='URL', default=None,
+                        help="send queries to a search service started with serve.py")
+    parser.add_argument('--shards', type=int, default=None, metavar='K',
+                        help="split the index into K document-partitioned shards")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    
+    if args.server:
+        engine = SearchClient(args.server)
+        try:
+            run(engine, args.query)
+        except (OSError, RuntimeError) as e:
+            print(f"{Colors.RED}Error querying {args.server}: {e}{Colors.END}")
+            sys.exit(1)
+        finally:
+            engine.close()
+        return
+    
     # Verify that data files exist
     data_dir = 'data'
     
-    required_files = ['index.json', 'pagerank.json', 'page_info.json']
+    required_files = ['urls.json', 'index.json', 'positions.json', 'pagerank.json', 'page_info.json']
     missing = [f for f in required_files if not os.path.exists(f'{data_dir}/{f}')]
     
     if missing:
@@ -158,20 +259,12 @@ def main():
     
     # Initialize Bernoulli
     try:
-        engine = SearchEngine(data_dir)
+        engine = open_engine(data_dir, num_shards=args.shards)
     except Exception as e:
         print(f"{Colors.RED}Error loading search engine: {e}{Colors.END}")
         sys.exit(1)
     
-    # Check for command-line queries or interactive mode
-    if len(sys.argv) > 1:
-        query = " ".join(sys.argv[1:])
-        print(f"{Colors.DIM}Searching...{Colors.END}", end='', flush=True)
-        results = engine.search(query)
-        print(f"\r{Colors.DIM}{' ' * 20}\r{Colors.END}", end='')
-        print_results(results, query)
-    else:
-        interactive_mode(engine)
+    run(engine, args.query)
 
 
 if __name__ == "__main__":
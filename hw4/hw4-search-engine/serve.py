@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Run Bernoulli as a long-running local HTTP/JSON search service.
+
+The index is opened once, and queries are answered concurrently over
+keep-alive connections (see src/search_service.py for the endpoints).
+With --processes N, N worker processes share the listening socket and one
+memory-mapped copy of the index, so throughput scales with cores.
+
+Usage:
+    python serve.py                         # http://127.0.0.1:8144/
+    python serve.py --port 9000 --threads 8
+    python serve.py --processes 4           # one worker process per core
+    python serve.py --shards 4              # search 4 index shards in parallel
+    curl 'http://127.0.0.1:8144/search?q=caltech&page=2&per_page=10'
+    curl 'http://127.0.0.1:8144/stats'
+    python search.py --server http://127.0.0.1:8144 "your query"
+"""
+
+import argparse
+import sys
+from src.query_cache import DEFAULT_CACHE_SIZE
+from src.search_service import DEFAULT_PORT, open_engine, run_service, run_workers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve searches over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on (default: localhost only)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on (default {DEFAULT_PORT}, 0 for any free port)")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="worker processes sharing the index (0: one per core)")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="searches that can run at the same time (per process)")
+    parser.add_argument('--shards', type=int, default=None, metavar='K',
+                        help="split the index into K document-partitioned shards")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help="distinct queries whose results are cached (0 to disable)")
+    parser.add_argument('--data-dir', default='data',
+                        help="directory with the crawler's data files")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.processes != 1:
+        run_workers(args.data_dir, args.host, args.port, args.processes, args.threads,
+                    args.cache_size, args.shards)
+        return
+    try:
+        engine = open_engine(args.data_dir, args.cache_size, args.shards)
+    except Exception as e:
+        print(f"Error loading search engine: {e}")
+        print("Run crawl.py and compute_pagerank.py first.")
+        sys.exit(1)
+    run_service(engine, args.host, args.port, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ This package contains all the core components:
 
 from .crawler import Crawler
 from .pagerank import compute_pagerank
-from .indexer import build_index
+from .indexer import build_index, build_index_files
 from .search_util import SearchEngine
 
-__all__ = ['Crawler', 'compute_pagerank', 'build_index', 'SearchEngine']
+__all__ = ['Crawler', 'compute_pagerank', 'build_index', 'build_index_files', 'SearchEngine']
@@ -0,0 +1,318 @@
+"""
+Memory-mapped binary index segments.
+
+A segment holds the positional index and the records of a set of pages, in
+a single file opened with mmap: opening it only reads a small header, and a
+query only touches the lexicon entries and posting lists of its own words
+and the records of the pages it returns. The search index is made of one or
+more segments (see index_store.py).
+
+Within a segment, pages are numbered 0..num_docs-1 in page ID order (their
+local number); posting lists refer to pages by local number, and the
+doc_ids section maps them back to page IDs.
+
+The file starts with a header (magic, byte order, counts and the offset and
+length of each section), followed by these sections, each 8-byte aligned:
+
+    doc_ids            uint32[num_docs]       page ID of each local page number
+    word_offsets       uint64[num_words + 1]  where each word starts in `words`
+    words              the words in sorted order, UTF-8, back to back
+    doc_freqs          uint32[num_words]      number of pages per word
+    postings_offsets   uint64[num_words + 1]  where each word's postings start
+    postings           per word: local page number gaps, then term frequencies (varints)
+    positions_offsets  uint64[num_words + 1]  where each word's positions start
+    positions          per word and page: position gaps (varints)
+    doc_lengths        uint32[num_docs]       page lengths in words
+    doc_offsets        uint64[num_docs + 1]   where each page's record starts
+    docs               per page: JSON [url, title, snippet], UTF-8
+    texts              the text of each page by local number, as a document store
+                       (see doc_store.py)
+
+Gaps are the differences between consecutive page numbers (or positions),
+which are small for all but the rarest words, and varints store small
+numbers in a single byte. Fixed-width arrays are in the machine's native
+byte order.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from .doc_store import DocStore, DocStoreWriter
+
+# Version of the file format, which stores built with another one are rebuilt for
+FORMAT = 2
+_MAGIC = b'BRNSEG%02d' % FORMAT
+_SECTIONS = ('doc_ids', 'word_offsets', 'words', 'doc_freqs', 'postings_offsets', 'postings',
+             'positions_offsets', 'positions', 'doc_lengths', 'doc_offsets', 'docs', 'texts')
+# magic, byte order, number of pages, number of words, total length of all pages,
+# then the (offset, length) of each section
+_HEADER = struct.Struct(f'<8sBxxxxxxxQQQ{2 * len(_SECTIONS)}Q')
+_BYTE_ORDERS = {'little': 0, 'big': 1}
+
+
+def encode_varints(numbers, out):
+    """Append numbers to a bytearray as varints (7 bits per byte, high bit = more bytes follow)."""
+    for n in numbers:
+        while n >= 0x80:
+            out.append((n & 0x7f) | 0x80)
+            n >>= 7
+        out.append(n)
+
+
+def decode_varints(data):
+    """Decode a bytes-like object holding only varints into a list of numbers."""
+    data = bytes(data)
+    if not data or max(data) < 0x80:
+        return list(data)  # every number fits in one byte
+    numbers = []
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(n)
+            n = shift = 0
+    return numbers
+
+
+def _gaps(numbers):
+    previous = 0
+    for n in numbers:
+        yield n - previous
+        previous = n
+
+
+def write_segment(path, words, docs):
+    """
+    Write a segment file.
+
+    Args:
+        words: (word, [(page ID, positions), ...]) pairs in sorted word
+               order, with the pages of each word in page ID order, e.g.
+               from IndexBuilder.merged().
+        docs: (page ID, url, title, snippet, length, text) of every page in
+              the segment, in page ID order; text is None if not known.
+              Read once, so it can be a generator that reads the texts one
+              at a time: they are compressed as they come.
+
+    The file is written next to `path` and renamed into place, so a reader
+    never sees a partial segment. Returns the number of pages written.
+    """
+    sections = {}
+
+    # Pages, by local number
+    doc_ids = array('I')
+    doc_lengths = array('I')
+    doc_offsets = array('Q', [0])
+    docs_blob = bytearray()
+    texts = DocStoreWriter()
+    try:
+        for doc_id, url, title, snippet, length, text in docs:
+            if text is not None:
+                texts.add(len(doc_ids), text)
+            doc_ids.append(doc_id)
+            doc_lengths.append(length)
+            docs_blob += json.dumps([url, title, snippet], separators=(',', ':')).encode('utf-8')
+            doc_offsets.append(len(docs_blob))
+        texts_blob = texts.to_bytes()
+    finally:
+        texts.close()
+    sections.update(doc_ids=doc_ids, doc_lengths=doc_lengths, doc_offsets=doc_offsets,
+                    docs=docs_blob, texts=texts_blob)
+    local_id = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+    # Lexicon and posting lists, in sorted word order
+    word_offsets = array('Q', [0])
+    words_blob = bytearray()
+    doc_freqs = array('I')
+    postings_offsets = array('Q', [0])
+    postings_blob = bytearray()
+    positions_offsets = array('Q', [0])
+    positions_blob = bytearray()
+    for word, pages in words:
+        words_blob += word.encode('utf-8')
+        word_offsets.append(len(words_blob))
+
+        doc_freqs.append(len(pages))
+        encode_varints(_gaps(local_id[doc_id] for doc_id, _ in pages), postings_blob)
+        encode_varints((len(positions) for _, positions in pages), postings_blob)
+        postings_offsets.append(len(postings_blob))
+        for _, positions in pages:
+            encode_varints(_gaps(positions), positions_blob)
+        positions_offsets.append(len(positions_blob))
+    sections.update(word_offsets=word_offsets, words=words_blob, doc_freqs=doc_freqs,
+                    postings_offsets=postings_offsets, postings=postings_blob,
+                    positions_offsets=positions_offsets, positions=positions_blob)
+
+    # Lay the sections out after the header, 8-byte aligned
+    sections = {name: data.tobytes() if isinstance(data, array) else bytes(data)
+                for name, data in sections.items()}
+    table = []
+    offset = _HEADER.size
+    for name in _SECTIONS:
+        offset += -offset % 8
+        table += [offset, len(sections[name])]
+        offset += len(sections[name])
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _BYTE_ORDERS[sys.byteorder], len(doc_ids),
+                             len(doc_freqs), sum(doc_lengths), *table))
+        for name, section_offset in zip(_SECTIONS, table[::2]):
+            f.write(b'\0' * (section_offset - f.tell()))
+            f.write(sections[name])
+    os.replace(tmp_path, path)
+    return len(doc_ids)
+
+
+class _Lexicon:
+    """The sorted words of a segment as a sequence of bytes, for bisect."""
+
+    def __init__(self, offsets, words):
+        self.offsets = offsets
+        self.words = words
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.words[self.offsets[i]:self.offsets[i + 1]])
+
+
+class IndexSegment:
+    """
+    Read-only access to a segment file. Posting lists and page records are
+    decoded on demand from the memory-mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        header = _HEADER.unpack_from(self._buffer)
+        magic, byte_order, self.num_docs, self.num_words, self.total_length = header[:5]
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not an index segment (or was written by another version)")
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(f"{path} was written on a machine with another byte order")
+
+        table = header[5:]
+        sections = {name: self._buffer[offset:offset + length]
+                    for name, offset, length in zip(_SECTIONS, table[::2], table[1::2])}
+        self.doc_ids = sections['doc_ids'].cast('I')          # by local page number
+        self._word_offsets = sections['word_offsets'].cast('Q')
+        self._words = sections['words']
+        self._doc_freqs = sections['doc_freqs'].cast('I')
+        self._postings_offsets = sections['postings_offsets'].cast('Q')
+        self._postings = sections['postings']
+        self._positions_offsets = sections['positions_offsets'].cast('Q')
+        self._positions = sections['positions']
+        self.doc_lengths = sections['doc_lengths'].cast('I')  # by local page number
+        self._doc_offsets = sections['doc_offsets'].cast('Q')
+        self._docs = sections['docs']
+        self._texts = DocStore(sections['texts'])
+        self.lexicon = _Lexicon(self._word_offsets, self._words)
+
+    def __len__(self):
+        return self.num_words
+
+    def __contains__(self, word):
+        return self.word_id(word) is not None
+
+    def word_id(self, word):
+        """The position of a word in the sorted lexicon, or None if it is not in the segment."""
+        key = word.encode('utf-8')
+        i = bisect.bisect_left(self.lexicon, key)
+        if i < self.num_words and self.lexicon[i] == key:
+            return i
+        return None
+
+    def local_id(self, doc_id):
+        """The local number of a page, or None if it is not in the segment."""
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        if i < self.num_docs and self.doc_ids[i] == doc_id:
+            return i
+        return None
+
+    def doc_freq(self, word):
+        word_id = self.word_id(word)
+        return 0 if word_id is None else self._doc_freqs[word_id]
+
+    def _postings_at(self, word_id):
+        df = self._doc_freqs[word_id]
+        start, end = self._postings_offsets[word_id], self._postings_offsets[word_id + 1]
+        numbers = decode_varints(self._postings[start:end])
+        return list(accumulate(numbers[:df])), numbers[df:]
+
+    def postings(self, word):
+        """
+        The posting list of a word as lists of (local page numbers, term
+        frequencies), or None if the word is not in the segment.
+        """
+        word_id = self.word_id(word)
+        if word_id is None:
+            return None
+        return self._postings_at(word_id)
+
+    def _positions_at(self, word_id):
+        local_ids, tfs = self._postings_at(word_id)
+        start, end = self._positions_offsets[word_id], self._positions_offsets[word_id + 1]
+        gaps = decode_varints(self._positions[start:end])
+        i = 0
+        for local, tf in zip(local_ids, tfs):
+            yield local, list(accumulate(gaps[i:i + tf]))
+            i += tf
+
+    def positions(self, word):
+        """
+        Iterate over (local page number, positions) for the pages containing
+        a word, in page order (nothing if the word is not in the segment).
+        """
+        word_id = self.word_id(word)
+        if word_id is None:
+            return iter(())
+        return self._positions_at(word_id)
+
+    def entries(self):
+        """
+        Iterate over (word, [(page ID, positions), ...]) for every word of
+        the segment in sorted order, e.g. to merge segments.
+        """
+        doc_ids = self.doc_ids
+        for word_id in range(self.num_words):
+            yield (self.lexicon[word_id].decode('utf-8'),
+                   [(doc_ids[local], positions) for local, positions in self._positions_at(word_id)])
+
+    def word_postings(self):
+        """
+        Iterate over (word, local page numbers) for every word of the
+        segment in sorted order, without decoding positions.
+        """
+        for word_id in range(self.num_words):
+            yield self.lexicon[word_id].decode('utf-8'), self._postings_at(word_id)[0]
+
+    def document(self, local):
+        """The (url, title, snippet) of the page with the given local number."""
+        start, end = self._doc_offsets[local], self._doc_offsets[local + 1]
+        return tuple(json.loads(bytes(self._docs[start:end]).decode('utf-8')))
+
+    def text(self, local):
+        """The text of the page with the given local number, or None if it was not stored."""
+        return self._texts.get(local)
+
+    def close(self):
+        self._texts.close()
+        for view in (self.doc_ids, self._word_offsets, self._doc_freqs, self._postings_offsets,
+                     self._positions_offsets, self.doc_lengths, self._doc_offsets,
+                     self._words, self._postings, self._positions, self._docs):
+            view.release()
+        self._buffer.release()
+        self._mmap.close()
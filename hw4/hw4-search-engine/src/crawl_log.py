@@ -0,0 +1,87 @@
+"""
+Persistent crawl state, so that an interrupted crawl can be resumed.
+
+Every fetched page is streamed to an append-only JSON-lines log as soon as
+it is processed, with everything needed to rebuild the graph, index and page
+info without refetching it, including its out-links. The frontier (the
+queue of URLs still to fetch) is not saved separately: every queued URL is
+the seed or a link of a logged page, so resuming replays the log and queues
+those links again, in the order they were found, skipping the URLs already
+fetched. Saving the frontier thus costs nothing however large it grows, and
+the log is only synced to disk every so often.
+"""
+
+import json
+import os
+
+LOG_FILE = 'crawl_log.jsonl'
+# Frontier snapshot written by earlier versions, removed when a new log is started
+CHECKPOINT_FILE = 'crawl_checkpoint.json'
+
+
+class CrawlLog:
+    def __init__(self, log_dir='data'):
+        self.log_dir = log_dir
+        self.log_path = os.path.join(log_dir, LOG_FILE)
+        self.checkpoint_path = os.path.join(log_dir, CHECKPOINT_FILE)
+        self.num_records = 0
+        self._valid_size = 0   # bytes of the log holding complete records
+        self._file = None
+
+    def exists(self):
+        return os.path.exists(self.log_path)
+
+    def open(self, resume=False):
+        """
+        Open the log for appending. Unless resuming, any previous log is
+        discarded. When resuming, call replay() first.
+        """
+        os.makedirs(self.log_dir, exist_ok=True)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        if not resume:
+            self.num_records = 0
+        elif self.exists():
+            # Drop a partial record left behind by a crash, so new records
+            # do not get glued onto it
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(self._valid_size)
+        # Line buffered, so each record reaches the OS as soon as it is written
+        self._file = open(self.log_path, 'a' if resume else 'w', encoding='utf-8', buffering=1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, record):
+        """Append one record (a JSON-serializable dict) to the log."""
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.num_records += 1
+
+    def replay(self):
+        """
+        Yield the records in the log, in the order they were written. A final
+        line cut short by a crash is ignored.
+        """
+        self.num_records = 0
+        self._valid_size = 0
+        if not self.exists():
+            return
+        with open(self.log_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self.num_records += 1
+                self._valid_size += len(line)
+                yield record
+
+    def sync(self):
+        """Make sure the records appended so far are on disk."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
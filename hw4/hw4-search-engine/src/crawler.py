@@ -4,34 +4,118 @@ induced subgraph and an inverted index to later be used by the search engine.
 """
 
 from . import fetcher
-from .indexer import extract_text_from_html, tokenize
+from .frontier import Frontier
+from .crawl_log import CrawlLog
+from .page_cache import PageCache
+from .politeness import HostScheduler, RobotsCache
+from .simhash import SimHashIndex
+from .freshness import FreshnessSchedule, content_hash
+from .url_table import UrlTable, load_urls
+from .postings import load_index
+from .index_builder import IndexBuilder, DEFAULT_MEMORY_BUDGET, write_index
+from .index_store import IndexStore, load_texts
+from .doc_store import DOCS_FILE, MAX_TEXT_LENGTH, DocStoreWriter
+from .indexer import parse_page
 import json
+import os
 import re
-import html
 import time
+import asyncio
+import multiprocessing
+import queue
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from urllib.parse import urlparse, urldefrag
 from collections import deque, defaultdict
 
+
+def _parse_page_timed(html_content, url):
+    """parse_page() for the pipeline's worker processes, also returning its run time"""
+    started = time.perf_counter()
+    page = parse_page(html_content, url)
+    page['sha1'] = content_hash(html_content)
+    return page, time.perf_counter() - started
+
+
 class Crawler:
-    def __init__(self, seed_url="http://www.caltech.edu/", max_pages=2000):
+    def __init__(self, seed_url="http://www.caltech.edu/", max_pages=2000,
+                 max_queue_in_memory=100000, log_dir=None, checkpoint_every=100,
+                 cache_dir=None, respect_robots=True, detect_duplicates=True,
+                 metrics=None, max_page_size=fetcher.MAX_PAGE_SIZE,
+                 index_memory=DEFAULT_MEMORY_BUDGET):
         self.max_pages = max_pages
         self.seed = self.normalize_url(seed_url)
         
-        # Use BFS traversal
-        self.queue = deque([self.seed])
-        self.visited = set()
+        # Use BFS traversal. The frontier remembers every URL it has seen,
+        # and spills to disk past max_queue_in_memory queued URLs.
+        self.max_queue_in_memory = max_queue_in_memory
+        self.queue = Frontier(max_in_memory=max_queue_in_memory)
+        self.queue.add(self.seed)
+        
+        # Pages are identified by integer IDs, interned in a single URL table,
+        # so the graph and the index hold compact arrays of IDs
+        self.urls = UrlTable()
+        self.visited = set()  # page IDs
         self.bad_urls = set()
         
-        self.in_links = {}
-        self.out_links = {}
+        # URLs popped from the queue but not yet processed
+        self._in_progress = set()
+        
+        # If log_dir is given, every page is streamed to an append-only log,
+        # synced to disk every checkpoint_every records
+        self.log = CrawlLog(log_dir) if log_dir else None
+        self.checkpoint_every = checkpoint_every
+        self._resumed = False
+        
+        # If cache_dir is given, fetched pages are cached there and later
+        # fetches of the same URL become conditional requests
+        self.cache = PageCache(cache_dir) if cache_dir else None
+        
+        # Pages larger than this many bytes are abandoned while downloading
+        self.max_page_size = max_page_size
+        
+        # Per-host rate limits are set up by each crawl call; robots.txt
+        # rules are cached across calls
+        self.robots = RobotsCache() if respect_robots else None
+        self.politeness = None
+        
+        # Near-duplicate detection: pages whose text fingerprint is close to
+        # that of a page already indexed are recorded as aliases of it
+        # instead of being indexed again, and their links are queued with
+        # low priority
+        self.fingerprints = SimHashIndex() if detect_duplicates else None
+        self.aliases = {}  # near-duplicate page ID -> canonical page ID
+        
+        # Optional CrawlMetrics, updated by the fetcher and at every page
+        self.metrics = metrics
         
-        # Store the complete graph structure as an adjacency list
+        # In- and out-degrees in the induced subgraph, indexed by page ID
+        self.in_links = array('I')
+        self.out_links = array('I')
+        
+        # Store the complete graph structure as an adjacency list:
+        # page ID -> array of the IDs it links to
         self.graph = {}
         
-        # Search index
-        self.index = defaultdict(list)  # word -> list of URLs
+        # Search index. Once the in-memory part of the index grows past
+        # index_memory bytes, it is flushed to a sorted segment on disk, and
+        # the segments are merged when the results are saved.
+        self.index_builder = IndexBuilder(index_memory)
+        self.index = self.index_builder.index  # word -> page IDs and word positions
+        self.doc_lengths = self.index_builder.doc_lengths  # page ID -> number of words
         self.page_info = {}  # url -> {title, snippet}
         
+        # Page texts for query-dependent snippets, compressed in blocks as
+        # pages come in (see doc_store.py). After load_results(), only those
+        # of refetched pages; the others are in saved_docs.
+        self.docs = DocStoreWriter()
+        self.saved_docs = None
+        
+        # page ID -> hash of the HTML of each crawled page, saved to the
+        # freshness schedule so that recrawls can tell what changed
+        self.content_hashes = {}
+        
         # Extensions to skip
         self.skip_extensions = {
             '.pdf', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg',
@@ -57,51 +141,25 @@ class Crawler:
             
         return url
     
-    def _index_page(self, url, html_content):
+    def _index_page(self, page_id, page):
         """
         Index a page's content for search.
-        Extracts text, tokenizes, and builds the inverted index.
-        Returns the number of unique words indexed.
+        Adds the words found by parse_page(), with their positions, to the
+        inverted index. Returns the number of unique words indexed.
         """
         try:
-            # Extract text from HTML
-            text = extract_text_from_html(html_content)
-            words = tokenize(text)
-            
-            # Extract title for display
-            title_match = re.search(r'<title[^>]*>(.*?)</title>', html_content, re.IGNORECASE | re.DOTALL)
-            if title_match:
-                title = title_match.group(1)
-                title = re.sub(r'<[^>]+>', '', title)
-                title = html.unescape(title)
-                # Normalize whitespace: replace all whitespace sequences with single space
-                title = re.sub(r'\s+', ' ', title).strip()
-            else:
-                title = url
-            title = title[:100]
-            
-            # Build snippet from body text
-            # Try to get a clean snippet from paragraphs or body content
-            snippet = text[:300].strip()
-            snippet = re.sub(r'\s+', ' ', snippet)
-            if len(snippet) > 200:
-                snippet = snippet[:200].rsplit(' ', 1)[0] + '...'
-            
             # Store page information
-            self.page_info[url] = {
-                'title': title,
-                'snippet': snippet
+            self.page_info[self.urls[page_id]] = {
+                'title': page['title'],
+                'snippet': page['snippet']
             }
+            self.docs.add(page_id, page['content'])
             
-            # Add words to inverted index
-            unique_words = set(words)
-            words_added = 0
-            for word in unique_words:
-                if url not in self.index[word]:
-                    self.index[word].append(url)
-                    words_added += 1
+            # Add words to inverted index. Each page is indexed once, so its
+            # ID cannot already be in the posting lists.
+            self.index_builder.add(page_id, page['positions'], page['length'])
             
-            return len(unique_words)
+            return len(page['positions'])
         except Exception as e:
             # If indexing fails, just skip it for now
             return 0
@@ -121,99 +179,572 @@ class Crawler:
         return True
     
     def crawl(self, delay=0.1):
-        """Main crawling loop with politeness delay"""
+        """
+        Main crawling loop with per-host politeness.
+        
+        `delay` is the minimum time between two requests to the same host
+        (or the host's robots.txt Crawl-delay, if larger). While one host is
+        cooling down, pages from other hosts are fetched instead.
+        """
         print(f"Starting crawl from {self.seed}")
         print(f"Target: {self.max_pages} pages\n")
         
-        while self.queue and len(self.visited) < self.max_pages:
-            # Use BFS
-            url = self.queue.popleft()
-            
-            # Normalize URL before processing
-            url = self.normalize_url(url)
-            
-            # Skip if already visited or known to be bad
-            if url in self.visited or url in self.bad_urls:
-                continue
-            
-            # Politeness delay to avoid DoS
-            time.sleep(delay)
-            
-            # Fetch page content
-            real_url, html_content = fetcher.fetch_html_page(url)
-            
-            if html_content is not None:
-                normalized_url = self.normalize_url(real_url)
+        self._start_politeness(delay)
+        waiting = defaultdict(deque)  # host -> urls held back by its rate limit
+        
+        self._open_log()
+        try:
+            while len(self.visited) < self.max_pages:
+                # Use BFS, skipping over hosts that are not ready yet
+                url = self._next_url(waiting, self._host_ready, max_waiting=1000)
                 
-                if normalized_url in self.visited:
+                if url is None:
+                    if not self._has_waiting(waiting):
+                        break
+                    # Every queued host is rate limited; wait for the first one
+                    time.sleep(self._next_ready(waiting))
                     continue
                 
-                self.visited.add(normalized_url)
+                # Fetch page content
+                self.politeness.wait(url)
+                real_url, html_content = self._fetch(url)
+                self._in_progress.discard(url)
+                self._process_page(url, real_url, html_content)
+        finally:
+            # Runs on Ctrl+C too, so the crawl can be resumed
+            self._requeue_in_progress()
+            self._close_log()
+        
+        self._finish_crawl()
+    
+    def crawl_async(self, delay=0.1, concurrency=16, per_host=2):
+        """
+        Crawl with up to `concurrency` requests in flight at once, and at most
+        `per_host` of them against any single host. Requests to a host are
+        also spaced at least `delay` seconds apart, as in crawl().
+        
+        Fetches run on a thread pool driven by an asyncio event loop, while all
+        bookkeeping (queue, graph, index) stays on the loop's thread, so the
+        results have the same shape as those of crawl().
+        """
+        print(f"Starting async crawl from {self.seed}")
+        print(f"Target: {self.max_pages} pages "
+              f"(concurrency: {concurrency}, per host: {per_host})\n")
+        
+        self._start_politeness(delay)
+        self._open_log()
+        try:
+            asyncio.run(self._crawl_async(concurrency, per_host))
+        finally:
+            self._requeue_in_progress()
+            self._close_log()
+        
+        self._finish_crawl()
+    
+    def crawl_pipelined(self, delay=0.1, fetch_workers=16, parse_processes=None):
+        """
+        Crawl with fetching, parsing and indexing split into pipeline stages:
+        
+            fetch threads -> parse/tokenize processes -> index merger
+        
+        `fetch_workers` threads download pages and hand the raw HTML to a
+        pool of `parse_processes` worker processes (default: one per core),
+        which send back compact parse_page() results. This thread merges
+        those into the graph and index. The stages are connected by bounded
+        queues, so a slow stage holds back the ones before it. Requests to a
+        host are spaced at least `delay` seconds apart, as in crawl().
+        """
+        parse_processes = parse_processes or os.cpu_count() or 1
+        print(f"Starting pipelined crawl from {self.seed}")
+        print(f"Target: {self.max_pages} pages "
+              f"(fetch threads: {fetch_workers}, parse processes: {parse_processes})\n")
+        
+        self._start_politeness(delay)
+        self._open_log()
+        try:
+            self._crawl_pipelined(fetch_workers, parse_processes)
+        finally:
+            self._requeue_in_progress()
+            self._close_log()
+        
+        self._finish_crawl()
+    
+    def _crawl_pipelined(self, fetch_workers, parse_processes):
+        """Coordinator and index-merger side of crawl_pipelined()"""
+        url_queue = queue.Queue(maxsize=fetch_workers)        # coordinator -> fetchers
+        html_queue = queue.Queue(maxsize=2 * parse_processes)  # fetchers -> parse pool
+        result_queue = queue.Queue()                           # fetchers/parse pool -> merger
+        stop = threading.Event()
+        errors = []
+        
+        # Bound the number of pages being parsed (or waiting for their result)
+        parse_slots = threading.BoundedSemaphore(2 * parse_processes)
+        
+        # Spawn rather than fork the workers, since this process has threads
+        pool = ProcessPoolExecutor(max_workers=parse_processes,
+                                   mp_context=multiprocessing.get_context('spawn'))
+        
+        def get(q):
+            # Block on a queue, but give up once the crawl is stopping
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return None
+        
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        
+        def fetch_worker():
+            while (url := get(url_queue)) is not None:
+                real_url, html_content = self._fetch(url)
+                if html_content is None:
+                    result_queue.put((url, real_url, None))
+                else:
+                    put(html_queue, (url, real_url, html_content))
+        
+        def parse_dispatcher():
+            while (item := get(html_queue)) is not None:
+                url, real_url, html_content = item
+                while not parse_slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                try:
+                    future = pool.submit(_parse_page_timed, html_content, real_url)
+                except Exception as e:
+                    # The pool is unusable (e.g. a worker failed to start)
+                    errors.append(e)
+                    return
+                
+                def done(future, url=url, real_url=real_url):
+                    parse_slots.release()
+                    result_queue.put((url, real_url, future))
+                future.add_done_callback(done)
+        
+        threads = [threading.Thread(target=fetch_worker, daemon=True) for _ in range(fetch_workers)]
+        threads.append(threading.Thread(target=parse_dispatcher, daemon=True))
+        for thread in threads:
+            thread.start()
+        
+        waiting = defaultdict(deque)  # host -> urls held back by its rate limit
+        dispatched = set()            # urls handed to the fetchers, not yet merged
+        try:
+            while len(self.visited) < self.max_pages:
+                # Keep the fetchers busy without running past max_pages
+                while not url_queue.full() and \
+                      len(self.visited) + len(dispatched) < self.max_pages:
+                    url = self._next_url(waiting, self._host_ready, max_waiting=1000)
+                    if url is None:
+                        break
+                    self.politeness.acquire(url)
+                    dispatched.add(url)
+                    url_queue.put(url)
                 
-                # Extract links from the page using our HTMLParser
-                parser = fetcher.MyHTMLParser()
-                parser.urls = []
-                parser.feed(html_content)
-                parser.close()
-                links = parser.get_links(real_url)
+                if not dispatched and not self._has_waiting(waiting):
+                    break
                 
-                normalized_links = []
-                for link in links:
-                    link = self.normalize_url(link)
-                    if self.is_valid_caltech_url(link):
-                        normalized_links.append(link)
-                        
-                        # Add to queue if not yet visited (using normalized URL)
-                        if link not in self.visited and \
-                           link not in self.bad_urls and \
-                           link not in self.queue:
-                            self.queue.append(link)
+                timeout = 0.1
+                if self._has_waiting(waiting):
+                    timeout = min(timeout, self._next_ready(waiting))
+                try:
+                    url, real_url, result = result_queue.get(timeout=timeout)
+                except queue.Empty:
+                    if errors:
+                        raise errors[0]
+                    continue
+                dispatched.discard(url)
+                self._in_progress.discard(url)
                 
-                self.graph[normalized_url] = normalized_links
+                if result is None:
+                    self._process_page(url, real_url, None)
+                    continue
+                try:
+                    page, parse_seconds = result.result()
+                except Exception:
+                    page = None
+                if page is None:
+                    self._process_page(url, real_url, None)
+                else:
+                    if self.metrics is not None:
+                        self.metrics.observe('parse_seconds', parse_seconds)
+                    self._record_page(url, real_url, page)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            pool.shutdown(wait=True, cancel_futures=True)
+    
+    async def _crawl_async(self, concurrency, per_host):
+        """Event loop side of crawl_async()"""
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        
+        in_flight = {}                   # task -> url
+        host_active = defaultdict(int)   # host -> number of requests in flight
+        waiting = defaultdict(deque)     # host -> urls held back by its caps
+        
+        def can_start(host):
+            return host_active[host] < per_host and self._host_ready(host)
+        
+        async def fetch(url):
+            await asyncio.sleep(self.politeness.acquire(url))
+            return await loop.run_in_executor(executor, self._fetch, url)
+        
+        try:
+            while len(self.visited) < self.max_pages:
+                # Fill the pool of in-flight requests
+                while len(in_flight) < concurrency and \
+                      len(self.visited) + len(in_flight) < self.max_pages:
+                    url = self._next_url(waiting, can_start, max_waiting=4 * concurrency)
+                    if url is None:
+                        break
+                    
+                    host = urlparse(url).netloc
+                    host_active[host] += 1
+                    in_flight[asyncio.ensure_future(fetch(url))] = url
                 
-                words_indexed = self._index_page(normalized_url, html_content)
+                # Wake up when a fetch completes, or when a rate-limited host
+                # we are holding URLs for becomes ready
+                timeout = self._next_ready(waiting) if self._has_waiting(waiting) else None
+                if not in_flight:
+                    if timeout is None:
+                        break
+                    await asyncio.sleep(timeout)
+                    continue
                 
-                print(f"{len(self.visited):5d}/{len(self.visited) + len(self.queue):5d} "
-                      f"{normalized_url} (out: {len(normalized_links)}, words: {words_indexed})")
-            else:
+                done, _ = await asyncio.wait(in_flight, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url = in_flight.pop(task)
+                    self._in_progress.discard(url)
+                    host_active[urlparse(url).netloc] -= 1
+                    
+                    real_url, html_content = task.result()
+                    self._process_page(url, real_url, html_content)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _next_url(self, waiting, can_start, max_waiting):
+        """
+        Pick the next URL to fetch, from a host for which can_start(host) is
+        true. URLs for other hosts are held back in `waiting` (up to
+        max_waiting of them, so a single busy host cannot drain the whole
+        queue into memory), and are served before the queue so that the
+        crawl stays close to BFS order.
+        """
+        for host, urls in waiting.items():
+            if urls and can_start(host):
+                url = urls.popleft()
+                if not urls:
+                    del waiting[host]
+                return url
+        
+        num_waiting = sum(len(urls) for urls in waiting.values())
+        while self.queue and num_waiting < max_waiting:
+            url = self.normalize_url(self.queue.pop())
+            if self._is_crawled(url) or url in self.bad_urls or url in self._in_progress:
+                continue
+            
+            self._in_progress.add(url)
+            host = urlparse(url).netloc
+            if can_start(host):
+                return url
+            waiting[host].append(url)
+            num_waiting += 1
+        
+        return None
+    
+    def _is_crawled(self, url):
+        """True if the URL is a visited page or a near-duplicate of one"""
+        url_id = self.urls.get(url)
+        return url_id is not None and (url_id in self.visited or url_id in self.aliases)
+    
+    def _start_politeness(self, delay):
+        self.politeness = HostScheduler(delay=delay, robots=self.robots)
+    
+    def _host_ready(self, host):
+        return self.politeness.ready_in(host) == 0
+    
+    def _next_ready(self, waiting):
+        """Seconds until the first host with held-back URLs is ready"""
+        return max(0.001, min(self.politeness.ready_in(host) for host in waiting))
+    
+    def _has_waiting(self, waiting):
+        return any(waiting.values())
+    
+    def _fetch(self, url):
+        """Fetch a page, unless robots.txt disallows it. Called on fetch threads."""
+        if not self.politeness.allowed(url):
+            if self.metrics is not None:
+                self.metrics.record_failure('robots')
+            return url, None
+        return fetcher.fetch_html_page(url, self.cache, self.metrics, self.max_page_size)
+    
+    def _requeue_in_progress(self):
+        """Put URLs that were popped but never processed back on the queue"""
+        for url in self._in_progress:
+            self.queue.requeue(url)
+        self._in_progress.clear()
+    
+    def _process_page(self, url, real_url, html_content):
+        """
+        Record the result of fetching `url`: add the page to the graph, queue
+        its out-links and index its content, or mark the URL as bad.
+        """
+        if html_content is None:
+            self.bad_urls.add(url)
+            self._log_record({'type': 'failed', 'url': url})
+            print(f"{len(self.visited):5d}/{len(self.visited) + len(self.queue):5d} "
+                  f"{url} (FAILED)")
+            self._report_metrics()
+            return
+        
+        normalized_url = self.normalize_url(real_url)
+        
+        if self._is_crawled(normalized_url):
+            # Redirected to a page we already have
+            self._log_record({'type': 'duplicate', 'url': url})
+            return
+        
+        started = time.perf_counter()
+        page = parse_page(html_content, real_url)
+        page['sha1'] = content_hash(html_content)
+        if self.metrics is not None:
+            self.metrics.observe('parse_seconds', time.perf_counter() - started)
+        self._record_page(url, real_url, page)
+    
+    def _record_page(self, url, real_url, page):
+        """
+        Add a parsed page (a parse_page() result) to the graph, queue its
+        out-links and index its content. A near-duplicate of a page already
+        indexed is recorded as an alias of that page instead.
+        """
+        normalized_url = self.normalize_url(real_url)
+        
+        if self._is_crawled(normalized_url):
+            # Redirected to a page we already have
+            self._log_record({'type': 'duplicate', 'url': url})
+            return
+        
+        # After a redirect, make sure the target is never queued again
+        self.queue.mark_seen(normalized_url)
+        page_id = self.urls.intern(normalized_url)
+        
+        # Keep the cached page findable under the URL it is saved as, so the
+        # index can be rebuilt from the cache (see indexer.build_index)
+        if self.cache is not None and real_url != normalized_url:
+            self.cache.alias(normalized_url, real_url)
+        
+        fingerprint = page['fingerprint']
+        canonical_id = None
+        if self.fingerprints is not None and fingerprint is not None:
+            canonical_id = self.fingerprints.find(fingerprint)
+        is_alias = canonical_id is not None
+        
+        normalized_links = []
+        for link in page['links']:
+            link = self.normalize_url(link)
+            if self.is_valid_caltech_url(link):
+                normalized_links.append(link)
+                
+                # Add to queue if never queued or visited (using normalized URL).
+                # Links only found on near-duplicates can wait.
+                self.queue.add(link, low_priority=is_alias)
+        
+        if is_alias:
+            self.aliases[page_id] = canonical_id
+            canonical_url = self.urls[canonical_id]
+            self._log_record({
+                'type': 'alias',
+                'url': normalized_url,
+                'requested': url,
+                'canonical': canonical_url,
+                'links': normalized_links,
+            })
+            print(f"{len(self.visited):5d}/{len(self.visited) + len(self.queue):5d} "
+                  f"{normalized_url} (near-duplicate of {canonical_url})")
+            if self.metrics is not None:
+                self.metrics.count('aliases')
+            self._report_metrics()
+            return
+        
+        self.visited.add(page_id)
+        self.graph[page_id] = array('I', map(self.urls.intern, normalized_links))
+        self.content_hashes[page_id] = page['sha1']
+        if self.fingerprints is not None and fingerprint is not None:
+            self.fingerprints.add(page_id, fingerprint)
+        
+        started = time.perf_counter()
+        num_words = self._index_page(page_id, page)
+        if self.metrics is not None:
+            self.metrics.observe('index_seconds', time.perf_counter() - started)
+            self.metrics.count('pages')
+        
+        info = self.page_info.get(normalized_url, {})
+        self._log_record({
+            'type': 'page',
+            'url': normalized_url,
+            'requested': url,
+            'links': normalized_links,
+            'title': info.get('title', normalized_url),
+            'snippet': info.get('snippet', ''),
+            'content': page['content'],
+            'positions': page['positions'],
+            'length': page['length'],
+            'fingerprint': fingerprint,
+            'sha1': page['sha1'],
+        })
+        
+        print(f"{len(self.visited):5d}/{len(self.visited) + len(self.queue):5d} "
+              f"{normalized_url} (out: {len(normalized_links)}, words: {num_words})")
+        self._report_metrics()
+    
+    def _report_metrics(self, final=False):
+        """Update the queue gauges and write a metrics snapshot if one is due"""
+        if self.metrics is None:
+            return
+        self.metrics.set_gauge('queue_depth', len(self.queue))
+        self.metrics.set_gauge('in_progress', len(self._in_progress))
+        self.metrics.set_gauge('visited', len(self.visited))
+        if final:
+            self.metrics.write()
+        else:
+            self.metrics.maybe_write()
+    
+    def resume(self):
+        """
+        Restore the state of an interrupted crawl from the crawl log, so that
+        crawling continues where it stopped without refetching any logged
+        page. Returns the number of pages restored.
+        """
+        # Replay the log to rebuild the graph, index and page info
+        seen = set()
+        for record in self.log.replay():
+            url = record['url']
+            seen.add(url)
+            if record['type'] == 'page':
+                seen.add(record['requested'])
+                page_id = self.urls.intern(url)
+                self.visited.add(page_id)
+                self.graph[page_id] = array('I', map(self.urls.intern, record['links']))
+                self.page_info[url] = {
+                    'title': record['title'],
+                    'snippet': record['snippet']
+                }
+                self.index_builder.add(page_id, record['positions'], record['length'])
+                if record.get('content') is not None:
+                    self.docs.add(page_id, record['content'])
+                if record.get('sha1') is not None:
+                    self.content_hashes[page_id] = record['sha1']
+                if self.fingerprints is not None and record.get('fingerprint') is not None:
+                    self.fingerprints.add(page_id, record['fingerprint'])
+            elif record['type'] == 'alias':
+                seen.add(record['requested'])
+                self.aliases[self.urls.intern(url)] = self.urls.intern(record['canonical'])
+            elif record['type'] == 'failed':
                 self.bad_urls.add(url)
-                print(f"{len(self.visited):5d}/{len(self.visited) + len(self.queue):5d} "
-                      f"{url} (FAILED)")
         
+        # Rebuild the frontier as the crawl built it: the seed, then the links
+        # of each logged page in log order (those of near-duplicates with low
+        # priority), leaving out every URL already fetched. This second pass
+        # streams the links into the frontier, which spills them to disk
+        self.queue = Frontier(max_in_memory=self.max_queue_in_memory)
+        for url in seen:
+            self.queue.mark_seen(url)
+        del seen
+        self.queue.add(self.seed)
+        for record in self.log.replay():
+            if record['type'] in ('page', 'alias'):
+                for link in record['links']:
+                    self.queue.add(link, low_priority=record['type'] == 'alias')
+        
+        self._resumed = True
+        print(f"Resumed crawl: {len(self.visited)} pages, {len(self.aliases)} near-duplicates, "
+              f"{len(self.bad_urls)} bad URLs, {len(self.queue)} URLs in queue")
+        return len(self.visited)
+    
+    def _open_log(self):
+        if self.log is not None:
+            self.log.open(resume=self._resumed)
+            # Any later crawl call on this crawler continues the same log
+            self._resumed = True
+    
+    def _close_log(self):
+        if self.log is not None:
+            self.log.sync()
+            self.log.close()
+    
+    def _log_record(self, record):
+        """
+        Append a record to the crawl log, syncing it to disk periodically.
+        The frontier needs no checkpoint: resume() rebuilds it from the log.
+        """
+        if self.log is None:
+            return
+        self.log.append(record)
+        if self.log.num_records % self.checkpoint_every == 0:
+            self.log.sync()
+    
+    def _finish_crawl(self):
+        """Build the induced subgraph and report crawl statistics"""
         # Build induced subgraph
         self._build_induced_subgraph()
         
         print(f"\nCrawl complete!")
         print(f"URLs visited: {len(self.visited)}")
+        print(f"Near-duplicates: {len(self.aliases)}")
         print(f"URLs in queue: {len(self.queue)}")
         print(f"Bad URLs: {len(self.bad_urls)}")
+        
+        if self.metrics is not None:
+            self._report_metrics(final=True)
+            snapshot = self.metrics.snapshot()
+            fetch = snapshot['histograms']['fetch_seconds']
+            print(f"Pages/sec: {snapshot['pages_per_sec']}, "
+                  f"bytes received: {snapshot['counters'].get('bytes', 0)}, "
+                  f"fetch p50/p90: {fetch['p50']}/{fetch['p90']}s")
+            if snapshot['failures']:
+                print(f"Failures: {snapshot['failures']}")
+        
+        # Remove any part of the queue that was spilled to disk
+        self.queue.close()
     
     def _build_induced_subgraph(self):
         """
-        Build induced subgraph containing only edges between visited nodes
+        Build induced subgraph containing only edges between visited nodes.
+        Links to a near-duplicate page point to its canonical page instead.
         """
         print("\nBuilding induced subgraph...")
         
         # Initialize in-degree and out-degree counts
-        self.in_links = {url: 0 for url in self.visited}
-        self.out_links = {url: 0 for url in self.visited}
+        self.in_links = array('I', [0]) * len(self.urls)
+        self.out_links = array('I', [0]) * len(self.urls)
         
         # Filter graph to only include edges between visited nodes
         induced_graph = {}
         
-        for source_url in self.graph:
-            # Only consider source URLs that were visited
-            if source_url not in self.visited:
+        for source_id, targets in self.graph.items():
+            # Only consider source pages that were visited
+            if source_id not in self.visited:
                 continue
             
-            # Filter target URLs to only include visited nodes (i.e. only include edges between visited nodes)
-            valid_targets = [
-                target for target in self.graph[source_url] 
+            # Filter targets to only include visited nodes (i.e. only include edges between visited nodes)
+            valid_targets = array('I', (
+                target for target in
+                (self.aliases.get(target, target) for target in targets)
                 if target in self.visited
-            ]
+            ))
             
-            induced_graph[source_url] = valid_targets
-            self.out_links[source_url] = len(valid_targets)
+            induced_graph[source_id] = valid_targets
+            self.out_links[source_id] = len(valid_targets)
             
             for target in valid_targets:
                 self.in_links[target] += 1
@@ -221,27 +752,332 @@ class Crawler:
         self.graph = induced_graph
         
         print(f"Induced subgraph: {len(self.visited)} nodes, "
-              f"{sum(self.out_links.values())} edges")
+              f"{sum(self.out_links)} edges")
     
     def save_results(self, data_dir='data'):
         """Save crawl results to JSON files, including search index"""
-        import os
         os.makedirs(data_dir, exist_ok=True)
+        num_words = self._write_results(data_dir, ('urls', 'graph', 'index', 'page_info', 'aliases',
+                                                   'docs'))
+        self._save_schedule(data_dir)
         
-        # Save our web graph
-        with open(f'{data_dir}/graph.json', 'w') as f:
-            json.dump(self.graph, f, indent=2)
+        print(f"\nResults saved to {data_dir}/")
+        print(f"  - URLs: {len(self.visited)} pages")
+        print(f"  - Graph: {len(self.graph)} pages")
+        print(f"  - Index: {num_words} unique words")
+        print(f"  - Page info: {len(self.page_info)} pages")
+        print(f"  - Page texts: {DOCS_FILE}")
+        print(f"  - Aliases: {len(self.aliases)} near-duplicate pages")
+    
+    def _save_schedule(self, data_dir):
+        """
+        Record the pages just crawled as checked in the freshness schedule,
+        with the hash of their content, and forget pages no longer crawled.
+        """
+        schedule = FreshnessSchedule(data_dir)
+        crawled = {self.urls[page_id] for page_id in self.visited}
+        for url in list(schedule.pages):
+            if url not in crawled:
+                schedule.forget(url)
+        for page_id, sha1 in self.content_hashes.items():
+            if page_id in self.visited:
+                schedule.record(self.urls[page_id], sha1)
+        schedule.save()
+    
+    def _write_results(self, data_dir, names):
+        """
+        Write the named result files (see url_table.py for the format of the
+        ID-based ones). Visited pages are renumbered 0..n-1 in ID order, so
+        the saved IDs are dense and the files written together agree.
+        Returns the number of words in the index, if it was written.
+        """
+        page_ids = sorted(self.visited)
+        saved_id = {page_id: i for i, page_id in enumerate(page_ids)}
         
-        # Save search index
-        index_dict = {word: urls for word, urls in self.index.items()}
-        with open(f'{data_dir}/index.json', 'w') as f:
-            json.dump(index_dict, f, indent=2)
+        results = {}
+        num_words = None
+        if 'urls' in names:
+            # The URL of each page, by saved ID
+            results['urls'] = [self.urls[page_id] for page_id in page_ids]
+        if 'graph' in names:
+            # Our web graph: the out-links of each page, by saved ID
+            results['graph'] = [[saved_id[target] for target in self.graph[page_id]]
+                                for page_id in page_ids]
+        if 'index' in names:
+            # Search index, with sorted posting lists, and the positions of
+            # the words in each page in the same order (see postings.py),
+            # merged from the flushed index segments one word at a time
+            num_words = write_index(data_dir, self.index_builder.merged(key=saved_id.__getitem__),
+                                    [self.doc_lengths.get(page_id, 0) for page_id in page_ids])
+        if 'page_info' in names:
+            # Page info (titles, snippets) to display in search results
+            results['page_info'] = self.page_info
+        if 'aliases' in names:
+            # Near-duplicate pages and the canonical page each is an alias of
+            results['aliases'] = {self.urls[alias]: self.urls[canonical]
+                                  for alias, canonical in self.aliases.items()}
+        if 'docs' in names:
+            # Page texts; pages that were not refetched keep their saved text
+            if self.saved_docs is not None:
+                fetched = set(self.docs.doc_ids)
+                for page_id in page_ids:
+                    if page_id not in fetched:
+                        text = self.saved_docs.get(page_id)
+                        if text is not None:
+                            self.docs.add(page_id, text)
+            self.docs.write(f'{data_dir}/{DOCS_FILE}', key=saved_id.get)
         
-        # Save page info (titles, snippets) to display in search results
-        with open(f'{data_dir}/page_info.json', 'w') as f:
-            json.dump(self.page_info, f, indent=2)
+        for name, data in results.items():
+            with open(f'{data_dir}/{name}.json', 'w') as f:
+                if name in ('page_info', 'aliases'):
+                    json.dump(data, f, indent=2)
+                else:
+                    # Lists of IDs are written compactly
+                    json.dump(data, f, separators=(',', ':'))
+        return num_words
+    
+    def load_results(self, data_dir='data'):
+        """
+        Load the URL table, graph, positional index, page info and aliases written by
+        save_results(), e.g. to update them with recrawl(). Page texts are
+        read from the saved store only as needed.
+        """
+        self.urls = UrlTable(load_urls(data_dir))
+        with open(f'{data_dir}/graph.json', 'r') as f:
+            self.graph = {page_id: array('I', targets)
+                          for page_id, targets in enumerate(json.load(f))}
+        index, doc_lengths = load_index(data_dir)
+        self.index_builder.clear()
+        self.index.update(index)
+        self.doc_lengths.update(enumerate(doc_lengths))
+        with open(f'{data_dir}/page_info.json', 'r') as f:
+            self.page_info = json.load(f)
+        try:
+            with open(f'{data_dir}/aliases.json', 'r') as f:
+                self.aliases = {self.urls.intern(alias): self.urls.intern(canonical)
+                                for alias, canonical in json.load(f).items()}
+        except FileNotFoundError:
+            self.aliases = {}
+        self.visited = set(self.graph)
+        self.docs.close()
+        self.docs = DocStoreWriter()
+        if self.saved_docs is not None:
+            self.saved_docs.close()
+        self.saved_docs = load_texts(data_dir)
+    
+    def recrawl(self, data_dir='data', delay=0.1, concurrency=8, max_pages=None):
+        """
+        Incrementally refresh the crawl results saved in data_dir.
         
-        print(f"\nResults saved to {data_dir}/")
-        print(f"  - Graph: {len(self.graph)} pages")
-        print(f"  - Index: {len(index_dict)} unique words")
-        print(f"  - Page info: {len(self.page_info)} pages")
\ No newline at end of file
+        Pages that are due according to their freshness schedule (see
+        freshness.py) are fetched again, at most max_pages of them, most
+        overdue first. A page whose content hash has not changed is only
+        rescheduled. For a changed page, only its postings, out-edges, page
+        info and text are updated. Pages that fail to fetch on two recrawls
+        in a row are removed. Only the data files that changed are rewritten.
+        
+        If the search index (see index_store.py) is up to date, the changed
+        pages are added to it as a new segment, which running search engines
+        pick up, and segments are merged in the background. After removals,
+        which renumber the pages, it is rebuilt instead.
+        
+        Links to pages that are not in the graph are ignored; a full crawl
+        is needed to discover new pages.
+        """
+        self.load_results(data_dir)
+        store = IndexStore(data_dir)
+        store_is_fresh = store.exists() and not store.is_stale()
+        schedule = FreshnessSchedule(data_dir)
+        due = schedule.due(self.urls[page_id] for page_id in self.graph)
+        if max_pages is not None:
+            due = due[:max_pages]
+        
+        print(f"Recrawling {len(due)} of {len(self.graph)} pages "
+              f"(concurrency: {concurrency})\n")
+        
+        # The words each page is currently indexed under
+        self._page_words = defaultdict(set)
+        for word, postings in self.index.items():
+            for page_id in postings:
+                self._page_words[page_id].add(word)
+        
+        # Spread the fetches over hosts, so workers rarely wait on the same one
+        by_host = defaultdict(deque)
+        for url in due:
+            by_host[urlparse(url).netloc].append(url)
+        ordered = []
+        while by_host:
+            for host in list(by_host):
+                ordered.append(by_host[host].popleft())
+                if not by_host[host]:
+                    del by_host[host]
+        
+        def fetch(url):
+            self.politeness.wait(url)
+            return self._fetch(url)
+        
+        self._start_politeness(delay)
+        changed_files = set()
+        updated = {}  # page ID -> new parse_page() result, for pages whose data changed
+        removed = set()
+        counts = defaultdict(int)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            futures = {executor.submit(fetch, url): url for url in ordered}
+            for i, future in enumerate(as_completed(futures), 1):
+                url = futures[future]
+                page_id = self.urls.get(url)
+                real_url, html_content = future.result()
+                
+                if html_content is None:
+                    counts['failed'] += 1
+                    if schedule.record_failure(url) >= 2:
+                        removed.add(page_id)
+                    status = "FAILED"
+                elif not schedule.record(url, content_hash(html_content)):
+                    counts['unchanged'] += 1
+                    status = "unchanged"
+                else:
+                    counts['changed'] += 1
+                    if self.cache is not None and real_url != url:
+                        self.cache.alias(url, real_url)
+                    page = parse_page(html_content, real_url)
+                    page_changes = self._update_page(page_id, page)
+                    if page_changes & {'index', 'page_info', 'docs'}:
+                        updated[page_id] = page
+                    changed_files |= page_changes
+                    status = "changed"
+                print(f"{i:5d}/{len(due):5d} {url} ({status})")
+        finally:
+            # On Ctrl+C nothing is written, so the saved results stay consistent
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if removed:
+            for page_id in removed:
+                schedule.forget(self.urls[page_id])
+            changed_files |= self._remove_pages(removed)
+        
+        # Without removals, the loaded IDs are kept, so unchanged files stay valid
+        self._write_results(data_dir, changed_files)
+        schedule.save()
+        
+        merging = None
+        if store.exists():
+            if store_is_fresh and not removed:
+                if updated:
+                    self._add_to_store(store, updated)
+                    merging = store.start_merging()
+            else:
+                store.rebuild()
+        
+        print(f"\nRecrawl complete!")
+        print(f"Unchanged: {counts['unchanged']}, changed: {counts['changed']}, "
+              f"failed: {counts['failed']}, removed: {len(removed)}")
+        print(f"Updated: {', '.join(sorted(changed_files)) or 'nothing'}")
+        if merging is not None:
+            merging.join()
+            print(f"Search index: {len(updated)} pages updated, "
+                  f"{len(store.read_manifest()['segments'])} segments")
+        return 'graph' in changed_files
+    
+    def _add_to_store(self, store, pages):
+        """Add the new versions of recrawled pages to the search index as one segment."""
+        words = defaultdict(list)
+        docs = []
+        for page_id in sorted(pages):
+            page = pages[page_id]
+            for word, positions in page['positions'].items():
+                words[word].append((page_id, positions))
+            docs.append((page_id, self.urls[page_id], page['title'], page['snippet'],
+                         page['length'], page['content']))
+        store.add_pages(sorted(words.items()), docs)
+    
+    def _update_page(self, page_id, page):
+        """
+        Bring the index, graph, page info and text of a recrawled page up to date
+        with its new parse_page() result. Returns the names of the data
+        files that changed.
+        """
+        changed_files = set()
+        
+        old_words = self._page_words[page_id]
+        new_positions = page['positions']
+        unchanged_words = set()
+        for word in old_words:
+            postings = self.index[word]
+            positions = new_positions.get(word)
+            if positions is not None and postings.get(page_id).tolist() == positions:
+                unchanged_words.add(word)
+                continue
+            postings.remove(page_id)
+            if not postings:
+                del self.index[word]
+            changed_files.add('index')
+        for word, positions in new_positions.items():
+            if word not in unchanged_words:
+                self.index[word].add(page_id, positions)
+                changed_files.add('index')
+        if self.doc_lengths.get(page_id) != page['length']:
+            self.doc_lengths[page_id] = page['length']
+            changed_files.add('index')
+        self._page_words[page_id] = set(new_positions)
+        
+        # Same edges as the induced subgraph: links to crawled pages only,
+        # with links to near-duplicates pointing to their canonical page.
+        # The fetcher returns links in no particular order (it varies with
+        # hash randomization), so they are compared and stored sorted
+        links = []
+        for link in page['links']:
+            link_id = self.urls.get(self.normalize_url(link))
+            if link_id is None:
+                continue
+            link_id = self.aliases.get(link_id, link_id)
+            if link_id in self.visited:
+                links.append(link_id)
+        links = array('I', sorted(links))
+        if links != array('I', sorted(self.graph[page_id])):
+            self.graph[page_id] = links
+            changed_files.add('graph')
+        
+        url = self.urls[page_id]
+        info = {'title': page['title'], 'snippet': page['snippet']}
+        if info != self.page_info.get(url):
+            self.page_info[url] = info
+            changed_files.add('page_info')
+        
+        saved_text = self.saved_docs.get(page_id) if self.saved_docs is not None else None
+        if page['content'][:MAX_TEXT_LENGTH] != saved_text:
+            self.docs.add(page_id, page['content'])
+            changed_files.add('docs')
+        
+        return changed_files
+    
+    def _remove_pages(self, page_ids):
+        """
+        Remove pages (and all links to them) from the index, graph, page
+        info and aliases. Returns the names of the data files that changed.
+        """
+        for page_id in page_ids:
+            for word in self._page_words.pop(page_id, ()):
+                postings = self.index[word]
+                postings.remove(page_id)
+                if not postings:
+                    del self.index[word]
+            self.doc_lengths.pop(page_id, None)
+            self.page_info.pop(self.urls[page_id], None)
+            del self.graph[page_id]
+            self.visited.discard(page_id)
+        
+        for source, targets in self.graph.items():
+            if any(target in page_ids for target in targets):
+                self.graph[source] = array('I', (target for target in targets
+                                                 if target not in page_ids))
+        
+        # The remaining pages are renumbered, so every ID-based file changes
+        changed_files = {'urls', 'graph', 'index', 'page_info', 'docs'}
+        orphans = [alias for alias, canonical in self.aliases.items() if canonical in page_ids]
+        for alias in orphans:
+            del self.aliases[alias]
+        if orphans:
+            changed_files.add('aliases')
+        return changed_files
@@ -0,0 +1,244 @@
+"""
+Block-compressed document store with random access by page ID.
+
+The text of every page is kept so that search results can show the part of
+a page that matches the query (see snippets.py). Texts are packed into
+blocks of about BLOCK_SIZE bytes, each compressed with zlib on its own:
+blocks are big enough to compress well, and reading one page only
+decompresses the block it is in. Recently read blocks are cached, and
+texts are cut to MAX_TEXT_LENGTH characters, so the cost of reading a page
+is bounded whatever its size.
+
+A store is written by a DocStoreWriter, which takes pages in any order
+(e.g. in the order a crawl fetches them) and streams full blocks to a
+temporary file, and read by a DocStore, from a file (data/docs.bin) or a
+section of a larger file (index segments embed the texts of their pages,
+see binary_index.py).
+
+Layout, starting with a header (magic, byte order, counts and the offset
+and length of each section, from the start of the store), then these
+sections, each 8-byte aligned:
+
+    blocks         the compressed blocks, back to back
+    block_offsets  uint64[num_blocks + 1]  where each block starts in `blocks`
+    doc_ids        uint32[num_docs]        page IDs, sorted
+    doc_blocks     uint32[num_docs]        block of each page's text
+    doc_slots      uint32[num_docs]        position of the text in its block
+
+A block decompresses to uint32 n, uint32[n + 1] offsets of the texts after
+them, and the texts in UTF-8. Numbers are in the machine's byte order.
+"""
+
+import bisect
+import io
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from functools import lru_cache
+
+DOCS_FILE = 'docs.bin'
+
+# Uncompressed bytes of text per block
+BLOCK_SIZE = 16 * 1024
+# Longer texts are cut to this many characters
+MAX_TEXT_LENGTH = 32 * 1024
+# Decompressed blocks kept per store
+CACHE_BLOCKS = 32
+COMPRESSION_LEVEL = 6
+
+_MAGIC = b'BRNDOC01'
+_SECTIONS = ('blocks', 'block_offsets', 'doc_ids', 'doc_blocks', 'doc_slots')
+# magic, byte order, number of pages, number of blocks, then the (offset, length) of each section
+_HEADER = struct.Struct(f'<8sBxxxxxxxQQ{2 * len(_SECTIONS)}Q')
+_BYTE_ORDERS = {'little': 0, 'big': 1}
+
+
+class DocStoreWriter:
+    """
+    Collects page texts and writes them as a document store.
+
+    Args:
+        block_size: Uncompressed bytes of text per block.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._file = None                     # compressed blocks, created on the first flush
+        self._block_offsets = array('Q', [0])
+        self.doc_ids = array('I')             # in the order they were added
+        self._doc_blocks = array('I')
+        self._doc_slots = array('I')
+        self._texts = []                      # UTF-8 texts of the block being filled
+        self._size = 0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, doc_id, text):
+        """Add the text of a page. If a page is added twice, the last text is kept."""
+        data = text[:MAX_TEXT_LENGTH].encode('utf-8')
+        self.doc_ids.append(doc_id)
+        self._doc_blocks.append(len(self._block_offsets) - 1)
+        self._doc_slots.append(len(self._texts))
+        self._texts.append(data)
+        self._size += len(data)
+        if self._size >= self.block_size:
+            self._flush()
+
+    def write(self, path, key=None):
+        """
+        Write the store to path, replacing it atomically. With key, page IDs
+        are replaced by key(page ID) (e.g. to renumber pages while saving),
+        and pages for which it returns None are left out.
+        """
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            self._write_to(f, key)
+        os.replace(temporary, path)
+
+    def to_bytes(self, key=None):
+        """The store as bytes, e.g. to embed it in another file."""
+        f = io.BytesIO()
+        self._write_to(f, key)
+        return f.getvalue()
+
+    def close(self):
+        """Remove the temporary file of the blocks."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        """Compress the block being filled and append it to the temporary file."""
+        if not self._texts:
+            return
+        offsets = array('I', [0])
+        for data in self._texts:
+            offsets.append(offsets[-1] + len(data))
+        block = zlib.compress(struct.pack('=I', len(self._texts)) + offsets.tobytes()
+                              + b''.join(self._texts), COMPRESSION_LEVEL)
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='docs-')
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(block)
+        self._block_offsets.append(self._block_offsets[-1] + len(block))
+        self._texts = []
+        self._size = 0
+
+    def _write_to(self, f, key):
+        self._flush()
+        latest = {}
+        for i, doc_id in enumerate(self.doc_ids):
+            if key is not None:
+                doc_id = key(doc_id)
+                if doc_id is None:
+                    continue
+            latest[doc_id] = i
+        doc_ids = array('I', sorted(latest))
+        entries = [latest[doc_id] for doc_id in doc_ids]
+        tables = {
+            'block_offsets': self._block_offsets.tobytes(),
+            'doc_ids': doc_ids.tobytes(),
+            'doc_blocks': array('I', (self._doc_blocks[i] for i in entries)).tobytes(),
+            'doc_slots': array('I', (self._doc_slots[i] for i in entries)).tobytes(),
+        }
+
+        start = f.tell()
+        table = []
+        offset = _HEADER.size
+        for name in _SECTIONS:
+            offset += -offset % 8
+            length = self._block_offsets[-1] if name == 'blocks' else len(tables[name])
+            table += [offset, length]
+            offset += length
+        f.write(_HEADER.pack(_MAGIC, _BYTE_ORDERS[sys.byteorder], len(doc_ids),
+                             len(self._block_offsets) - 1, *table))
+        for name, section_offset in zip(_SECTIONS, table[::2]):
+            f.write(b'\0' * (start + section_offset - f.tell()))
+            if name == 'blocks':
+                if self._file is not None:
+                    self._file.seek(0)
+                    shutil.copyfileobj(self._file, f)
+            else:
+                f.write(tables[name])
+
+
+class DocStore:
+    """
+    Read-only access to a document store in a buffer (e.g. a memoryview of
+    a memory-mapped file); see open() to read a file. Blocks are
+    decompressed on demand, and the last CACHE_BLOCKS read are cached.
+    """
+
+    def __init__(self, buffer, cache_blocks=CACHE_BLOCKS):
+        self._mmap = None
+        self._buffer = memoryview(buffer)
+        header = _HEADER.unpack_from(self._buffer)
+        magic, byte_order, self.num_docs, self.num_blocks = header[:4]
+        if magic != _MAGIC:
+            raise ValueError("not a document store (or written by another version)")
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError("document store written on a machine with another byte order")
+
+        table = header[4:]
+        sections = {name: self._buffer[offset:offset + length]
+                    for name, offset, length in zip(_SECTIONS, table[::2], table[1::2])}
+        self._blocks = sections['blocks']
+        self._block_offsets = sections['block_offsets'].cast('Q')
+        self.doc_ids = sections['doc_ids'].cast('I')
+        self._doc_blocks = sections['doc_blocks'].cast('I')
+        self._doc_slots = sections['doc_slots'].cast('I')
+        self._block = lru_cache(maxsize=cache_blocks)(self._read_block)
+
+    @classmethod
+    def open(cls, path, cache_blocks=CACHE_BLOCKS):
+        """Open a store file with mmap."""
+        with open(path, 'rb') as f:
+            store_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        store = cls(store_map, cache_blocks)
+        store._mmap = store_map
+        return store
+
+    def __len__(self):
+        return self.num_docs
+
+    def __contains__(self, doc_id):
+        return self._position(doc_id) is not None
+
+    def _position(self, doc_id):
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        if i < self.num_docs and self.doc_ids[i] == doc_id:
+            return i
+        return None
+
+    def _read_block(self, block):
+        """(text offsets, texts) of a block."""
+        start, end = self._block_offsets[block], self._block_offsets[block + 1]
+        data = zlib.decompress(self._blocks[start:end])
+        count = struct.unpack_from('=I', data)[0]
+        offsets = array('I')
+        offsets.frombytes(data[4:8 + 4 * count])
+        return offsets, data[8 + 4 * count:]
+
+    def get(self, doc_id, default=None):
+        """The text of a page, or default if it is not in the store."""
+        i = self._position(doc_id)
+        if i is None:
+            return default
+        offsets, texts = self._block(self._doc_blocks[i])
+        slot = self._doc_slots[i]
+        return texts[offsets[slot]:offsets[slot + 1]].decode('utf-8')
+
+    def close(self):
+        self._block.cache_clear()
+        for view in (self._block_offsets, self.doc_ids, self._doc_blocks, self._doc_slots,
+                     self._blocks):
+            view.release()
+        self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
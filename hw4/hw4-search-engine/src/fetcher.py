@@ -13,13 +13,44 @@ The output is a list (may be empty "[]") of hyperlinks which looks like:
 The output is "None" if the URL is not a valid HTML page or some error occurred.
 
 Note: Updated urllib request to avoid 403 errors (Andrew Ma, ama2@caltech.edu)
+
+Note: Requests now go through a pool of keep-alive connections and ask for
+gzip-compressed responses. fetch_html_page also accepts an optional PageCache
+(see page_cache.py) to revalidate previously fetched pages with conditional
+requests instead of downloading them again.
+
+Note: Bodies are read in chunks and decompressed and decoded as they arrive,
+using the charset from the headers or a <meta> tag, and pages over a maximum
+size are abandoned.
+
+Note: fetch_html_page can report the latency, bytes received and failure
+reason of every fetch to an optional CrawlMetrics (see metrics.py).
 """
 
 from html.parser import HTMLParser
-from urllib.parse import urljoin
-from urllib import request
+from urllib.parse import urljoin, urlsplit, quote
 from urllib.error import URLError
-import urllib
+import codecs
+import http.client
+import re
+import socket
+import threading
+import time
+import zlib
+
+# Request headers sent with every fetch
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+TIMEOUT = 2
+MAX_REDIRECTS = 10
+MAX_PAGE_SIZE = 5 * 1024 * 1024   # largest (decompressed) page body we accept, in bytes
+CHUNK_SIZE = 64 * 1024            # bytes read from the socket at a time
+SNIFF_SIZE = 1024                 # bytes searched for a <meta> charset declaration
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
 
 
 # Our version of the HTMLParser, which handles start tags differently than Python's
@@ -51,25 +82,272 @@ class MyHTMLParser(HTMLParser):
         res.discard(current_url)    # self-link is removed
         return list(res)
 
+# A pool of open keep-alive connections, so that consecutive requests to the
+# same host reuse one TCP (and TLS) connection instead of opening a new one.
+class ConnectionPool:
+    def __init__(self, max_idle_per_host=8, timeout=TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}   # (scheme, host) -> list of idle connections
+        self._lock = threading.Lock()
+
+    # Take an idle connection to the host if there is one, else open a new one.
+    # Returns the connection and whether it was reused.
+    def get(self, scheme, host):
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, timeout=self.timeout), False
+
+    # Return a connection whose last response has been read in full.
+    def put(self, scheme, host, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+_pool = ConnectionPool()
+
+# Raised when a response body is larger than the allowed maximum
+class PageTooLarge(Exception):
+    pass
+
+# Find the charset declared in a <meta> tag near the start of a page
+def _meta_charset(data):
+    match = _META_CHARSET_RE.search(data)
+    return match.group(1).decode('ascii') if match else None
+
+# An incremental decoder for the charset, with undecodable bytes replaced
+# (UTF-8 for missing or unknown charsets)
+def _decoder(charset):
+    try:
+        return codecs.getincrementaldecoder(charset or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+# Read a response body in chunks, decompressing and decoding it as it
+# arrives, so only the decoded text is ever held in full. The charset comes
+# from the Content-Type header, else from a <meta> tag in the first
+# SNIFF_SIZE bytes, else defaults to UTF-8. Raises PageTooLarge once the
+# decompressed body exceeds max_size bytes. Returns the text and the
+# number of (compressed) bytes received.
+def _read_text(response, max_size):
+    encoding = (response.getheader('Content-Encoding') or '').lower()
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = None
+
+    charset = response.msg.get_content_charset()
+    decoder = None
+    sniffed = b''   # start of the body, held until the charset is known
+    parts = []
+    size = 0
+    num_bytes = 0
+
+    def add(data):
+        nonlocal decoder, sniffed, size
+        size += len(data)
+        if size > max_size:
+            raise PageTooLarge(f'body larger than {max_size} bytes')
+        if decoder is None:
+            sniffed += data
+            if charset is None and len(sniffed) < SNIFF_SIZE:
+                return
+            decoder = _decoder(charset or _meta_charset(sniffed))
+            data = sniffed
+        parts.append(decoder.decode(data))
+
+    while chunk := response.read(CHUNK_SIZE):
+        num_bytes += len(chunk)
+        if decompressor is None:
+            add(chunk)
+            continue
+        while chunk:
+            try:
+                # Bounded, so a small compressed body cannot expand unchecked
+                add(decompressor.decompress(chunk, max_size - size + 1))
+            except zlib.error:
+                if encoding != 'deflate' or size:
+                    raise
+                # Some servers send a raw deflate stream without the zlib header
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                continue
+            chunk = decompressor.unconsumed_tail
+    if decompressor is not None:
+        add(decompressor.flush())
+
+    if decoder is None:
+        decoder = _decoder(charset or _meta_charset(sniffed))
+        parts.append(decoder.decode(sniffed))
+    parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts), num_bytes
+
+# Send one GET request over a pooled connection. Returns the response with its
+# body already read and decoded (as `text`, with the bytes received in
+# `num_bytes`), or with text None if it does not have the wanted content type
+# (None accepts any type) or its Content-Length is over max_size. Bodies that
+# turn out to be larger than max_size raise PageTooLarge.
+def _get(url, headers, content_type='text/html', max_size=MAX_PAGE_SIZE):
+    parts = urlsplit(url)
+    path = quote(parts.path or '/', safe="/%:@!$&'()*+,;=-._~")
+    if parts.query:
+        path += '?' + parts.query
+
+    for attempt in range(2):
+        conn, reused = _pool.get(parts.scheme, parts.netloc)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+            conn.close()
+            # The server may have closed an idle connection; retry on a new one
+            if reused and attempt == 0:
+                continue
+            raise
+        except:
+            conn.close()
+            raise
+        break
+
+    # Only download the body if it is html (not mp3/avi/...) or a redirect,
+    # and not announced as too large
+    response.text = None
+    response.num_bytes = 0
+    response.too_large = False
+    wanted = content_type is None or content_type in (response.getheader('Content-Type') or '') \
+             or 300 <= response.status < 400
+    length = response.getheader('Content-Length') or ''
+    if wanted and length.isdigit() and int(length) > max_size:
+        response.too_large = True
+        wanted = False
+
+    if wanted:
+        try:
+            response.text, response.num_bytes = _read_text(response, max_size)
+        except:
+            conn.close()
+            raise
+
+    if not wanted or response.will_close:
+        conn.close()
+    else:
+        _pool.put(parts.scheme, parts.netloc, conn)
+    return response
+
+# Why a fetch raised, for metrics
+def _failure_reason(error):
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, PageTooLarge):
+        return 'too_large'
+    if isinstance(error, (UnicodeDecodeError, zlib.error)):
+        return 'decode_error'
+    if isinstance(error, (OSError, http.client.HTTPException)):
+        return 'connection_error'
+    return type(error).__name__
+
 # Fetch an HTML file and return the real (redirected) URL and the content.
-def fetch_html_page(url):
+# Connections are kept alive and reused, and responses are compressed when the
+# server supports it. If a PageCache is given, requests are made conditional on
+# the cached copy, which is returned on "304 Not Modified" (if the cached body
+# cannot be read, the page is requested again without conditions). If a
+# CrawlMetrics is given, the fetch is recorded in it.
+def fetch_html_page(url, cache=None, metrics=None, max_size=MAX_PAGE_SIZE):
     content = None
     real_url = url
-    req = urllib.request.Request(
-        url=url,
-        headers={'User-Agent': 'Mozilla/5.0'}
-    )
+    started = time.perf_counter()
+    num_bytes = 0
+    num_requests = 0
+    status = None
+    failure = 'too_many_redirects'
+    conditional = cache is not None
     try:
-        with urllib.request.urlopen(req, timeout=2) as usock:
-            real_url = usock.url   # real_url will be changed if there is a redirection
-            if "text/html" in usock.info()['content-type']:
-                content=usock.read().decode('utf-8')    # only fetch it if it is html (not mp3/avi/...)
+        # One more request than redirects, for a retry after a cache miss
+        for _ in range(MAX_REDIRECTS + 2):
+            headers = dict(HEADERS)
+            cached = cache.lookup(real_url) if conditional else None
+            if cached is not None:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+            response = _get(real_url, headers, max_size=max_size)
+            num_requests += 1
+            num_bytes += response.num_bytes
+            status = response.status
+
+            if response.status in REDIRECT_STATUSES:
+                location = response.getheader('Location')
+                if not location:
+                    failure = 'bad_redirect'
+                    break
+                real_url = urljoin(real_url, location)   # real_url will be changed if there is a redirection
+                continue
+
+            if response.status == 304 and cached is not None:
+                content = cache.load(cached['sha1'])
+                if content is None and conditional:
+                    # The cached body is gone or corrupt: ask for the whole page
+                    conditional = False
+                    continue
+                failure = 'cache_miss'
+            elif response.status == 200 and response.text is not None:
+                content = response.text
+                if cache is not None:
+                    cache.store(real_url, content, etag=response.getheader('ETag'),
+                                last_modified=response.getheader('Last-Modified'))
+            elif response.status == 200:
+                failure = 'too_large' if response.too_large else 'not_html'
+            else:
+                failure = f'http_{response.status}'
+            break
     # Terminate on CTRL+C sequences, and pass URLError up the stack.
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        failure = _failure_reason(e)
+    if metrics is not None:
+        metrics.record_fetch(time.perf_counter() - started, num_bytes, num_requests, status,
+                             failure=None if content is not None else failure)
+    return (real_url, content)
+
+# Fetch a plain-text resource such as robots.txt, following redirects.
+# Returns the final HTTP status (None if the request failed) and the content.
+def fetch_text(url):
+    status = None
+    content = None
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            response = _get(url, HEADERS, content_type=None)
+            status = response.status
+            location = response.getheader('Location')
+            if status in REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            if status == 200:
+                content = response.text
+            break
     except KeyboardInterrupt:
         raise
     except:
         pass
-    return (real_url, content)
+    return (status, content)
 
 # Fetch the hyperlinks by first fetching the content then using our HTMLParser to
 # parse them.
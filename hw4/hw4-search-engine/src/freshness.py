@@ -0,0 +1,98 @@
+"""
+Freshness schedule for incremental recrawls.
+
+For every crawled page we remember the hash of its content, when it was
+last checked and how long to wait before checking it again. The interval
+adapts to how often the page actually changes: it is halved each time a
+recrawl finds new content and doubled each time the page is unchanged,
+within [MIN_INTERVAL, MAX_INTERVAL]. Pages that change daily are then
+revisited daily, while static pages are only checked every few weeks.
+
+A full crawl records the hash of every page it fetched, so the first
+recrawl already tells changed pages from unchanged ones. The schedule is
+stored in data/crawl_state.json:
+    {url: {"sha1": ..., "checked": unix time, "interval": seconds, "failures": n}}
+"""
+
+import hashlib
+import json
+import os
+import time
+
+STATE_FILE = 'crawl_state.json'
+
+HOUR = 3600
+DAY = 24 * HOUR
+MIN_INTERVAL = HOUR
+MAX_INTERVAL = 30 * DAY
+DEFAULT_INTERVAL = DAY
+
+
+def content_hash(html_content):
+    """The hash of a page's HTML that changes are detected by."""
+    return hashlib.sha1(html_content.encode('utf-8')).hexdigest()
+
+
+class FreshnessSchedule:
+    def __init__(self, data_dir='data'):
+        self.path = os.path.join(data_dir, STATE_FILE)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.pages = {}
+
+    def next_check(self, url):
+        """Unix time at which the page is due; pages never checked are due now."""
+        state = self.pages.get(url)
+        if state is None:
+            return 0
+        return state['checked'] + state['interval']
+
+    def due(self, urls, now=None):
+        """The URLs that are due for a check, most overdue first."""
+        now = time.time() if now is None else now
+        due = [(self.next_check(url), url) for url in urls]
+        return [url for next_check, url in sorted(due) if next_check <= now]
+
+    def record(self, url, sha1, now=None):
+        """
+        Record a successful fetch of the page with content hash `sha1`, and
+        reschedule it. Returns True if the content changed since the last
+        check (or the page had never been checked).
+        """
+        now = time.time() if now is None else now
+        state = self.pages.get(url)
+        if state is None:
+            self.pages[url] = {'sha1': sha1, 'checked': now,
+                               'interval': DEFAULT_INTERVAL, 'failures': 0}
+            return True
+
+        changed = state['sha1'] != sha1
+        if changed:
+            state['interval'] = max(MIN_INTERVAL, state['interval'] / 2)
+        else:
+            state['interval'] = min(MAX_INTERVAL, state['interval'] * 2)
+        state.update(sha1=sha1, checked=now, failures=0)
+        return changed
+
+    def record_failure(self, url, now=None):
+        """
+        Record a failed fetch. The page is retried at the next recrawl.
+        Returns the number of consecutive failures.
+        """
+        now = time.time() if now is None else now
+        state = self.pages.setdefault(url, {'sha1': None, 'interval': DEFAULT_INTERVAL,
+                                            'failures': 0})
+        state['checked'] = now - state['interval']  # due again right away
+        state['failures'] += 1
+        return state['failures']
+
+    def forget(self, url):
+        self.pages.pop(url, None)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.pages, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,179 @@
+"""
+The crawl frontier: the FIFO queue of URLs waiting to be fetched.
+
+Every URL that has ever been added is remembered in a set, so checking
+whether a link is "already enqueued or visited" is a constant-time lookup
+instead of a scan of the queue. Once the queue grows past a memory
+threshold, its cold tail is written to disk in segments and read back
+in order as the head drains, so very large crawls keep a bounded amount
+of the queue in RAM.
+
+URLs can also be added with low priority (e.g. links found on near-duplicate
+pages). They wait in a second FIFO queue that is only popped from when the
+normal one is empty.
+"""
+
+import os
+import shutil
+import tempfile
+from collections import deque
+
+
+class _SpillQueue:
+    """
+    A FIFO queue of strings that keeps at most `max_in_memory` items at the
+    head in memory and spills newer items to disk in segment files of
+    `segment_size` items each.
+    """
+
+    def __init__(self, max_in_memory, segment_size, get_spill_dir, name='segment'):
+        self.max_in_memory = max_in_memory
+        self.segment_size = segment_size
+        self._get_spill_dir = get_spill_dir
+        self.name = name
+
+        self.head = deque()      # oldest items, popped from the left
+        self.segments = deque()  # paths of spilled segment files, oldest first
+        self.tail = []           # newest items, waiting to be spilled
+        self.num_spilled = 0     # items currently stored in segment files
+        self._next_segment = 0
+
+    def __len__(self):
+        return len(self.head) + self.num_spilled + len(self.tail)
+
+    def push(self, item):
+        # Once anything has been spilled, new items must queue up behind it
+        if not self.segments and not self.tail and len(self.head) < self.max_in_memory:
+            self.head.append(item)
+            return
+
+        self.tail.append(item)
+        if len(self.tail) >= self.segment_size:
+            self._spill()
+
+    def pop(self):
+        if not self.head:
+            self._refill()
+        return self.head.popleft()
+
+    def __iter__(self):
+        """Iterate over queued items in FIFO order without removing them."""
+        yield from self.head
+        for path in self.segments:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    yield line.rstrip('\n')
+        yield from self.tail
+
+    def _spill(self):
+        path = os.path.join(self._get_spill_dir(), f'{self.name}-{self._next_segment:08d}.txt')
+        self._next_segment += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            for item in self.tail:
+                f.write(item + '\n')
+        self.segments.append(path)
+        self.num_spilled += len(self.tail)
+        self.tail = []
+
+    def _refill(self):
+        if self.segments:
+            path = self.segments.popleft()
+            with open(path, 'r', encoding='utf-8') as f:
+                items = [line.rstrip('\n') for line in f]
+            os.remove(path)
+            self.num_spilled -= len(items)
+            self.head.extend(items)
+        elif self.tail:
+            self.head.extend(self.tail)
+            self.tail = []
+        else:
+            raise IndexError("pop from an empty frontier")
+
+
+class Frontier:
+    """
+    FIFO crawl queue with constant-time deduplication and disk spill, plus
+    a low-priority lane that is served after the main queue.
+
+    Args:
+        max_in_memory: Number of queued URLs kept in memory (per lane)
+                       before newer ones are spilled to disk.
+        segment_size: Number of URLs per spilled segment file.
+        spill_dir: Directory for segment files. A temporary directory is
+                   created (and removed by close()) if not given.
+    """
+
+    def __init__(self, max_in_memory=100000, segment_size=10000, spill_dir=None):
+        self.seen = set()  # every URL ever added or marked seen
+        self._spill_dir = spill_dir
+        self._owns_spill_dir = False
+        self._queue = _SpillQueue(max_in_memory, segment_size, self._get_spill_dir)
+        self._low = _SpillQueue(max_in_memory, segment_size, self._get_spill_dir, name='low')
+
+    def __len__(self):
+        return len(self._queue) + len(self._low)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __contains__(self, url):
+        """True if the URL has ever been enqueued or marked seen."""
+        return url in self.seen
+
+    def __iter__(self):
+        """Iterate over queued URLs in the order they will be popped."""
+        yield from self._queue
+        yield from self._low
+
+    def queued(self, low_priority=False):
+        """Iterate over the URLs queued in one lane, in FIFO order."""
+        return iter(self._low if low_priority else self._queue)
+
+    def add(self, url, low_priority=False):
+        """Enqueue a URL unless it has been seen before. Returns True if added."""
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+        (self._low if low_priority else self._queue).push(url)
+        return True
+
+    def mark_seen(self, url):
+        """Record a URL (e.g. a redirect target) so that it is never enqueued."""
+        self.seen.add(url)
+
+    def requeue(self, url):
+        """Put back a URL that was popped but not fetched."""
+        self.seen.add(url)
+        self._queue.push(url)
+
+    def pop(self):
+        """
+        Remove and return the oldest queued URL, taking low-priority URLs
+        only once the main queue is empty.
+        """
+        if self._queue or not self._low:
+            return self._queue.pop()
+        return self._low.pop()
+
+    def close(self):
+        """
+        Drop any spilled segments, and remove the spill directory if we
+        created it. URLs still held in memory stay queued.
+        """
+        for lane in (self._queue, self._low):
+            for path in lane.segments:
+                if os.path.exists(path):
+                    os.remove(path)
+            lane.segments.clear()
+            lane.num_spilled = 0
+        if self._owns_spill_dir and self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+            self._owns_spill_dir = False
+
+    def _get_spill_dir(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='frontier-')
+            self._owns_spill_dir = True
+        os.makedirs(self._spill_dir, exist_ok=True)
+        return self._spill_dir
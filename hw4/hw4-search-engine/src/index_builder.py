@@ -0,0 +1,175 @@
+"""
+Single-pass in-memory index construction (SPIMI) with a memory budget.
+
+Pages are added to an in-memory positional index (see postings.py). When its
+estimated size goes over the memory budget, it is written to disk as a
+segment, with the words in sorted order, and emptied. At the end, a k-way
+merge over the sorted words of all segments (and what is left in memory)
+yields each word's complete posting list in turn, so the index files can be
+written without ever holding the whole index in memory.
+
+Segment files are JSON lines, one per word, in sorted word order:
+    [word, [page ID, ...], [[positions in 1st page], [positions in 2nd page], ...]]
+"""
+
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import weakref
+from collections import defaultdict
+from .postings import Postings
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Rough memory cost of a word in the in-memory index (dict entry, key string,
+# Postings object and its arrays), of a page in a posting list and of a position
+_WORD_BYTES = 400
+_POSTING_BYTES = 8
+_POSITION_BYTES = 4
+
+
+class IndexBuilder:
+    """
+    Builds a positional index that may not fit in memory.
+
+    Args:
+        memory_budget: Approximate number of bytes the in-memory part of the
+                       index may use before it is flushed to a segment
+                       (None to never flush).
+        segment_dir: Directory for segment files. A temporary directory is
+                     created (and removed by close()) if not given.
+        name: Prefix of the segment file names, so that several builders
+              (e.g. in worker processes) can share a segment directory.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, segment_dir=None, name='segment'):
+        self.memory_budget = memory_budget
+        self.name = name
+        self.index = defaultdict(Postings)  # word -> Postings, for pages not flushed yet
+        self.doc_lengths = {}                # page ID -> number of words, for all pages
+        self.segments = []                   # paths of flushed segment files, oldest first
+        self._size = 0
+        self._segment_dir = segment_dir
+        self._remove_segment_dir = None      # finalizer of a temporary segment directory
+
+    def add(self, doc_id, positions, length):
+        """
+        Index a page, given the positions of each of its words (as returned
+        by term_positions()) and its length in words.
+        """
+        for word, word_positions in positions.items():
+            if word not in self.index:
+                self._size += _WORD_BYTES
+            self.index[word].add(doc_id, word_positions)
+            self._size += _POSTING_BYTES + _POSITION_BYTES * len(word_positions)
+        self.doc_lengths[doc_id] = length
+        if self.memory_budget is not None and self._size > self.memory_budget:
+            self.flush()
+
+    def flush(self):
+        """Write the in-memory index to a new segment file and empty it."""
+        if not self.index:
+            return
+        path = os.path.join(self._get_segment_dir(), f'{self.name}-{len(self.segments):06d}.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for word in sorted(self.index):
+                postings = self.index[word]
+                entry = [word, postings.doc_ids.tolist(),
+                         [positions.tolist() for _, _, positions in postings.items()]]
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.segments.append(path)
+        self.index.clear()
+        self._size = 0
+
+    def add_segments(self, paths, doc_lengths):
+        """
+        Include segments flushed by other builders (e.g. in worker processes)
+        in the merge, given their files and the lengths of their pages. The
+        files are then owned by this builder.
+        """
+        self.segments.extend(paths)
+        self.doc_lengths.update(doc_lengths)
+
+    def merged(self, key=None):
+        """
+        Iterate over (word, [(page ID, positions), ...]) for every word, in
+        sorted word order, with the pages of each word from all segments and
+        from memory sorted by page ID, or by key(page ID) if given (key
+        replaces the page IDs, e.g. to renumber pages while saving).
+        """
+        sources = [self._read_segment(path) for path in self.segments]
+        sources.append((word, postings.doc_ids,
+                        [positions.tolist() for _, _, positions in postings.items()])
+                       for word, postings in sorted(self.index.items()))
+
+        entries = heapq.merge(*sources, key=lambda entry: entry[0])
+        for word, word_entries in itertools.groupby(entries, key=lambda entry: entry[0]):
+            pages = [(doc_id if key is None else key(doc_id), positions)
+                     for _, doc_ids, positions_lists in word_entries
+                     for doc_id, positions in zip(doc_ids, positions_lists)]
+            pages.sort(key=lambda page: page[0])
+            yield word, pages
+
+    def clear(self):
+        """Drop all indexed pages, including flushed segments."""
+        self.index.clear()
+        self.doc_lengths.clear()
+        self._size = 0
+        self._remove_segments()
+
+    def close(self):
+        """Drop the segment files, and remove the segment directory if we created it."""
+        self._remove_segments()
+        if self._remove_segment_dir is not None:
+            self._remove_segment_dir()
+            self._segment_dir = None
+            self._remove_segment_dir = None
+
+    def _remove_segments(self):
+        for path in self.segments:
+            if os.path.exists(path):
+                os.remove(path)
+        self.segments = []
+
+    def _read_segment(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _get_segment_dir(self):
+        if self._segment_dir is None:
+            self._segment_dir = tempfile.mkdtemp(prefix='index-segments-')
+            # Also clean up if the builder is dropped without being closed
+            self._remove_segment_dir = weakref.finalize(
+                self, shutil.rmtree, self._segment_dir, ignore_errors=True)
+        os.makedirs(self._segment_dir, exist_ok=True)
+        return self._segment_dir
+
+
+def write_index(data_dir, words, doc_lengths):
+    """
+    Write data/index.json and data/positions.json (see postings.py) from
+    (word, [(page ID, positions), ...]) pairs in sorted word order, e.g. from
+    IndexBuilder.merged(), one word at a time. doc_lengths lists the length
+    of every page by ID. Returns the number of words written.
+    """
+    separators = (',', ':')
+    num_words = 0
+    with open(f'{data_dir}/index.json', 'w') as index_file, \
+         open(f'{data_dir}/positions.json', 'w') as positions_file:
+        index_file.write('{')
+        positions_file.write('{"doc_lengths":' + json.dumps(doc_lengths, separators=separators)
+                             + ',"positions":{')
+        for word, pages in words:
+            key = (',' if num_words else '') + json.dumps(word) + ':'
+            index_file.write(key + json.dumps([doc_id for doc_id, _ in pages],
+                                              separators=separators))
+            positions_file.write(key + json.dumps([positions for _, positions in pages],
+                                                  separators=separators))
+            num_words += 1
+        index_file.write('}')
+        positions_file.write('}}')
+    return num_words
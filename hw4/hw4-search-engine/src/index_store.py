@@ -0,0 +1,597 @@
+"""
+Segmented, incrementally updatable search index (log-structured merge).
+
+The index the search engine reads lives in data/index/ as a set of immutable
+segment files (see binary_index.py) and a manifest listing the live ones:
+
+    data/index/manifest.json   # {"generation": n, "format": n, "next_file": n, "pagerank": file name,
+                               #  "segments": [{"name": file name, "num_docs": n,
+                               #                "deleted": [page ID, ...]}, ...]}
+    data/index/segment-*.seg   # segments
+    data/index/pagerank-*.bin  # PageRank scores by page ID (float64, native byte order)
+
+Updated pages are written to a new, small segment, and their old versions
+are marked deleted (tombstoned) in the older segments rather than rewritten,
+so a page is live in exactly one segment. Deleted pages are just tombstoned.
+A merge policy then combines segments of similar size, and rewrites
+segments that are mostly deleted, dropping the deleted pages; merges can run
+in a background thread while pages are being added.
+
+Every change writes a new manifest (atomically, with a new generation
+number) and only then removes the files it no longer lists. A reader opens
+the segments of one manifest and keeps using them even if they are removed
+(their memory mappings stay valid), so the search engine can switch to a new
+segment set by just opening the latest manifest.
+
+Only one process should update the store at a time.
+"""
+
+import heapq
+import itertools
+import json
+import math
+import mmap
+import os
+import threading
+from array import array
+from collections import defaultdict
+import numpy as np
+from .binary_index import FORMAT, IndexSegment, write_segment
+from .doc_store import DOCS_FILE, DocStore
+
+INDEX_DIR = 'index'
+MANIFEST_FILE = 'manifest.json'
+
+# Segments are merged MERGE_FACTOR at a time once that many are in the same
+# size tier (tier = log base MERGE_FACTOR of the number of live pages)
+MERGE_FACTOR = 4
+# A segment is rewritten when more than this fraction of its pages are deleted
+MAX_DELETED_FRACTION = 0.5
+
+# The data files the store is built from (see IndexStore.rebuild())
+SOURCE_FILES = ('urls.json', 'index.json', 'positions.json', 'page_info.json', DOCS_FILE)
+
+
+def load_sources(data_dir='data'):
+    """The (urls, index, positions, page_info) of the JSON data files the store is built from."""
+    with open(f'{data_dir}/urls.json', 'r') as f:
+        urls = json.load(f)
+    with open(f'{data_dir}/index.json', 'r') as f:
+        index = json.load(f)
+    with open(f'{data_dir}/positions.json', 'r') as f:
+        positions = json.load(f)
+    with open(f'{data_dir}/page_info.json', 'r') as f:
+        page_info = json.load(f)
+    return urls, index, positions, page_info
+
+
+def load_texts(data_dir='data'):
+    """The document store of the page texts in data_dir (see doc_store.py), or None if there is none."""
+    try:
+        return DocStore.open(os.path.join(data_dir, DOCS_FILE))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def load_pagerank(data_dir, urls):
+    """The PageRank scores in pagerank.json by page ID (0.0 if missing), as an array('d')."""
+    try:
+        with open(f'{data_dir}/pagerank.json', 'r') as f:
+            scores = json.load(f)
+    except FileNotFoundError:
+        scores = {}
+    return array('d', (scores.get(url, 0.0) for url in urls))
+
+
+def _open_segments(path, manifest):
+    return [IndexSegment(os.path.join(path, entry['name'])) for entry in manifest['segments']]
+
+
+def _map_pagerank(path):
+    """
+    Memory-map a PageRank file; returns (the mmap or None if the file is
+    empty, the scores by page ID as a sequence of floats). Like the segments,
+    the mapping is shared by every process that opens the same file.
+    """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None, array('d')
+        pagerank_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return pagerank_map, memoryview(pagerank_map).cast('d')
+
+
+class IndexStore:
+    """
+    Writer of the segmented index in data_dir/index/.
+
+    Args:
+        data_dir: Directory of the crawl results.
+        merge_factor: Number of segments of the same size tier merged at once.
+        path: Directory of the store, if not data_dir/index/ (e.g. a shard's,
+              see shards.py).
+    """
+
+    def __init__(self, data_dir='data', merge_factor=MERGE_FACTOR, path=None):
+        self.data_dir = data_dir
+        self.path = path or os.path.join(data_dir, INDEX_DIR)
+        self.merge_factor = merge_factor
+        self._lock = threading.Lock()        # guards manifest updates
+        self._merge_lock = threading.Lock()  # one merge at a time
+        self._pending = set()                # files being written, not in the manifest yet
+        self._next_file = 0                  # numbers below this may be in use by a merge
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, MANIFEST_FILE))
+
+    def is_stale(self):
+        """
+        True if the store is missing, in an older format or older than any of
+        the data files it is built from.
+        """
+        try:
+            built = os.path.getmtime(os.path.join(self.path, MANIFEST_FILE))
+            if self.read_manifest().get('format') != FORMAT:
+                return True
+        except FileNotFoundError:
+            return True
+        return any(os.path.getmtime(os.path.join(self.data_dir, name)) > built
+                   for name in SOURCE_FILES if os.path.exists(os.path.join(self.data_dir, name)))
+
+    def pagerank_is_stale(self):
+        """True if pagerank.json is newer than the PageRank scores in the store."""
+        try:
+            updated = os.path.getmtime(os.path.join(self.data_dir, 'pagerank.json'))
+        except FileNotFoundError:
+            return False
+        try:
+            manifest = self.read_manifest()
+            return updated > os.path.getmtime(os.path.join(self.path, manifest['pagerank']))
+        except FileNotFoundError:
+            return True
+
+    def read_manifest(self):
+        with open(os.path.join(self.path, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+
+    def rebuild(self):
+        """
+        Replace the whole store with a single segment compiled from urls.json,
+        index.json, positions.json, page_info.json, pagerank.json and the page
+        texts in docs.bin (pages have no text if it is missing).
+        """
+        urls, index, positions, page_info = load_sources(self.data_dir)
+        doc_lengths = positions['doc_lengths']
+        positions = positions['positions']
+        words = ((word, list(zip(index[word], positions[word]))) for word in sorted(index))
+        texts = load_texts(self.data_dir)
+
+        # Texts are read as the segment is written, not all held in memory
+        def docs():
+            for page_id, url in enumerate(urls):
+                info = page_info.get(url, {})
+                yield (page_id, url, info.get('title', url), info.get('snippet', ''),
+                       doc_lengths[page_id], texts.get(page_id) if texts else None)
+
+        try:
+            self.replace(words, docs(), load_pagerank(self.data_dir, urls))
+        finally:
+            if texts is not None:
+                texts.close()
+
+    def replace(self, words, docs, pagerank):
+        """
+        Replace the whole store with a single segment of the given pages (see
+        add_pages() for the arguments) and PageRank scores (by page ID).
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            manifest = self._read_or_create_manifest()
+            segment = self._write_segment(manifest, words, docs)
+            pagerank = self._write_pagerank(manifest, pagerank)
+            manifest['segments'] = [segment]
+            manifest['pagerank'] = pagerank
+            manifest['format'] = FORMAT
+            self._commit(manifest)
+            self._pending.difference_update((segment['name'], pagerank))
+
+    def update_pagerank(self):
+        """Replace the PageRank scores in the store with those in pagerank.json."""
+        with open(f'{self.data_dir}/urls.json', 'r') as f:
+            urls = json.load(f)
+        self.set_pagerank(load_pagerank(self.data_dir, urls))
+
+    def set_pagerank(self, pagerank):
+        """Replace the PageRank scores in the store (an array('d') by page ID)."""
+        with self._lock:
+            manifest = self.read_manifest()
+            manifest['pagerank'] = self._write_pagerank(manifest, pagerank)
+            self._commit(manifest)
+            self._pending.discard(manifest['pagerank'])
+
+    def add_pages(self, words, docs):
+        """
+        Add new versions of pages as a new segment. The arguments are as for
+        write_segment(): words are (word, [(page ID, positions), ...]) in
+        sorted word order, and docs (page ID, url, title, snippet, length,
+        text) in page ID order. Older versions of the pages are tombstoned.
+        """
+        doc_ids = [doc[0] for doc in docs]
+        if not doc_ids:
+            return
+        with self._lock:
+            manifest = self.read_manifest()
+            segment = self._write_segment(manifest, words, docs)
+            self._tombstone(manifest, doc_ids)
+            manifest['segments'].append(segment)
+            self._commit(manifest)
+            self._pending.discard(segment['name'])
+
+    def delete_pages(self, doc_ids):
+        """Tombstone pages, so that they are no longer returned by searches."""
+        with self._lock:
+            manifest = self.read_manifest()
+            if self._tombstone(manifest, doc_ids):
+                self._commit(manifest)
+
+    def merge(self):
+        """
+        Do one merge chosen by the merge policy, if any. Returns True if a
+        merge was done. Pages can be added and deleted while it runs.
+        """
+        with self._merge_lock:
+            with self._lock:
+                manifest = self.read_manifest()
+                chosen = self._choose_merge(manifest)
+                if not chosen:
+                    return False
+                deleted = {entry['name']: set(entry['deleted']) for entry in chosen}
+                name = self._next_name(manifest, 'segment', 'seg')
+
+            segments = [IndexSegment(os.path.join(self.path, entry['name'])) for entry in chosen]
+            try:
+                words, new_ids, docs = self._merged(segments,
+                                                    [deleted[entry['name']] for entry in chosen])
+                write_segment(os.path.join(self.path, name), words, docs)
+            except BaseException:
+                self._pending.discard(name)
+                raise
+            finally:
+                for segment in segments:
+                    segment.close()
+
+            with self._lock:
+                manifest = self.read_manifest()
+                entries = {entry['name']: entry for entry in manifest['segments']}
+                self._pending.discard(name)
+                if any(entry['name'] not in entries for entry in chosen):
+                    # The store was rebuilt meanwhile; the merged segment is obsolete
+                    os.remove(os.path.join(self.path, name))
+                    return False
+                # Carry over pages deleted or replaced while merging
+                ids = set(new_ids)
+                newly_deleted = sorted(
+                    doc_id for entry in chosen
+                    for doc_id in set(entries[entry['name']]['deleted']) - deleted[entry['name']]
+                    if doc_id in ids)
+                chosen_names = {entry['name'] for entry in chosen}
+                segments = [entry for entry in manifest['segments']
+                            if entry['name'] not in chosen_names]
+                if new_ids:
+                    segments.append({'name': name, 'num_docs': len(new_ids),
+                                     'deleted': newly_deleted})
+                else:
+                    os.remove(os.path.join(self.path, name))
+                manifest['segments'] = segments
+                self._commit(manifest)
+            return True
+
+    def merge_all(self):
+        """Merge until the merge policy has nothing left to do."""
+        while self.merge():
+            pass
+
+    def start_merging(self):
+        """Run merge_all() in a background thread, which is returned (join it before exiting)."""
+        thread = threading.Thread(target=self.merge_all, name='index-merge', daemon=True)
+        thread.start()
+        return thread
+
+    def _choose_merge(self, manifest):
+        """The manifest entries of the segments to merge next, or None."""
+        tiers = defaultdict(list)
+        for entry in manifest['segments']:
+            num_deleted = len(entry['deleted'])
+            if num_deleted > MAX_DELETED_FRACTION * entry['num_docs']:
+                return [entry]
+            live = entry['num_docs'] - num_deleted
+            tiers[int(math.log(max(live, 1), self.merge_factor))].append(entry)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return None
+
+    def _merged(self, segments, deleted):
+        """
+        The words, page IDs and docs of a merge of segments, without the
+        deleted pages (one set of page IDs per segment). Words and docs are
+        generators reading the segments, which must stay open until they
+        are consumed.
+        """
+        pages = [(doc_id, segment, local)
+                 for segment, segment_deleted in zip(segments, deleted)
+                 for local, doc_id in enumerate(segment.doc_ids)
+                 if doc_id not in segment_deleted]
+        pages.sort(key=lambda page: page[0])
+
+        def docs():
+            for doc_id, segment, local in pages:
+                url, title, snippet = segment.document(local)
+                yield (doc_id, url, title, snippet, segment.doc_lengths[local],
+                       segment.text(local))
+
+        def live_entries(segment, segment_deleted):
+            for word, pages in segment.entries():
+                pages = [page for page in pages if page[0] not in segment_deleted]
+                if pages:
+                    yield word, pages
+
+        def words():
+            sources = [live_entries(segment, segment_deleted)
+                       for segment, segment_deleted in zip(segments, deleted)]
+            entries = heapq.merge(*sources, key=lambda entry: entry[0])
+            for word, word_entries in itertools.groupby(entries, key=lambda entry: entry[0]):
+                pages = [page for _, pages in word_entries for page in pages]
+                pages.sort(key=lambda page: page[0])
+                yield word, pages
+
+        return words(), [page[0] for page in pages], docs()
+
+    def _tombstone(self, manifest, doc_ids):
+        """Mark pages deleted in the segments they are live in. Returns True if any was."""
+        changed = False
+        for entry, segment in zip(manifest['segments'], _open_segments(self.path, manifest)):
+            deleted = set(entry['deleted'])
+            new = {doc_id for doc_id in doc_ids
+                   if doc_id not in deleted and segment.local_id(doc_id) is not None}
+            segment.close()
+            if new:
+                entry['deleted'] = sorted(deleted | new)
+                changed = True
+        return changed
+
+    def _read_or_create_manifest(self):
+        try:
+            return self.read_manifest()
+        except FileNotFoundError:
+            return {'generation': 0, 'format': FORMAT, 'next_file': 0, 'pagerank': None,
+                    'segments': []}
+
+    def _next_name(self, manifest, prefix, extension):
+        number = max(manifest['next_file'], self._next_file)
+        manifest['next_file'] = self._next_file = number + 1
+        name = f"{prefix}-{number:06d}.{extension}"
+        self._pending.add(name)
+        return name
+
+    def _write_segment(self, manifest, words, docs):
+        name = self._next_name(manifest, 'segment', 'seg')
+        num_docs = write_segment(os.path.join(self.path, name), words, docs)
+        return {'name': name, 'num_docs': num_docs, 'deleted': []}
+
+    def _write_pagerank(self, manifest, pagerank):
+        name = self._next_name(manifest, 'pagerank', 'bin')
+        path = os.path.join(self.path, name)
+        with open(path + '.tmp', 'wb') as f:
+            pagerank.tofile(f)
+        os.replace(path + '.tmp', path)
+        return name
+
+    def _commit(self, manifest):
+        """Write a new generation of the manifest, then remove the files it no longer uses."""
+        manifest['generation'] += 1
+        manifest['next_file'] = max(manifest['next_file'], self._next_file)
+        path = os.path.join(self.path, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+        used = {entry['name'] for entry in manifest['segments']}
+        used.add(manifest['pagerank'])
+        for name in os.listdir(self.path):
+            if name == MANIFEST_FILE or name in used or name in self._pending:
+                continue
+            if name.endswith('.tmp') and name[:-len('.tmp')] in self._pending:
+                continue
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+
+def sync_store(data_dir='data', log=None):
+    """
+    Bring the store in data_dir up to date with the JSON data files:
+    rebuild it if they changed, or only replace its PageRank scores if just
+    pagerank.json did. log(message) is called before doing either.
+    """
+    store = IndexStore(data_dir)
+    if store.is_stale():
+        if log is not None:
+            log("Building the search index...")
+        store.rebuild()
+    elif store.pagerank_is_stale():
+        if log is not None:
+            log("Updating the PageRank scores of the search index...")
+        store.update_pagerank()
+    return store
+
+
+def read_generation(data_dir='data', path=None):
+    """The generation of the store's manifest, or None if there is no store."""
+    path = path or os.path.join(data_dir, INDEX_DIR)
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+            return json.load(f)['generation']
+    except FileNotFoundError:
+        return None
+
+
+class SegmentedIndex:
+    """
+    Read-only view of the live segments of one generation of the store,
+    with the same interface as a single index: posting lists combine the
+    live pages of every segment, by page ID.
+    """
+
+    def __init__(self, data_dir='data', retries=5, path=None):
+        path = path or os.path.join(data_dir, INDEX_DIR)
+        for attempt in range(retries):
+            with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+                manifest = json.load(f)
+            try:
+                self._segments = _open_segments(path, manifest)
+                self._pagerank_map, self.pagerank = _map_pagerank(
+                    os.path.join(path, manifest['pagerank']))
+                break
+            except FileNotFoundError:
+                # A newer generation replaced these files; read its manifest
+                if attempt == retries - 1:
+                    raise
+        self.generation = manifest['generation']
+        self.max_pagerank = max(self.pagerank, default=0.0)
+        self._deleted = [frozenset(entry['deleted']) for entry in manifest['segments']]
+
+        self.num_docs = 0
+        self.total_length = 0
+        for segment, deleted in zip(self._segments, self._deleted):
+            self.num_docs += segment.num_docs - len(deleted)
+            self.total_length += segment.total_length - sum(
+                segment.doc_lengths[segment.local_id(doc_id)] for doc_id in deleted)
+        self.avg_doc_length = self.total_length / self.num_docs if self.num_docs else 0.0
+
+    @property
+    def num_segments(self):
+        return len(self._segments)
+
+    def __contains__(self, word):
+        return any(word in segment for segment in self._segments)
+
+    def doc_freq(self, word):
+        """The number of live pages containing a word."""
+        total = 0
+        for segment, deleted in zip(self._segments, self._deleted):
+            if not deleted:
+                total += segment.doc_freq(word)
+                continue
+            postings = segment.postings(word)
+            if postings is not None:
+                doc_ids = segment.doc_ids
+                total += sum(1 for local in postings[0] if doc_ids[local] not in deleted)
+        return total
+
+    def postings(self, word):
+        """
+        The posting list of a word as (page IDs, term frequencies, page
+        lengths), in page ID order, or None if no live page contains it.
+        """
+        parts = []
+        for segment, deleted in zip(self._segments, self._deleted):
+            postings = segment.postings(word)
+            if postings is None:
+                continue
+            local_ids, tfs = postings
+            doc_ids = list(map(segment.doc_ids.__getitem__, local_ids))
+            doc_lengths = list(map(segment.doc_lengths.__getitem__, local_ids))
+            if deleted:
+                live = [i for i, doc_id in enumerate(doc_ids) if doc_id not in deleted]
+                doc_ids, tfs, doc_lengths = ([values[i] for i in live]
+                                             for values in (doc_ids, tfs, doc_lengths))
+            if doc_ids:
+                parts.append((doc_ids, tfs, doc_lengths))
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        # A page is live in only one segment, so this just interleaves the lists
+        entries = sorted(itertools.chain.from_iterable(zip(*part) for part in parts))
+        return tuple(map(list, zip(*entries)))
+
+    def postings_arrays(self, word):
+        """
+        The same as postings(), as NumPy int64 arrays, for vectorized
+        scoring. Pages are mapped to their IDs with array operations.
+        """
+        parts = []
+        for segment, deleted in zip(self._segments, self._deleted):
+            postings = segment.postings(word)
+            if postings is None:
+                continue
+            local_ids = np.array(postings[0], dtype=np.int64)
+            doc_ids = np.frombuffer(segment.doc_ids, dtype=np.uint32)[local_ids].astype(np.int64)
+            tfs = np.array(postings[1], dtype=np.int64)
+            doc_lengths = np.frombuffer(segment.doc_lengths, dtype=np.uint32)[local_ids].astype(np.int64)
+            if deleted:
+                live = ~np.isin(doc_ids, np.fromiter(deleted, dtype=np.int64, count=len(deleted)))
+                doc_ids, tfs, doc_lengths = doc_ids[live], tfs[live], doc_lengths[live]
+            if len(doc_ids):
+                parts.append((doc_ids, tfs, doc_lengths))
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        doc_ids, tfs, doc_lengths = (np.concatenate(arrays) for arrays in zip(*parts))
+        order = np.argsort(doc_ids, kind='stable')
+        return doc_ids[order], tfs[order], doc_lengths[order]
+
+    def word_pages(self):
+        """
+        Iterate over (word, page IDs as a NumPy array) for the live pages of
+        every word, segment by segment (a word can come up once per segment).
+        """
+        for segment, deleted in zip(self._segments, self._deleted):
+            doc_ids = np.frombuffer(segment.doc_ids, dtype=np.uint32).astype(np.int64)
+            deleted_ids = np.fromiter(deleted, dtype=np.int64, count=len(deleted))
+            for word, local_ids in segment.word_postings():
+                page_ids = doc_ids[local_ids]
+                if deleted:
+                    page_ids = page_ids[~np.isin(page_ids, deleted_ids)]
+                if len(page_ids):
+                    yield word, page_ids
+
+    def positions(self, word):
+        """Iterate over (page ID, positions) for the live pages containing a word, by page ID."""
+        def segment_positions(segment, deleted):
+            doc_ids = segment.doc_ids
+            for local, positions in segment.positions(word):
+                doc_id = doc_ids[local]
+                if doc_id not in deleted:
+                    yield doc_id, positions
+
+        return heapq.merge(*(segment_positions(segment, deleted)
+                             for segment, deleted in zip(self._segments, self._deleted)),
+                           key=lambda entry: entry[0])
+
+    def _live(self, doc_id):
+        """The segment a page is live in, and its local number there."""
+        for segment, deleted in zip(self._segments, self._deleted):
+            local = segment.local_id(doc_id)
+            if local is not None and doc_id not in deleted:
+                return segment, local
+        raise KeyError(doc_id)
+
+    def document(self, doc_id):
+        """The (url, title, snippet) of a live page."""
+        segment, local = self._live(doc_id)
+        return segment.document(local)
+
+    def text(self, doc_id):
+        """The text of a live page, or None if it was not stored (see doc_store.py)."""
+        segment, local = self._live(doc_id)
+        return segment.text(local)
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        if self._pagerank_map is not None:
+            self.pagerank.release()
+            self._pagerank_map.close()
@@ -8,117 +8,248 @@ It also stores the page information for display later.
 """
 
 import json
+import multiprocessing
+import os
 import re
 import html
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from urllib.parse import urlparse
-from collections import defaultdict
 from . import fetcher
+from .page_cache import PageCache
+from .simhash import simhash
+from .postings import term_positions
+from .index_builder import IndexBuilder, DEFAULT_MEMORY_BUDGET, write_index
+from .doc_store import DOCS_FILE, DocStoreWriter
+from .url_table import load_urls
 
 
-def extract_text_from_html(html_content):
+# Tags whose whole content is dropped from the page text. The closing tag is
+# located directly, so everything up to the first matching close is skipped.
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'svg', 'nav', 'header', 'footer', 'aside'}
+
+# Tags whose text is collected as page content, in the order the categories
+# appear in the extracted text (headings come first, repeated for weight)
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+CONTENT_TAGS = ('main', 'article', 'section', 'p', 'li')
+
+_TAG_RE = re.compile(
+    r'<(?:'
+    r'!--.*?-->'                                                      # comment
+    r'|(/?)([a-zA-Z][a-zA-Z0-9:-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>'  # start or end tag
+    r'|[!?][^>]*>'                                                    # doctype etc.
+    r')', re.DOTALL)
+_LINK_ATTR_RE = re.compile(
+    r'(?:^|\s)(href|src)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+_LINK_TAG_RE = re.compile(
+    r'<(a|area|frame|iframe)(\s(?:[^>"\']|"[^"]*"|\'[^\']*\')*)?>', re.IGNORECASE)
+_TAGS_RE = re.compile(r'<[^>]+>')
+# Raw text elements, whose content cannot contain tags
+RAW_TEXT_TAGS = {'script', 'style', 'title'}
+_CLOSE_TAG_RES = {}
+
+
+def _find_close_tag(html_content, tag, pos):
+    """Return the (start, end) span of the first </tag> at or after pos, or None."""
+    pattern = _CLOSE_TAG_RES.get(tag)
+    if pattern is None:
+        pattern = _CLOSE_TAG_RES[tag] = re.compile(rf'</{tag}\s*>', re.IGNORECASE)
+    match = pattern.search(html_content, pos)
+    return match.span() if match else None
+
+
+def _add_link(link_parser, tag, attr_text):
+    """Feed a link tag's attributes to the link parser."""
+    attrs = []
+    for attr in _LINK_ATTR_RE.finditer(attr_text):
+        value = next(v for v in attr.groups()[1:] if v is not None)
+        attrs.append((attr.group(1).lower(), html.unescape(value)))
+    link_parser.handle_starttag(tag, attrs)
+
+
+def _clean(text):
+    """Decode HTML entities and collapse whitespace."""
+    return ' '.join(html.unescape(text).split())
+
+
+def extract_page(html_content, url=''):
     """
-    Extract visible text from HTML content, focusing on main body content.
-    Tries to extract meaningful text from semantic HTML elements.
+    Extract everything the crawler and indexer need from a page in a single
+    pass over the HTML.
+
+    Returns a dict with:
+        title: page title for display (falls back to the URL, max 100 chars)
+        headings: text of the h1-h6 headings
+        text: the visible text used for indexing; the title is repeated three
+              times and headings twice for extra weight in search
+        content: the visible text once, in page order, for query-dependent
+                 snippets (see snippets.py); text in nested elements (e.g. a
+                 <p> in a <section> in <main>) is only taken once
+        snippet: first ~200 characters of the text, for display
+        links: absolute hyperlinks on the page, as fetcher.MyHTMLParser
+               would return them, resolved against url
     """
-    if not html_content:
-        return ""
-    
-    # Remove script, style, and other non-content elements
-    html_content = re.sub(r'<script[^>]*>.*?</script>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-    html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-    html_content = re.sub(r'<noscript[^>]*>.*?</noscript>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-    html_content = re.sub(r'<svg[^>]*>.*?</svg>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-    
-    # Extract title for weighting
-    title_match = re.search(r'<title[^>]*>(.*?)</title>', html_content, re.IGNORECASE | re.DOTALL)
-    title = title_match.group(1) if title_match else ""
-    if title:
-        title = re.sub(r'<[^>]+>', '', title)
-        title = html.unescape(title)
-        title = re.sub(r'\s+', ' ', title).strip()
-    
-    # Try to extract body content
-    body_match = re.search(r'<body[^>]*>(.*?)</body>', html_content, re.IGNORECASE | re.DOTALL)
-    if body_match:
-        body_content = body_match.group(1)
-    else:
-        # Otherwise, use entire content
-        body_content = html_content
-    
-    # Remove common navigation/header/footer elements
-    # These often contain repetitive, non-meaningful text
-    body_content = re.sub(r'<nav[^>]*>.*?</nav>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
-    body_content = re.sub(r'<header[^>]*>.*?</header>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
-    body_content = re.sub(r'<footer[^>]*>.*?</footer>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
-    body_content = re.sub(r'<aside[^>]*>.*?</aside>', '', body_content, flags=re.DOTALL | re.IGNORECASE)
-    
-    # Extract text from semantic content elements
+    html_content = html_content or ''
+    link_parser = fetcher.MyHTMLParser()
+    title = None
+
+    headings = {tag: [] for tag in HEADING_TAGS}
+    content = {tag: [] for tag in CONTENT_TAGS}
+    all_text = []     # every text chunk in the body, used if nothing else is found
+    open_tags = []    # stack of (tag, chunks) for heading/content elements being read
+    blocks = []       # text chunks of the page's text blocks, in page order, for content
+    block = None      # the block being read; a new one starts at every heading/content tag
+    in_body = True    # until a <body> tag shows up, treat the whole page as body
+
+    pos = 0
+    length = len(html_content)
+    while pos < length:
+        match = _TAG_RE.search(html_content, pos)
+        chunk_end = match.start() if match else length
+
+        # Text between tags goes to every element currently being read
+        if chunk_end > pos and in_body:
+            chunk = html_content[pos:chunk_end]
+            all_text.append(chunk)
+            for _, chunks in open_tags:
+                chunks.append(chunk)
+            if open_tags:
+                if block is None:
+                    block = []
+                    blocks.append(block)
+                block.append(chunk)
+
+        if not match:
+            break
+        pos = match.end()
+
+        tag = match.group(2)
+        if tag is None:
+            continue  # comment or doctype
+        tag = tag.lower()
+
+        if match.group(1):
+            # End tag: finish the innermost open element with this name, and
+            # any unclosed elements inside it (e.g. <li> items closed by </ul>)
+            if tag == 'body':
+                in_body = False
+            for i in range(len(open_tags) - 1, -1, -1):
+                if open_tags[i][0] == tag or \
+                   (tag in ('ul', 'ol') and open_tags[i][0] != 'li'):
+                    break
+            else:
+                i = -1
+            if tag in ('ul', 'ol'):
+                i += 1
+            while 0 <= i < len(open_tags):
+                open_tag, chunks = open_tags.pop()
+                target = headings if open_tag in headings else content
+                target[open_tag].append(chunks)
+                block = None
+            # Tags separate words, as if each tag were replaced by a space
+            for _, chunks in open_tags:
+                chunks.append(' ')
+            if block is not None:
+                block.append(' ')
+            continue
+
+        # Start tag
+        if tag in ('a', 'area', 'frame', 'iframe'):
+            _add_link(link_parser, tag, match.group(3))
+
+        if tag in SKIPPED_TAGS or tag == 'title':
+            span = _find_close_tag(html_content, tag, pos)
+            if span is None:
+                continue
+            if tag == 'title' and title is None:
+                title = _clean(_TAGS_RE.sub('', html_content[pos:span[0]]))
+            elif tag not in RAW_TEXT_TAGS:
+                # Skipped elements like <nav> still contribute their links
+                for link in _LINK_TAG_RE.finditer(html_content, pos, span[0]):
+                    _add_link(link_parser, link.group(1).lower(), link.group(2) or '')
+            pos = span[1]
+        elif tag == 'body':
+            # Anything before the body (i.e. the head) is not page text
+            in_body = True
+            all_text = []
+            open_tags = []
+            blocks = []
+            block = None
+            headings = {tag: [] for tag in HEADING_TAGS}
+            content = {tag: [] for tag in CONTENT_TAGS}
+        elif tag in headings or tag in content:
+            # A new paragraph or list item implicitly closes the previous one
+            if tag in ('p', 'li') and open_tags and open_tags[-1][0] == tag:
+                content[tag].append(open_tags.pop()[1])
+            for _, chunks in open_tags:
+                chunks.append(' ')
+            open_tags.append((tag, []))
+            block = None
+        else:
+            for _, chunks in open_tags:
+                chunks.append(' ')
+            if block is not None:
+                block.append(' ')
+
+    # Collect text parts: headings (twice each), then the content elements.
+    # Elements still open at the end of the page are dropped.
     text_parts = []
-    
-    # Headings
-    for level in [1, 2, 3, 4, 5, 6]:
-        headings = re.findall(rf'<h{level}[^>]*>(.*?)</h{level}>', body_content, re.IGNORECASE | re.DOTALL)
-        for heading in headings:
-            heading_text = re.sub(r'<[^>]+>', '', heading).strip()
-            # Decode HTML entities
-            heading_text = html.unescape(heading_text)
+    heading_texts = []
+    for tag in HEADING_TAGS:
+        for chunks in headings[tag]:
+            heading_text = _clean(''.join(chunks))
             if heading_text:
-                # Repeat headings for extra weight
+                heading_texts.append(heading_text)
                 text_parts.append(heading_text)
                 text_parts.append(heading_text)
-    
-    # Main content areas
-    main_content = re.findall(r'<main[^>]*>(.*?)</main>', body_content, re.IGNORECASE | re.DOTALL)
-    article_content = re.findall(r'<article[^>]*>(.*?)</article>', body_content, re.IGNORECASE | re.DOTALL)
-    section_content = re.findall(r'<section[^>]*>(.*?)</section>', body_content, re.IGNORECASE | re.DOTALL)
-    
-    # Paragraphs
-    paragraphs = re.findall(r'<p[^>]*>(.*?)</p>', body_content, re.IGNORECASE | re.DOTALL)
-    
-    # Lists
-    list_items = re.findall(r'<li[^>]*>(.*?)</li>', body_content, re.IGNORECASE | re.DOTALL)
-    
-    # Collect all content
-    for content in main_content + article_content + section_content:
-        content_text = re.sub(r'<[^>]+>', ' ', content).strip()
-        content_text = html.unescape(content_text)
-        if content_text:
-            text_parts.append(content_text)
-    
-    for para in paragraphs:
-        para_text = re.sub(r'<[^>]+>', ' ', para).strip()
-        para_text = html.unescape(para_text)
-        if para_text:
-            text_parts.append(para_text)
-    
-    for item in list_items:
-        item_text = re.sub(r'<[^>]+>', ' ', item).strip()
-        item_text = html.unescape(item_text)
-        if item_text:
-            text_parts.append(item_text)
-    
-    # If we didn't find semantic elements, fall back to extracting all text
+    for tag in CONTENT_TAGS:
+        for chunks in content[tag]:
+            content_text = _clean(' '.join(chunks))
+            if content_text:
+                text_parts.append(content_text)
+
+    # The content has each text block once, where the text repeats the text
+    # of nested elements (e.g. a <p> in a <section>) in each of them
+    content_parts = [_clean(' '.join(chunks)) for chunks in blocks]
+
+    # If we didn't find semantic elements, fall back to all the body text
     if not text_parts:
-        # Remove remaining HTML tags and get text
-        body_text = re.sub(r'<[^>]+>', ' ', body_content).strip()
-        body_text = html.unescape(body_text)
+        body_text = _clean(' '.join(all_text))
         if body_text:
             text_parts.append(body_text)
-    
-    # Combine all text parts
+        content_parts = [body_text]
     body_text = ' '.join(text_parts)
-    
-    # Clean up whitespace
-    body_text = re.sub(r'\s+', ' ', body_text).strip()
-    
-    # Combine title with body text
+
+    # Title appears multiple times for extra weight in search
     if title:
-        # Title appears multiple times for extra weight in search
-        full_text = f"{title} {title} {title} {body_text}"
+        text = f"{title} {title} {title} {body_text}"
     else:
-        full_text = body_text
-    
-    return full_text
+        text = body_text
+
+    # Build snippet from the text, truncated at a word boundary
+    snippet = ' '.join(text[:300].split())
+    if len(snippet) > 200:
+        snippet = snippet[:200].rsplit(' ', 1)[0] + '...'
+
+    return {
+        'title': (title or url)[:100],
+        'headings': heading_texts,
+        'text': text,
+        'content': ' '.join(part for part in content_parts if part),
+        'snippet': snippet,
+        'links': link_parser.get_links(url) if url else [],
+    }
+
+
+def extract_text_from_html(html_content):
+    """
+    Extract visible text from HTML content, focusing on main body content.
+    Tries to extract meaningful text from semantic HTML elements.
+    """
+    if not html_content:
+        return ""
+    return extract_page(html_content)['text']
 
 
 def tokenize(text):
@@ -130,88 +261,185 @@ def tokenize(text):
     return words
 
 
-def build_index(graph, data_dir='data'):
+def parse_page(html_content, url=''):
     """
-    Build an inverted index from the web graph.
+    Extract and tokenize a page for the crawler.
     
-    For each page in the graph, fetch its content and index the words.
-    Saves the index to data/index.json.
+    Returns a compact dict with the page's links, title, snippet, content
+    (see extract_page()), the positions of each unique word in its text,
+    its length in words and the SimHash fingerprint of the text (None for
+    very short pages). It is small enough to be sent back cheaply from a
+    worker process.
     """
-    print("Building search index...")
-    
-    # Inverted index: word -> list of URLs containing that word
-    index = defaultdict(list)
-    
-    # Store page titles and snippets for display later
+    page = extract_page(html_content, url)
+    words = tokenize(page['text'])
+    return {
+        'links': page['links'],
+        'title': page['title'],
+        'snippet': page['snippet'],
+        'content': page['content'],
+        'positions': term_positions(words),
+        'length': len(words),
+        'fingerprint': simhash(words),
+    }
+
+
+def _index_pages(pages, cache_dir, segment_dir, name, memory_budget):
+    """
+    Index a chunk of pages in a worker process of build_index_files().
+
+    pages is a list of (page ID, URL). Each page is read from the page cache
+    in cache_dir, or fetched if it is not there (or if cache_dir is None).
+    The chunk's index is flushed to segments in segment_dir. Returns the
+    segment paths, the page lengths, the page info, the page contents (by
+    page ID) and the number of pages that had to be fetched.
+    """
+    cache = PageCache(cache_dir) if cache_dir else None
+    builder = IndexBuilder(memory_budget, segment_dir=segment_dir, name=name)
     page_info = {}
+    contents = {}
+    num_fetched = 0
     
-    urls = list(graph.keys())
-    total = len(urls)
-    
-    for i, url in enumerate(urls, 1):
-        if i % 50 == 0:
-            print(f"  Indexed {i}/{total} pages...")
-        
+    for page_id, url in pages:
         try:
-            # Fetch page content
-            real_url, content = fetcher.fetch_html_page(url)
+            content = cache.get(url) if cache is not None else None
+            if content is None:
+                # Not in the page store: fetch it (and cache it)
+                real_url, content = fetcher.fetch_html_page(url, cache)
+                num_fetched += 1
             
             if content:
                 # Extract and tokenize text
-                text = extract_text_from_html(content)
-                words = tokenize(text)
-                
-                # Extract title for display
-                title_match = re.search(r'<title[^>]*>(.*?)</title>', content, re.IGNORECASE | re.DOTALL)
-                if title_match:
-                    title = title_match.group(1)
-                    title = re.sub(r'<[^>]+>', '', title)  # Clean up any nested tags
-                    title = html.unescape(title)  # Decode HTML entities
-                    # Normalize whitespace: replace all whitespace sequences with single space
-                    title = re.sub(r'\s+', ' ', title).strip()
-                else:
-                    title = url
-                title = title[:100]  # Limit title length
-                
-                # Build snippet from body text (first meaningful 200 chars)
-                snippet = text[:300].strip()
-                snippet = re.sub(r'\s+', ' ', snippet)  # Normalize whitespace
-                # Truncate at word boundary if needed
-                if len(snippet) > 200:
-                    snippet = snippet[:200].rsplit(' ', 1)[0] + '...'
+                page = extract_page(content, url)
+                words = tokenize(page['text'])
                 
                 page_info[url] = {
-                    'title': title,
-                    'snippet': snippet
+                    'title': page['title'],
+                    'snippet': page['snippet']
                 }
+                contents[page_id] = page['content']
                 
                 # Add words to index
-                unique_words = set(words)
-                for word in unique_words:
-                    if word not in index or url not in index[word]:
-                        index[word].append(url)
+                builder.add(page_id, term_positions(words), len(words))
         
         except Exception as e:
             # Skip pages that fail to fetch
             continue
     
-    # Convert defaultdict to regular dict for JSON serialization
-    index_dict = {word: urls for word, urls in index.items()}
+    builder.flush()
+    return builder.segments, builder.doc_lengths, page_info, contents, num_fetched
+
+
+def build_index(graph, data_dir='data', use_cache=True, memory_budget=DEFAULT_MEMORY_BUDGET,
+                processes=None):
+    """
+    Build an inverted index from the web graph, as build_index_files()
+    does, and return it: (index, page_info), index mapping each word to the
+    URLs of the pages containing it.
+    
+    This loads the whole index into memory to return it; to only write the
+    index files (e.g. for a large crawl), call build_index_files(), which
+    returns the number of unique words instead of the index.
+    """
+    _, page_info = build_index_files(graph, data_dir, use_cache, memory_budget, processes)
+    urls = load_urls(data_dir)
+    with open(f'{data_dir}/index.json', 'r') as f:
+        index = {word: [urls[page_id] for page_id in page_ids]
+                 for word, page_ids in json.load(f).items()}
+    return index, page_info
+
+
+def build_index_files(graph, data_dir='data', use_cache=True, memory_budget=DEFAULT_MEMORY_BUDGET,
+                      processes=None):
+    """
+    Build an inverted index from the web graph, without holding it in memory.
+    
+    For each page in the graph, read its content and index the words.
+    Saves the index to data/index.json, with pages identified by their
+    position in the graph, the word positions and page lengths to
+    data/positions.json (see postings.py), the page texts to data/docs.bin
+    (see doc_store.py), and the matching URL table to data/urls.json (the
+    same as the crawler's if the graph comes from url_table.load_graph()).
+    
+    With use_cache, pages are read from the page cache in data/cache that
+    the crawler filled, so changes to text extraction or tokenization can
+    be applied without crawling again; only pages missing from the cache
+    are fetched. Without it, every page is fetched.
+    
+    Pages are extracted and tokenized in chunks on a pool of `processes`
+    worker processes (default: one per core). Each worker builds the index
+    of its chunk within its share of memory_budget and flushes it to sorted
+    segments on disk; the segments of all workers are merged into the
+    index files at the end (see index_builder.py), so the whole index never
+    has to fit in memory.
+    
+    Returns the number of unique words and the page info.
+    """
+    print("Building search index...")
+    
+    urls = list(graph.keys())
+    total = len(urls)
+    processes = processes or os.cpu_count() or 1
+    cache_dir = f'{data_dir}/cache' if use_cache else None
+    
+    # A few contiguous chunks of pages per worker, to balance the load
+    num_chunks = max(1, min(total, processes * 4))
+    chunk_size = -(-total // num_chunks)
+    pages = list(enumerate(urls))
+    chunks = [pages[start:start + chunk_size] for start in range(0, total, chunk_size)]
     
-    # Save index
-    index_path = f'{data_dir}/index.json'
-    with open(index_path, 'w') as f:
-        json.dump(index_dict, f, indent=2)
+    # Inverted index: word -> IDs of the pages containing that word, and
+    # the positions of the word in each, merged from the workers' segments
+    segment_dir = tempfile.mkdtemp(prefix='index-segments-')
+    builder = IndexBuilder(segment_dir=segment_dir)
+    # Page texts, compressed as the chunks come in
+    docs = DocStoreWriter()
+    
+    # Store page titles and snippets for display later
+    page_info = {}
+    
+    try:
+        num_indexed = num_fetched = 0
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(_index_pages, chunk, cache_dir, segment_dir,
+                                   f'chunk{i:05d}', memory_budget // processes): chunk
+                       for i, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                segments, doc_lengths, chunk_info, contents, chunk_fetched = future.result()
+                builder.add_segments(segments, doc_lengths)
+                page_info.update(chunk_info)
+                for page_id, content in contents.items():
+                    docs.add(page_id, content)
+                num_indexed += len(futures[future])
+                num_fetched += chunk_fetched
+                print(f"  Indexed {num_indexed}/{total} pages...")
+        
+        # Save the URL table and the index, merging the index segments
+        with open(f'{data_dir}/urls.json', 'w') as f:
+            json.dump(urls, f, separators=(',', ':'))
+        index_path = f'{data_dir}/index.json'
+        doc_lengths = [builder.doc_lengths.get(page_id, 0) for page_id in range(total)]
+        num_words = write_index(data_dir, builder.merged(), doc_lengths)
+        docs.write(f'{data_dir}/{DOCS_FILE}')
+    finally:
+        builder.close()
+        docs.close()
+        shutil.rmtree(segment_dir, ignore_errors=True)
     
-    # Save page info
+    # Save page info, in page ID order
+    page_info = {url: page_info[url] for url in urls if url in page_info}
     info_path = f'{data_dir}/page_info.json'
     with open(info_path, 'w') as f:
         json.dump(page_info, f, indent=2)
     
     print(f"\nIndex built successfully!")
     print(f"  Total pages indexed: {len(page_info)}")
-    print(f"  Total unique words: {len(index_dict)}")
+    if use_cache:
+        print(f"  Pages fetched (not in the cache): {num_fetched}")
+    print(f"  Total unique words: {num_words}")
     print(f"  Index saved to {index_path}")
     print(f"  Page info saved to {info_path}")
+    print(f"  Page texts saved to {data_dir}/{DOCS_FILE}")
     
-    return index_dict, page_info
\ No newline at end of file
+    return num_words, page_info
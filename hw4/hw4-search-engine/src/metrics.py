@@ -0,0 +1,203 @@
+"""
+Crawl metrics: per-stage timings, throughput, bytes and failure reasons.
+
+CrawlMetrics collects counters, gauges and histograms from the fetcher and
+the crawler (fetch threads report into it concurrently), and every
+`interval` seconds appends a snapshot as one line of a JSON-lines file.
+If a Prometheus path is given, the same numbers are also written there in
+the Prometheus text exposition format, e.g. for node_exporter's textfile
+collector.
+
+Comparing the fetch, parse and index time histograms (and the queue depth)
+shows which stage limits a given crawl.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CPU_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class Histogram:
+    """A histogram with fixed bucket bounds, like a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs, ending with +Inf."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Estimate the q-quantile as the upper bound of the bucket it falls
+        in (the largest finite bound for the +Inf bucket), or None if empty.
+        """
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound if bound != float('inf') else self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): total
+                        for bound, total in self.cumulative()},
+        }
+
+
+class CrawlMetrics:
+    """
+    Thread-safe crawl metrics.
+
+    Args:
+        path: JSON-lines file that snapshots are appended to (None to not write any).
+        prometheus_path: Optional file rewritten with each snapshot in the
+                         Prometheus text format.
+        interval: Minimum seconds between two snapshots written by maybe_write().
+    """
+
+    def __init__(self, path=None, prometheus_path=None, interval=10.0):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+
+        self.counters = defaultdict(int)   # e.g. pages, requests, bytes
+        self.failures = defaultdict(int)   # failure reason -> count
+        self.gauges = {}                   # e.g. queue_depth
+        self.histograms = {
+            'fetch_seconds': Histogram(LATENCY_BUCKETS),
+            'parse_seconds': Histogram(CPU_BUCKETS),
+            'index_seconds': Histogram(CPU_BUCKETS),
+        }
+
+        self.started = time.monotonic()
+        self._last_write = self.started
+        self._last_pages = 0
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.histograms[name].observe(seconds)
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def record_failure(self, reason):
+        with self._lock:
+            self.counters['failures'] += 1
+            self.failures[reason] += 1
+
+    def record_fetch(self, seconds, num_bytes, num_requests, status, failure=None):
+        """
+        Record one page fetch (including any redirects it followed): its
+        latency, the body bytes received, the final HTTP status (None if no
+        response) and, if the fetch failed, why.
+        """
+        with self._lock:
+            self.histograms['fetch_seconds'].observe(seconds)
+            self.counters['fetches'] += 1
+            self.counters['requests'] += num_requests
+            self.counters['bytes'] += num_bytes
+            if status == 304:
+                self.counters['not_modified'] += 1
+            if failure is not None:
+                self.counters['failures'] += 1
+                self.failures[failure] += 1
+
+    def snapshot(self):
+        """The current metrics as a JSON-serializable dict."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.started
+            since_last = now - self._last_write
+            pages = self.counters['pages']
+            return {
+                'time': time.time(),
+                'elapsed': round(elapsed, 3),
+                'pages_per_sec': round(pages / elapsed, 3) if elapsed > 0 else 0.0,
+                'recent_pages_per_sec': (round((pages - self._last_pages) / since_last, 3)
+                                         if since_last > 0 else 0.0),
+                'counters': dict(self.counters),
+                'failures': dict(self.failures),
+                'gauges': dict(self.gauges),
+                'histograms': {name: histogram.snapshot()
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def maybe_write(self):
+        """Write a snapshot if at least `interval` seconds passed since the last one."""
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """Append a snapshot to the metrics file and update the Prometheus file."""
+        snapshot = self.snapshot()
+        with self._lock:
+            self._last_write = time.monotonic()
+            self._last_pages = self.counters['pages']
+
+        if self.path is not None:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(snapshot, separators=(',', ':')) + '\n')
+
+        if self.prometheus_path is not None:
+            tmp_path = self.prometheus_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self._prometheus_text(snapshot))
+            os.replace(tmp_path, self.prometheus_path)
+        return snapshot
+
+    def _prometheus_text(self, snapshot):
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append(f'# TYPE crawler_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'crawler_{name}{labels} {value}')
+
+        for name, value in sorted(snapshot['counters'].items()):
+            metric(f'{name}_total', 'counter', [('', value)])
+        metric('failures_by_reason_total', 'counter',
+               [(f'{{reason="{reason}"}}', value)
+                for reason, value in sorted(snapshot['failures'].items())])
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric(name, 'gauge', [('', value)])
+        metric('pages_per_second', 'gauge', [('', snapshot['pages_per_sec'])])
+        for name, histogram in snapshot['histograms'].items():
+            samples = [(f'_bucket{{le="{bound}"}}', total)
+                       for bound, total in histogram['buckets'].items()]
+            samples.append(('_sum', histogram['sum']))
+            samples.append(('_count', histogram['count']))
+            metric(name, 'histogram', samples)
+        return '\n'.join(lines) + '\n'
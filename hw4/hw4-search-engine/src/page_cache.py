@@ -0,0 +1,103 @@
+"""
+An on-disk cache of fetched pages, used to make conditional requests.
+
+Page bodies are stored compressed and content-addressed (by the SHA-1 of the
+page), so identical pages served under several URLs are stored once. For each
+URL we keep a small metadata record with the hash of its current body and the
+ETag / Last-Modified validators the server sent with it. On a later fetch the
+validators are sent back as If-None-Match / If-Modified-Since, and a
+"304 Not Modified" answer is served from the cache.
+
+Layout:
+    cache_dir/objects/ab/abcdef....z   # zlib-compressed page bodies
+    cache_dir/meta/12/123456....json   # per-URL metadata, keyed by SHA-1 of the URL
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+
+class PageCache:
+    def __init__(self, cache_dir='data/cache'):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.meta_dir = os.path.join(cache_dir, 'meta')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.meta_dir, exist_ok=True)
+        self._tmp_counter = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, url):
+        """
+        Return the metadata stored for a URL, or None if it is not cached.
+        The metadata has keys 'url', 'sha1', 'etag' and 'last_modified'.
+        """
+        try:
+            with open(self._meta_path(url), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # The body may have been removed independently of the metadata
+        if not os.path.exists(self._object_path(meta['sha1'])):
+            return None
+        return meta
+
+    def load(self, sha1):
+        """Return the cached page body with the given hash, or None."""
+        try:
+            with open(self._object_path(sha1), 'rb') as f:
+                return zlib.decompress(f.read()).decode('utf-8')
+        except (FileNotFoundError, zlib.error):
+            return None
+
+    def get(self, url):
+        """Return the cached body of a URL, or None if it is not cached."""
+        meta = self.lookup(url)
+        return self.load(meta['sha1']) if meta else None
+
+    def alias(self, url, target_url):
+        """
+        Make the cached page of target_url also available under url, e.g. to
+        find a page by its normalized URL after it was fetched through a
+        redirect. Returns False if target_url is not cached.
+        """
+        meta = self.lookup(target_url)
+        if meta is None:
+            return False
+        meta['url'] = url
+        self._write_atomic(self._meta_path(url), json.dumps(meta).encode('utf-8'))
+        return True
+
+    def store(self, url, content, etag=None, last_modified=None):
+        """Cache the body of a URL along with its validators. Returns its hash."""
+        data = content.encode('utf-8')
+        sha1 = hashlib.sha1(data).hexdigest()
+
+        object_path = self._object_path(sha1)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, zlib.compress(data))
+
+        meta = {'url': url, 'sha1': sha1, 'etag': etag, 'last_modified': last_modified}
+        self._write_atomic(self._meta_path(url), json.dumps(meta).encode('utf-8'))
+        return sha1
+
+    def _object_path(self, sha1):
+        return os.path.join(self.objects_dir, sha1[:2], sha1 + '.z')
+
+    def _meta_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.meta_dir, key[:2], key + '.json')
+
+    def _write_atomic(self, path, data):
+        # Write to a unique temporary file and rename it into place, so that
+        # readers (and concurrent writers) never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            self._tmp_counter += 1
+            tmp_path = f'{path}.{os.getpid()}.{self._tmp_counter}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
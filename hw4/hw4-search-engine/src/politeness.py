@@ -0,0 +1,154 @@
+"""
+Per-host politeness for the crawler.
+
+Instead of sleeping before every request, each host gets its own token
+bucket: a host can be sent one request every `delay` seconds (or less often,
+if its robots.txt asks for a larger Crawl-delay). The crawler asks the
+scheduler which hosts are ready, so it can keep fetching from other hosts
+at full speed while any single host stays within its limit.
+
+robots.txt files are fetched once per host and cached for the crawl.
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+from . import fetcher
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, with bursts of up to
+    `capacity` events. A rate of None means no limit.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now):
+        """
+        Take a token, even if it is not available yet, and return how many
+        seconds to wait before using it.
+        """
+        wait = self.ready_in(now)
+        if self.rate is not None:
+            self.tokens -= 1
+        return wait
+
+
+class RobotsCache:
+    """Fetches and caches robots.txt rules per host."""
+
+    def __init__(self, user_agent=fetcher.HEADERS['User-Agent']):
+        self.user_agent = user_agent
+        self._parsers = {}       # scheme://host -> RobotFileParser
+        self._host_locks = {}    # so each robots.txt is only fetched once
+        self._lock = threading.Lock()
+
+    def _parser(self, url):
+        parts = urlsplit(url)
+        root = f'{parts.scheme}://{parts.netloc}'
+        with self._lock:
+            parser = self._parsers.get(root)
+            if parser is not None:
+                return parser
+            host_lock = self._host_locks.setdefault(root, threading.Lock())
+
+        with host_lock:
+            parser = self._parsers.get(root)
+            if parser is None:
+                parser = RobotFileParser(root + '/robots.txt')
+                status, content = fetcher.fetch_text(root + '/robots.txt')
+                # Same interpretation as RobotFileParser.read()
+                if status in (401, 403):
+                    parser.disallow_all = True
+                elif status == 200 and content is not None:
+                    parser.parse(content.splitlines())
+                else:
+                    parser.allow_all = True
+                with self._lock:
+                    self._parsers[root] = parser
+        return parser
+
+    def can_fetch(self, url):
+        return self._parser(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url):
+        """The Crawl-delay for the URL's host in seconds, or None."""
+        delay = self._parser(url).crawl_delay(self.user_agent)
+        return float(delay) if delay is not None else None
+
+
+class HostScheduler:
+    """
+    Rate limits requests per host.
+
+    Args:
+        delay: Minimum seconds between requests to the same host (0 for no limit).
+        burst: Number of requests a host may receive back to back after being idle.
+        robots: Optional RobotsCache. Disallowed URLs are refused, and a host's
+                Crawl-delay is used when it is larger than `delay`.
+    """
+
+    def __init__(self, delay=0.1, burst=1, robots=None):
+        self.delay = delay
+        self.burst = burst
+        self.robots = robots
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host, delay=None):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            delay = self.delay if delay is None else delay
+            bucket = self._buckets[host] = TokenBucket(1.0 / delay if delay > 0 else None, self.burst)
+        return bucket
+
+    def ready_in(self, host):
+        """Seconds until a request to the host may be sent."""
+        with self._lock:
+            return self._bucket(host).ready_in(time.monotonic())
+
+    def acquire(self, url):
+        """Reserve a request slot for the URL's host; returns the seconds to wait first."""
+        with self._lock:
+            return self._bucket(urlsplit(url).netloc).reserve(time.monotonic())
+
+    def wait(self, url):
+        """Block until a request to the URL's host may be sent."""
+        wait = self.acquire(url)
+        if wait > 0:
+            time.sleep(wait)
+
+    def allowed(self, url):
+        """
+        Check robots.txt for the URL, fetching it on first contact with the
+        host. This may block, so call it from the thread doing the fetch.
+        """
+        if self.robots is None:
+            return True
+        crawl_delay = self.robots.crawl_delay(url)
+        if crawl_delay is not None and crawl_delay > self.delay:
+            host = urlsplit(url).netloc
+            with self._lock:
+                bucket = self._bucket(host, crawl_delay)
+                if bucket.rate is None or bucket.rate > 1.0 / crawl_delay:
+                    bucket.rate = 1.0 / crawl_delay
+        return self.robots.can_fetch(url)
@@ -0,0 +1,101 @@
+"""
+Positional posting lists.
+
+For every word, the index keeps the IDs of the pages containing it, how
+often it occurs in each (its term frequency) and at which token positions,
+in three parallel typed arrays. Positions of all pages are stored back to
+back, so a posting list costs a few bytes per occurrence rather than an
+object per page.
+
+On disk, the page IDs of each word stay in data/index.json (sorted), and
+data/positions.json holds, in the same order, the positions of the word in
+each page, along with the length (number of tokens) of every page:
+
+    {"doc_lengths": [length of page 0, ...],
+     "positions": {word: [[positions in 1st page], [positions in 2nd page], ...]}}
+
+The term frequency of a word in a page is the number of its positions.
+"""
+
+import json
+from array import array
+from itertools import chain
+
+
+def term_positions(tokens):
+    """Map each distinct token of a tokenized page to the positions it occurs at."""
+    positions = {}
+    for i, token in enumerate(tokens):
+        positions.setdefault(token, []).append(i)
+    return positions
+
+
+class Postings:
+    __slots__ = ('doc_ids', 'tfs', 'positions')
+
+    def __init__(self, doc_ids=(), positions=()):
+        """Create a posting list from page IDs and the word's positions in each page."""
+        self.doc_ids = array('I', doc_ids)
+        self.tfs = array('I', map(len, positions))
+        self.positions = array('I', chain.from_iterable(positions))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        """Iterate over the IDs of the pages in the list."""
+        return iter(self.doc_ids)
+
+    def add(self, doc_id, positions):
+        """Append a page and the positions of the word in it."""
+        self.doc_ids.append(doc_id)
+        self.tfs.append(len(positions))
+        self.positions.extend(positions)
+
+    def get(self, doc_id):
+        """The positions of the word in a page, or None if the page is not in the list."""
+        try:
+            i = self.doc_ids.index(doc_id)
+        except ValueError:
+            return None
+        start = sum(self.tfs[:i])
+        return self.positions[start:start + self.tfs[i]]
+
+    def remove(self, doc_id):
+        """Remove a page from the list. Raises ValueError if it is not there."""
+        i = self.doc_ids.index(doc_id)
+        start = sum(self.tfs[:i])
+        del self.positions[start:start + self.tfs[i]]
+        del self.doc_ids[i]
+        del self.tfs[i]
+
+    def items(self):
+        """Iterate over (page ID, term frequency, positions) in list order."""
+        start = 0
+        for doc_id, tf in zip(self.doc_ids, self.tfs):
+            yield doc_id, tf, self.positions[start:start + tf]
+            start += tf
+
+    def sorted_items(self, key=None):
+        """
+        The list's (page ID, positions) pairs sorted by page ID, or by
+        key(page ID) if given, e.g. to renumber pages while saving.
+        """
+        entries = [(doc_id if key is None else key(doc_id), positions.tolist())
+                   for doc_id, _, positions in self.items()]
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+
+def load_index(data_dir='data'):
+    """
+    Load the saved positional index as a dict mapping each word to its
+    Postings, and the list of page lengths (by page ID).
+    """
+    with open(f'{data_dir}/index.json', 'r') as f:
+        doc_ids = json.load(f)
+    with open(f'{data_dir}/positions.json', 'r') as f:
+        data = json.load(f)
+    positions = data['positions']
+    index = {word: Postings(page_ids, positions[word]) for word, page_ids in doc_ids.items()}
+    return index, data['doc_lengths']
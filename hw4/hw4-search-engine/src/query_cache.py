@@ -0,0 +1,71 @@
+"""
+LRU cache of search results.
+
+Searches are cached under the normalized query (its tokens and phrases),
+the number of results, the ranking parameters and the generation of the
+index they ran on. Since every change to the index, including new PageRank
+scores, creates a new generation (see index_store.py), results computed on
+an older index are never returned, and the search engine drops them when it
+switches to a new one.
+"""
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache with hit and miss counters.
+
+    Args:
+        max_entries: Number of results kept; the least recently used are
+                     evicted beyond it (0 disables the cache).
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The cached value for key, or None (counted as a hit or a miss)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if self.max_entries <= 0:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries (the counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
@@ -0,0 +1,490 @@
+"""
+A local HTTP/JSON search service, and a client for it.
+
+The service opens the index once and answers queries until it is stopped,
+so queries do not pay for starting Python and opening the index. It runs
+on asyncio: connections are kept alive between requests, and searches run
+on a small thread pool so that slow queries do not hold up the others.
+
+Searching is GIL-bound, so run_workers() serves with several processes
+that accept connections on one shared listening socket. They all open the
+same index files, which are memory-mapped (see index_store.py), so the
+operating system keeps one copy of the index in memory however many
+workers there are; each worker only adds its own interpreter, result
+cache and query buffers. Request counts and latencies are kept in shared
+memory, so /stats reports the totals of all workers whichever answers it.
+
+Endpoints (GET only):
+
+    /search?q=<query>&page=<n>&per_page=<n>
+        {"query", "page", "per_page", "results": [...], "has_more", "took_ms"}
+        Pages start at 1; results are as returned by SearchEngine.search(),
+        with snippets made for the requested page only.
+    /suggest?q=<prefix>&n=<n>
+        {"prefix", "suggestions": [{"word", "score", "pages", "pagerank"}, ...], "took_ms"}
+        Autocompletions of a word, as returned by SearchEngine.suggest().
+    /stats
+        Request counts, search latency percentiles, result cache hits and
+        misses, snippet counts and timings, and the index generation.
+    /health
+        {"status": "ok"}
+"""
+
+import asyncio
+import http.client
+import json
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+from .index_store import sync_store
+from .metrics import Histogram
+from .query_cache import DEFAULT_CACHE_SIZE
+from .search_util import SNIPPET_BUCKETS, SearchEngine
+from .shards import ShardedSearchEngine, sync_shards
+from .suggest import MAX_SUGGESTIONS
+
+DEFAULT_PORT = 8144
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+# The deepest result that can be asked for (page * per_page)
+MAX_RESULTS = 1000
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 15.0
+
+# Histogram bucket upper bounds for search latency, in seconds
+SEARCH_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+COUNTERS = ('connections', 'requests', 'searches', 'suggestions', 'bad_requests', 'errors')
+# Cache and snippet statistics added up over the workers
+CACHE_COUNTERS = ('hits', 'misses', 'entries', 'max_entries')
+SNIPPET_COUNTERS = ('snippets', 'characters')
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _int_param(params, name, default, minimum, maximum):
+    try:
+        value = int(params.get(name, [default])[0])
+    except ValueError:
+        raise _BadRequest(f"'{name}' must be an integer")
+    if not minimum <= value <= maximum:
+        raise _BadRequest(f"'{name}' must be between {minimum} and {maximum}")
+    return value
+
+
+class SharedStats:
+    """
+    The counters, search latency histogram, cache statistics and snippet
+    statistics of each worker process, in one shared memory array with a
+    row per worker. Each worker only writes its own row.
+
+    Args:
+        workers: Number of rows.
+        context: The multiprocessing context the workers are started with.
+    """
+
+    def __init__(self, workers, context=multiprocessing):
+        self.workers = workers
+        # counters, latency histogram bucket counts (with +Inf) and sum, cache
+        # statistics, snippet counters, snippet time histogram bucket counts and sum
+        self.width = (len(COUNTERS) + len(SEARCH_BUCKETS) + 2 + len(CACHE_COUNTERS)
+                      + len(SNIPPET_COUNTERS) + len(SNIPPET_BUCKETS) + 2)
+        self.values = context.Array('d', workers * self.width, lock=False)
+
+    def publish(self, worker, counters, latency, cache_stats, snippet_counts, snippet_time):
+        row = ([counters[name] for name in COUNTERS] + latency.counts + [latency.sum]
+               + [cache_stats[name] for name in CACHE_COUNTERS]
+               + [snippet_counts[name] for name in SNIPPET_COUNTERS]
+               + snippet_time.counts + [snippet_time.sum])
+        start = worker * self.width
+        self.values[start:start + self.width] = row
+
+    def totals(self):
+        """
+        (counters, latency Histogram, cache statistics, snippet statistics)
+        of all workers together.
+        """
+        sums = [0.0] * self.width
+        for worker in range(self.workers):
+            row = self.values[worker * self.width:(worker + 1) * self.width]
+            sums = [total + value for total, value in zip(sums, row)]
+        values = iter(sums)
+
+        def take(n):
+            return [next(values) for _ in range(n)]
+
+        def histogram(buckets):
+            result = Histogram(buckets)
+            result.counts = [int(value) for value in take(len(result.counts))]
+            result.count = sum(result.counts)
+            result.sum = next(values)
+            return result
+
+        counters = {name: int(value) for name, value in zip(COUNTERS, take(len(COUNTERS)))}
+        latency = histogram(SEARCH_BUCKETS)
+        cache = {name: int(value) for name, value in zip(CACHE_COUNTERS, take(len(CACHE_COUNTERS)))}
+        lookups = cache['hits'] + cache['misses']
+        cache['hit_rate'] = round(cache['hits'] / lookups, 4) if lookups else None
+        snippets = {name: int(value)
+                    for name, value in zip(SNIPPET_COUNTERS, take(len(SNIPPET_COUNTERS)))}
+        snippets['seconds'] = histogram(SNIPPET_BUCKETS).snapshot()
+        return counters, latency, cache, snippets
+
+
+class SearchService:
+    """
+    Serves a SearchEngine over HTTP.
+
+    Args:
+        engine: The SearchEngine to query.
+        threads: Number of searches that can run at the same time.
+        shared: Optional SharedStats of a pool of workers, this one being
+                row worker, to report the totals of all of them.
+    """
+
+    def __init__(self, engine, threads=4, shared=None, worker=0):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='search')
+        self.latency = Histogram(SEARCH_BUCKETS)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.shared = shared
+        self.worker = worker
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, ready=None, sock=None):
+        """
+        Accept connections until cancelled, on host and port or on an
+        already listening socket. ready(server), if given, is called once
+        listening (e.g. to learn the port when port is 0).
+        """
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Answer the requests of one connection until it is closed or idle."""
+        self._count('connections')
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': "malformed request line"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                # Requests have no use for a body; skip it to reach the next request
+                length = int(headers.get('content-length', 0) or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection != 'close' if version == 'HTTP/1.1'
+                              else connection == 'keep-alive')
+
+                status, payload = await self.handle_request(method, target)
+                self._publish()
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent something we cannot parse
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, target):
+        """The (status, JSON payload) response to a request."""
+        self._count('requests')
+        if method != 'GET':
+            return 405, {'error': "only GET is supported"}
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        try:
+            if url.path == '/search':
+                return 200, await self.search(params)
+            if url.path == '/suggest':
+                return 200, await self.suggest(params)
+            if url.path == '/stats':
+                return 200, self.stats()
+            if url.path == '/health':
+                return 200, {'status': 'ok'}
+            return 404, {'error': f"no such endpoint: {url.path}"}
+        except _BadRequest as e:
+            self._count('bad_requests')
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self._count('errors')
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+
+    async def search(self, params):
+        query = params.get('q', [''])[0]
+        if not query.strip():
+            raise _BadRequest("missing query parameter 'q'")
+        per_page = _int_param(params, 'per_page', DEFAULT_PER_PAGE, 1, MAX_PER_PAGE)
+        page = _int_param(params, 'page', 1, 1, MAX_RESULTS // per_page)
+        offset = (page - 1) * per_page
+
+        # One more result than needed, to tell whether there is a next page
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        results = await loop.run_in_executor(
+            self.executor, self.engine.search, query, offset + per_page + 1, offset)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters['searches'] += 1
+            self.latency.observe(elapsed)
+
+        return {
+            'query': query,
+            'page': page,
+            'per_page': per_page,
+            'results': results[:per_page],
+            'has_more': len(results) > per_page,
+            'took_ms': round(elapsed * 1000, 3),
+        }
+
+    async def suggest(self, params):
+        prefix = params.get('q', [''])[0]
+        n = _int_param(params, 'n', MAX_SUGGESTIONS, 1, MAX_SUGGESTIONS)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        suggestions = await loop.run_in_executor(self.executor, self.engine.suggest, prefix, n)
+        elapsed = time.perf_counter() - start
+        self._count('suggestions')
+        return {'prefix': prefix, 'suggestions': suggestions, 'took_ms': round(elapsed * 1000, 3)}
+
+    def stats(self):
+        index = self.engine.index
+        self._publish()
+        with self._lock:
+            if self.shared is not None:
+                counters, latency, cache, snippets = self.shared.totals()
+            else:
+                counters, latency = dict(self.counters), self.latency
+                cache, snippets = self.engine.cache.stats(), self.engine.snippet_stats()
+            return {
+                'uptime': round(time.monotonic() - self.started, 3),
+                'workers': self.shared.workers if self.shared is not None else 1,
+                'counters': counters,
+                'latency_seconds': latency.snapshot(),
+                'cache': cache,
+                'snippets': snippets,
+                'index': {'generation': index.generation, 'pages': index.num_docs,
+                          'segments': index.num_segments},
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _publish(self):
+        if self.shared is not None:
+            with self._lock:
+                self.shared.publish(self.worker, self.counters, self.latency,
+                                    self.engine.cache.stats(), self.engine.snippet_counts,
+                                    self.engine.snippet_time)
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def run_service(engine, host='127.0.0.1', port=DEFAULT_PORT, threads=4):
+    """Serve engine until interrupted (Ctrl+C)."""
+    service = SearchService(engine, threads)
+
+    def ready(server):
+        for sock in server.sockets:
+            address = sock.getsockname()
+            print(f"Serving searches on http://{address[0]}:{address[1]}/ (Ctrl+C to stop)")
+
+    try:
+        asyncio.run(service.serve(host, port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+def open_engine(data_dir='data', cache_size=DEFAULT_CACHE_SIZE, num_shards=None):
+    """A SearchEngine, or a ShardedSearchEngine over num_shards shards if given."""
+    if num_shards:
+        return ShardedSearchEngine(data_dir, num_shards, cache_size)
+    return SearchEngine(data_dir, cache_size)
+
+
+def _serve_worker(sock, data_dir, threads, cache_size, num_shards, shared, worker):
+    # Ctrl+C reaches the whole process group; the parent stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    service = SearchService(open_engine(data_dir, cache_size, num_shards), threads, shared, worker)
+    try:
+        asyncio.run(service.serve(sock=sock))
+    finally:
+        service.close()
+
+
+def run_workers(data_dir='data', host='127.0.0.1', port=DEFAULT_PORT, processes=None,
+                threads=4, cache_size=DEFAULT_CACHE_SIZE, num_shards=None):
+    """
+    Serve the index in data_dir (split into num_shards shards, if given)
+    with a pool of worker processes (default: one per core) until
+    interrupted (Ctrl+C). Workers that die are restarted.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    # Build or update the index once, before the workers open it
+    if num_shards:
+        sync_shards(data_dir, num_shards, log=print)
+    else:
+        sync_store(data_dir, log=print)
+
+    context = multiprocessing.get_context('spawn')
+    shared = SharedStats(processes, context)
+    sock = socket.create_server((host, port))
+    address = sock.getsockname()
+
+    def start(worker):
+        process = context.Process(target=_serve_worker, name=f'search-worker-{worker}',
+                                  args=(sock, data_dir, threads, cache_size, num_shards, shared, worker),
+                                  daemon=True)
+        process.start()
+        return process
+
+    # Stop the workers when terminated too, not just on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = [start(worker) for worker in range(processes)]
+    print(f"Serving searches on http://{address[0]}:{address[1]}/ "
+          f"with {processes} worker processes (Ctrl+C to stop)")
+    try:
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in workers])
+            for worker, process in enumerate(workers):
+                if not process.is_alive():
+                    print(f"Worker {worker} exited with code {process.exitcode}; restarting it")
+                    time.sleep(1.0)  # do not spin if workers cannot start at all
+                    workers[worker] = start(worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
+        sock.close()
+
+
+class SearchClient:
+    """
+    Queries a running search service, with the same search() as
+    SearchEngine, over one kept-alive connection.
+    """
+
+    def __init__(self, url, timeout=30.0):
+        parts = urlsplit(url if '//' in url else f'http://{url}')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._connection = None
+
+    def search(self, query, max_results=10, offset=0):
+        """
+        As SearchEngine.search(): the best max_results are ranked, and
+        those from offset on returned. The service returns them in pages of
+        at most MAX_PER_PAGE results, so they are fetched as one page when
+        possible and over several requests otherwise; results past the
+        first MAX_RESULTS cannot be had.
+        """
+        if max_results > MAX_RESULTS:
+            raise ValueError(f"the search service only returns the first {MAX_RESULTS} results "
+                             f"(asked for {max_results})")
+        count = max_results - offset
+        if count <= 0:
+            return []
+        if count <= MAX_PER_PAGE and offset % count == 0:
+            return self._search_page(query, count, offset // count + 1)['results']
+        results = []
+        first_page = offset // MAX_PER_PAGE + 1
+        for page in range(first_page, (max_results - 1) // MAX_PER_PAGE + 2):
+            response = self._search_page(query, MAX_PER_PAGE, page)
+            results += response['results']
+            if not response['has_more']:
+                break
+        skip = offset - (first_page - 1) * MAX_PER_PAGE
+        return results[skip:skip + count]
+
+    def _search_page(self, query, per_page, page):
+        params = urlencode({'q': query, 'per_page': per_page, 'page': page}, quote_via=quote)
+        return self._get(f'/search?{params}')
+
+    def suggest(self, prefix, max_suggestions=MAX_SUGGESTIONS):
+        params = urlencode({'q': prefix, 'n': max_suggestions}, quote_via=quote)
+        return self._get(f'/suggest?{params}')['suggestions']
+
+    def stats(self):
+        return self._get('/stats')
+
+    def cache_stats(self):
+        return self.stats()['cache']
+
+    def snippet_stats(self):
+        return self.stats()['snippets']
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _get(self, path):
+        # Reconnect once if the service closed the idle connection
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port,
+                                                              timeout=self.timeout)
+            try:
+                self._connection.request('GET', path)
+                response = self._connection.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (ConnectionError, http.client.HTTPException):
+                self.close()
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"search service error {response.status}: {payload.get('error')}")
+        return payload
@@ -5,11 +5,20 @@ Ranking Configuration:
 All ranking parameters are now in ranking_config.py in the project root.
 Edit that file to experiment with different ranking strategies!
 """
-import json
+import math
 import re
 import os
 import sys
-from collections import defaultdict
+import threading
+import time
+from collections import Counter
+import numpy as np
+from .index_store import SegmentedIndex, read_generation, sync_store
+from .metrics import Histogram
+from .query_cache import DEFAULT_CACHE_SIZE, QueryCache
+from .snippets import make_snippet
+from .suggest import MAX_SUGGESTIONS, Suggester, build_suggestions
+from .topk import BLOCK_SIZE, QueryTerm, top_k
 from .stopwords import is_stop_word
 
 _config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ranking_config.py')
@@ -27,6 +36,10 @@ try:
     PARTIAL_MATCH_PENALTY = ranking_config.PARTIAL_MATCH_PENALTY
     TEXT_RELEVANCE_WEIGHT = ranking_config.TEXT_RELEVANCE_WEIGHT
     PAGERANK_WEIGHT = ranking_config.PAGERANK_WEIGHT
+    TEXT_SCORER = ranking_config.TEXT_SCORER
+    BM25_K1 = ranking_config.BM25_K1
+    BM25_B = ranking_config.BM25_B
+    SCORING_BACKEND = ranking_config.SCORING_BACKEND
 except Exception as e:
     # Could not load ranking_config.py, so use default values
     print(f"Warning: Could not load ranking_config.py: {e}", file=sys.stderr)
@@ -38,132 +51,626 @@ except Exception as e:
     PARTIAL_MATCH_PENALTY = 0.5
     TEXT_RELEVANCE_WEIGHT = 0.9
     PAGERANK_WEIGHT = 0.1
+    TEXT_SCORER = 'match'
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    SCORING_BACKEND = 'topk'
+
+# Minimum seconds between two checks for a new generation of the index
+REFRESH_INTERVAL = 1.0
+
+# Query suggestions, in the data directory (see suggest.py)
+SUGGESTIONS_FILE = 'suggestions.npz'
+
+# Histogram bucket upper bounds for the time spent making the snippets of a search, in seconds
+SNIPPET_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def _ranking_parameters():
+    """The current ranking parameters, which cached results depend on."""
+    return (TEXT_SCORER, MEANINGFUL_WORD_WEIGHT, STOP_WORD_WEIGHT, PERFECT_MATCH_BONUS_MIN,
+            ALL_WORDS_MATCH_BONUS_MIN, PARTIAL_MATCH_PENALTY, TEXT_RELEVANCE_WEIGHT,
+            PAGERANK_WEIGHT, BM25_K1, BM25_B)
+
+
+class CollectionStats:
+    """
+    The statistics of the whole collection that BM25 scores depend on:
+    the number of pages, their average length and the number of pages
+    containing each word (None to count them in the posting lists).
+    A shard of the index is scored with those of all shards (see shards.py).
+    """
+    
+    def __init__(self, num_docs, avg_doc_length, doc_freqs=None):
+        self.num_docs = num_docs
+        self.avg_doc_length = avg_doc_length
+        self.doc_freqs = doc_freqs
+    
+    @classmethod
+    def of(cls, index):
+        return cls(index.num_docs, index.avg_doc_length)
+    
+    def doc_freq(self, word, doc_ids):
+        """The document frequency of a word whose posting list in the index has doc_ids."""
+        return len(doc_ids) if self.doc_freqs is None else self.doc_freqs[word]
 
 
 class SearchEngine:
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', cache_size=DEFAULT_CACHE_SIZE):
         """
-        Initialize Bernoulli by loading the index, PageRank scores,
-        and page metadata.
+        Initialize Bernoulli by opening the segmented index, which holds the
+        index, PageRank scores and page metadata (see index_store.py). It
+        is compiled from the JSON data files first if it is missing or out
+        of date. The results of the last cache_size distinct queries are
+        cached (see query_cache.py).
         """
         self.data_dir = data_dir
+        self.cache = QueryCache(cache_size)
+        self._suggester = None
+        self._suggest_lock = threading.Lock()
+        self._suggest_thread = None
+        # Snippets made and the time they took per search (see snippet_stats())
+        self.snippet_counts = {'snippets': 0, 'characters': 0}
+        self.snippet_time = Histogram(SNIPPET_BUCKETS)
+        self._snippet_lock = threading.Lock()
+        
+        self._sync_index()
         
-        with open(f'{data_dir}/index.json', 'r') as f:
-            self.index = json.load(f)
+        # Posting lists and page records are read from the memory-mapped
+        # segments on demand, so startup does not depend on the size of the index
+        self.index = self._open_index()
+        self._last_refresh = time.monotonic()
+    
+    def _sync_index(self):
+        """Build or update the index from the JSON data files if they changed."""
+        sync_store(self.data_dir, log=lambda message: print(message, file=sys.stderr))
+    
+    def _open_index(self):
+        """Open the latest generation of the index."""
+        return SegmentedIndex(self.data_dir)
+    
+    def _latest_generation(self):
+        """The generation of the index on disk (None if there is none)."""
+        return read_generation(self.data_dir)
+    
+    def _suggestions_path(self):
+        return os.path.join(self.data_dir, SUGGESTIONS_FILE)
+    
+    def _suggestion_indexes(self, index):
+        """The SegmentedIndex objects whose words are suggested."""
+        return [index]
+    
+    def refresh(self):
+        """
+        Switch to the latest generation of the index, e.g. after a recrawl
+        added pages or a merge replaced segments, without restarting.
+        Checks at most once per REFRESH_INTERVAL; returns True if it switched.
+        """
+        now = time.monotonic()
+        if now - self._last_refresh < REFRESH_INTERVAL:
+            return False
+        self._last_refresh = now
+        if self._latest_generation() in (None, self.index.generation):
+            return False
+        # Searches already running keep the segments they started with
+        self.index = self._open_index()
+        self.cache.clear()
+        return True
+    
+    def cache_stats(self):
+        """Hit and miss counts of the result cache (see QueryCache.stats())."""
+        return self.cache.stats()
+    
+    def snippet_stats(self):
+        """
+        The number of snippets made from page texts, the characters of text
+        they were made from, and the time spent making the snippets of a
+        search (see Histogram.snapshot()).
+        """
+        with self._snippet_lock:
+            return dict(self.snippet_counts, seconds=self.snippet_time.snapshot())
+    
+    def suggest(self, prefix, max_suggestions=MAX_SUGGESTIONS):
+        """
+        Autocomplete a word: up to max_suggestions words of the index
+        starting with prefix (stop words excepted), best first. Words score
+        higher the more pages contain them and the higher the best PageRank
+        among those pages (see suggest.py). Each suggestion is a dict with
+        word, score, pages (how many contain it) and pagerank (the best).
         
-        with open(f'{data_dir}/pagerank.json', 'r') as f:
-            self.pagerank = json.load(f)
+        The suggestions are computed once per generation of the index and
+        saved. Until they are recomputed for a new generation, those of the
+        previous one are used.
+        """
+        suggester = self._current_suggester()
+        return [{'word': word, 'score': score, 'pages': pages, 'pagerank': pagerank}
+                for word, score, pages, pagerank in suggester.suggest(prefix, max_suggestions)]
+    
+    def _current_suggester(self):
+        """The Suggester of the current index, building or loading it if needed."""
+        self.refresh()
+        index = self.index
+        key = (index.generation, (TEXT_RELEVANCE_WEIGHT, PAGERANK_WEIGHT))
+        suggester = self._suggester
+        if suggester is not None and (suggester.generation, suggester.weights) == key:
+            return suggester
         
-        with open(f'{data_dir}/page_info.json', 'r') as f:
-            self.page_info = json.load(f)
+        with self._suggest_lock:
+            if self._suggest_thread is not None and self._suggest_thread.is_alive():
+                return self._suggester
+            # Saved by another process or an earlier run?
+            path = self._suggestions_path()
+            try:
+                saved = Suggester(path)
+                if (saved.generation, saved.weights) == key:
+                    self._suggester = saved
+                    return saved
+            except (OSError, ValueError, KeyError):
+                pass
+            
+            def build():
+                build_suggestions(path, self._suggestion_indexes(index), *key)
+                self._suggester = Suggester(path)
+            
+            if self._suggester is None:
+                print("Building query suggestions...", file=sys.stderr)
+                build()
+            else:
+                # Keep suggesting from the previous generation meanwhile
+                self._suggest_thread = threading.Thread(target=build, name='suggestions', daemon=True)
+                self._suggest_thread.start()
+            return self._suggester
     
     def tokenize(self, query):
         """Tokenize a search query into words, removing stop words."""
         words = re.findall(r'\b[a-z0-9]+\b', query.lower())
         return words
     
-    def search(self, query, max_results=10):
+    def parse_query(self, query):
+        """
+        Split a query into its words and its quoted phrases, e.g.
+        'caltech "computer science"' -> (['caltech', 'computer', 'science'],
+        [['computer', 'science']]).
+        """
+        phrases = [self.tokenize(phrase) for phrase in re.findall(r'"([^"]*)"', query)]
+        return self.tokenize(query), [phrase for phrase in phrases if phrase]
+    
+    def search(self, query, max_results=10, offset=0):
         """
         Search for pages matching the query.
         
         Returns results ranked by a combination of:
-        - Text relevance (pages with ALL query words ranked highest)
+        - Text relevance (see TEXT_SCORER in ranking_config.py)
         - PageRank score
+        
+        Quoted phrases in the query must appear in a page, word for word,
+        for it to be returned. The best pages are found without scoring
+        every page that contains a query word (see topk.py); ties go to the
+        lower page ID.
+        
+        The best max_results are ranked, and those from offset on returned
+        (e.g. one page of them). Their snippets are the passages of their
+        pages that best match the query, with the (start, end) spans of the
+        query words in them as highlights (see snippets.py). Only the
+        results returned get a snippet made, so the cost of snippets is
+        bounded by the number of results shown; see snippet_stats().
+        
+        Results are cached by query words, phrases, max_results, ranking
+        parameters and index generation; see self.cache.stats() for the
+        hit and miss counts. Snippets are cached with them once made.
         """
-        query_words = self.tokenize(query)
+        query_words, phrases = self.parse_query(query)
         
         if not query_words:
             return []
         
-        # Find pages containing each query word
-        pages_by_word = {}
-        for word in query_words:
-            if word in self.index:
-                pages_by_word[word] = set(self.index[word])
+        self.refresh()
+        # The whole query uses one generation of the index
+        index = self.index
         
-        if not pages_by_word:
-            # No words found in index
+        key = (tuple(query_words), tuple(map(tuple, phrases)), max_results,
+               index.generation, _ranking_parameters())
+        hits = self.cache.get(key)
+        if hits is None:
+            hits = self._search(index, query_words, phrases, max_results)
+            self.cache.put(key, hits)
+        return self._with_snippets(hits, offset, query_words)
+    
+    def _search(self, index, query_words, phrases, max_results):
+        """
+        The hits of a parsed query on one generation of the index, best
+        first: (result, index the page is in, page ID in that index).
+        """
+        accept = self._phrase_filter(index, phrases)
+        if accept is not None and not accept:
             return []
+        scoring = self._text_scoring(index, query_words, accept)
+        if scoring is None:
+            return []
+        max_text_score = self._max_text_score(index, query_words)
+        ranking = self._ranking(index, scoring, accept, max_text_score, max_results)
+        return [(self._result(index, score, page_id), index, page_id) for score, page_id in ranking]
+    
+    def _result(self, index, score, page_id):
+        """A search result with the page's metadata."""
+        url, title, snippet = index.document(page_id)
+        return {
+            'url': url,
+            'title': title,
+            'snippet': snippet,
+            'highlights': (),
+            'score': score,
+            'pagerank': index.pagerank[page_id]
+        }
+    
+    def _with_snippets(self, hits, offset, query_words):
+        """
+        Copies of the results of hits[offset:], with query-dependent
+        snippets. A hit's snippet is made the first time it is returned,
+        from its page's text, and the hit is replaced by its final result
+        (index and page ID None). Pages without a stored text keep the
+        snippet saved at indexing time, with the query words highlighted.
+        """
+        results = []
+        started = time.perf_counter()
+        num_snippets = characters = 0
+        for i in range(offset, len(hits)):
+            result, page_index, page_id = hits[i]
+            if page_index is not None:
+                result = dict(result)
+                text = page_index.text(page_id)
+                if text is None:
+                    text = result['snippet']
+                    result['snippet'], result['highlights'] = make_snippet(text, query_words, len(text))
+                else:
+                    result['snippet'], result['highlights'] = make_snippet(text, query_words)
+                    num_snippets += 1
+                    characters += len(text)
+                hits[i] = (result, None, None)
+            # Copies, so callers cannot change the cached results
+            results.append(dict(result))
+        if num_snippets:
+            elapsed = time.perf_counter() - started
+            with self._snippet_lock:
+                self.snippet_counts['snippets'] += num_snippets
+                self.snippet_counts['characters'] += characters
+                self.snippet_time.observe(elapsed)
+        return results
+    
+    def _phrase_filter(self, index, phrases):
+        """
+        The IDs of the pages containing all the quoted phrases (None if
+        there are none), as quoted phrases restrict the results to them.
+        """
+        accept = None
+        for phrase in phrases:
+            matching_pages = self._phrase_pages(index, phrase)
+            accept = matching_pages if accept is None else accept & matching_pages
+            if not accept:
+                return set()
+        return accept
+    
+    def _text_scoring(self, index, query_words, accept, collection=None):
+        """
+        The text scores of the accepted pages matching the query, in the
+        form the scoring backend ranks from; None if no page matches.
+        collection holds the statistics BM25 uses if they are not the
+        index's own (see CollectionStats).
+        """
+        if SCORING_BACKEND == 'numpy':
+            if TEXT_SCORER == 'bm25':
+                page_ids, text_scores = self._bm25_vector_scores(index, query_words, collection)
+            else:
+                page_ids, text_scores = self._match_vector_scores(index, query_words)
+            if accept is not None:
+                accepted = np.fromiter(accept, dtype=np.int64, count=len(accept))
+                keep = np.isin(page_ids, accepted)
+                page_ids, text_scores = page_ids[keep], text_scores[keep]
+            if not len(page_ids):
+                return None
+            return page_ids, text_scores
         
-        # Get all candidate pages (union of all word matches)
-        candidate_pages = set()
-        for pages in pages_by_word.values():
-            candidate_pages.update(pages)
+        if TEXT_SCORER == 'bm25':
+            terms, text_score = self._bm25_terms(index, query_words, collection)
+        else:
+            terms, text_score = self._match_terms(index, query_words)
+        if not terms:
+            return None
+        return terms, text_score
+    
+    def _max_text_score(self, index, query_words, collection=None):
+        """
+        The highest text score a page could have for the query, which text
+        scores are normalized to [0, 1] by. It follows from the query and
+        the collection statistics alone, so ranking takes a single pass over
+        the posting lists: 1 for the match scorer, and for BM25 the sum of
+        the scores the query words approach as their counts in a page grow.
+        """
+        if TEXT_SCORER != 'bm25':
+            return 1.0
+        collection = collection or CollectionStats.of(index)
+        num_pages = collection.num_docs
+        score = 0.0
+        for word, count in Counter(query_words).items():
+            if collection.doc_freqs is None:
+                df = index.doc_freq(word)
+            else:
+                df = collection.doc_freqs[word]
+            if df:
+                idf = math.log(1 + (num_pages - df + 0.5) / (df + 0.5))
+                score += count * idf * (BM25_K1 + 1)
+        return score
+    
+    def _ranking(self, index, scoring, accept, max_text_score, max_results):
+        """
+        The best (score, page ID) pairs, from best to worst, given the
+        _text_scoring() of the query and its _max_text_score().
+        """
+        if max_text_score <= 0:
+            max_text_score = 1.0
+        if SCORING_BACKEND == 'numpy':
+            page_ids, text_scores = scoring
+            return self._vector_ranking(index, page_ids, text_scores, max_text_score, max_results)
+        terms, text_score = scoring
+        return self._topk_ranking(index, terms, text_score, accept, max_text_score, max_results)
+    
+    def _topk_ranking(self, index, terms, text_score, accept, max_text_score, max_results):
+        """
+        The best (score, page ID) pairs from the top-k evaluator (see
+        topk.py), from best to worst.
+        """
+        # Combine text scores with PageRank (weights are configurable above)
+        def final_score(values, pr_score):
+            # Normalize PageRank (assuming it's already in reasonable range)
+            return (TEXT_RELEVANCE_WEIGHT * (text_score(values) / max_text_score)
+                    + PAGERANK_WEIGHT * pr_score)
         
-        if not candidate_pages:
-            return []
+        return top_k(terms, final_score, max_results, accept, index.pagerank, index.max_pagerank)
+    
+    def _vector_ranking(self, index, page_ids, text_scores, max_text_score, max_results):
+        """
+        The same ranking as _topk_ranking(), computed for all candidate
+        pages at once with NumPy array operations. Faster when the query
+        words occur in many pages.
+        """
+        # Combine text scores with PageRank (weights are configurable above)
+        pagerank = np.frombuffer(index.pagerank, dtype=np.float64)
+        final_scores = (TEXT_RELEVANCE_WEIGHT * (text_scores / max_text_score)
+                        + PAGERANK_WEIGHT * pagerank[page_ids])
+        
+        # The max_results best, ties going to the lower page ID (page_ids is sorted)
+        if max_results < len(final_scores):
+            best = np.argpartition(-final_scores, max_results - 1)[:max_results]
+            cutoff = final_scores[best].min()
+            above = np.flatnonzero(final_scores > cutoff)
+            ties = np.flatnonzero(final_scores == cutoff)[:max_results - len(above)]
+            best = np.concatenate([above, ties])
+        else:
+            best = np.arange(len(final_scores))
+        best = best[np.lexsort((page_ids[best], -final_scores[best]))]
+        return [(float(final_scores[i]), int(page_ids[i])) for i in best]
+    
+    def _query_postings(self, index, query_words):
+        """
+        (word, count in the query, posting list) for the distinct query
+        words in the index, with the posting lists as NumPy arrays.
+        """
+        result = []
+        for word, count in Counter(query_words).items():
+            postings = index.postings_arrays(word)
+            if postings is not None:
+                result.append((word, count, postings))
+        return result
+    
+    def _candidates(self, id_arrays):
+        """
+        The sorted union of arrays of page IDs, and the positions of each
+        array's IDs in it.
+        """
+        num_ids = max(int(doc_ids[-1]) for doc_ids in id_arrays) + 1
+        if sum(map(len, id_arrays)) * 4 >= num_ids:
+            # Many candidates: mark them in an array over all page IDs
+            is_candidate = np.zeros(num_ids, dtype=bool)
+            for doc_ids in id_arrays:
+                is_candidate[doc_ids] = True
+            position = np.cumsum(is_candidate) - 1
+            return np.flatnonzero(is_candidate), [position[doc_ids] for doc_ids in id_arrays]
+        page_ids, inverse = np.unique(np.concatenate(id_arrays), return_inverse=True)
+        return page_ids, np.split(inverse, np.cumsum([len(doc_ids) for doc_ids in id_arrays])[:-1])
+    
+    def _match_vector_scores(self, index, query_words):
+        """
+        The candidate page IDs (sorted) and their match scores, as in
+        _match_terms().
+        """
+        query_postings = self._query_postings(index, query_words)
+        if not query_postings:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        page_ids, positions = self._candidates([doc_ids for _, _, (doc_ids, _, _) in query_postings])
+        
+        # Count matching words per page (a word repeated in the query counts
+        # once per occurrence)
+        page_meaningful = np.zeros(len(page_ids), dtype=np.int64)
+        page_stop = np.zeros(len(page_ids), dtype=np.int64)
+        for (word, count, _), word_positions in zip(query_postings, positions):
+            matching = page_stop if is_stop_word(word) else page_meaningful
+            matching[word_positions] += count
+        matching_total = page_meaningful + page_stop
         
         # Separate stop words from meaningful words
-        stop_words = [w for w in query_words if is_stop_word(w)]
-        meaningful_words = [w for w in query_words if not is_stop_word(w)]
-        
-        # Score each candidate page
-        page_scores = {}
-        for url in candidate_pages:
-            # Count matching words (weight meaningful words more)
-            matching_meaningful = sum(1 for word in meaningful_words 
-                                    if word in pages_by_word and url in pages_by_word[word])
-            matching_stop = sum(1 for word in stop_words 
-                              if word in pages_by_word and url in pages_by_word[word])
-            matching_total = matching_meaningful + matching_stop
-            
-            if matching_total == 0:
+        num_stop = sum(1 for w in query_words if is_stop_word(w))
+        num_meaningful = len(query_words) - num_stop
+        max_weighted = num_meaningful * MEANINGFUL_WORD_WEIGHT + num_stop * STOP_WORD_WEIGHT
+        
+        # Base score: weighted fraction of words matched
+        weighted_matches = page_meaningful * MEANINGFUL_WORD_WEIGHT + page_stop * STOP_WORD_WEIGHT
+        if max_weighted > 0:
+            scores = weighted_matches / max_weighted
+        else:
+            # All words are stop words - treat normally
+            scores = matching_total / len(query_words)
+        
+        # Bonuses for pages containing ALL words, penalty for partial matches
+        all_words = matching_total == len(query_words)
+        perfect = all_words & (page_meaningful == num_meaningful) & (num_meaningful > 0)
+        scores = np.where(
+            perfect, PERFECT_MATCH_BONUS_MIN + (1.0 - PERFECT_MATCH_BONUS_MIN) * scores,
+            np.where(all_words, ALL_WORDS_MATCH_BONUS_MIN + (1.0 - ALL_WORDS_MATCH_BONUS_MIN) * scores,
+                     scores * PARTIAL_MATCH_PENALTY))
+        return page_ids, scores
+    
+    def _bm25_vector_scores(self, index, query_words, collection=None):
+        """
+        The candidate page IDs (sorted) and their BM25 scores, as in
+        _bm25_terms().
+        """
+        query_postings = self._query_postings(index, query_words)
+        if not query_postings:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        page_ids, positions = self._candidates([doc_ids for _, _, (doc_ids, _, _) in query_postings])
+        
+        collection = collection or CollectionStats.of(index)
+        num_pages = collection.num_docs
+        # Length normalization: norm = k1 * (1 - b + b * length / average length)
+        avg_length = collection.avg_doc_length or 1.0
+        norm_base = BM25_K1 * (1 - BM25_B)
+        norm_per_word = BM25_K1 * BM25_B / avg_length
+        
+        # Accumulated in query word order, so the sums equal _bm25_terms()'s
+        scores = np.zeros(len(page_ids))
+        for (word, count, (doc_ids, tfs, doc_lengths)), word_positions in zip(query_postings, positions):
+            # Rare words count more
+            df = collection.doc_freq(word, doc_ids)
+            idf = math.log(1 + (num_pages - df + 0.5) / (df + 0.5))
+            weight = count * idf * (BM25_K1 + 1)
+            norm = norm_base + norm_per_word * doc_lengths
+            scores[word_positions] += weight * tfs / (tfs + norm)
+        return page_ids, scores
+    
+    def _match_terms(self, index, query_words):
+        """
+        The query terms (see topk.py) and text score function of the match
+        scorer, which scores pages by the (weighted) fraction of the query
+        words they contain.
+        """
+        # Separate stop words from meaningful words
+        num_stop = sum(1 for w in query_words if is_stop_word(w))
+        num_meaningful = len(query_words) - num_stop
+        max_weighted = num_meaningful * MEANINGFUL_WORD_WEIGHT + num_stop * STOP_WORD_WEIGHT
+        
+        # A word repeated in the query counts once per occurrence
+        terms = []
+        counts = []
+        stop = []
+        for word, count in Counter(query_words).items():
+            postings = index.postings(word)
+            if postings is None:
                 continue
+            is_stop = is_stop_word(word)
+            weight = STOP_WORD_WEIGHT if is_stop else MEANINGFUL_WORD_WEIGHT
+            terms.append(QueryTerm(postings[0], count * weight))
+            counts.append(count)
+            stop.append(is_stop)
+        
+        def text_score(values):
+            page_meaningful = page_stop = 0
+            for value, count, is_stop in zip(values, counts, stop):
+                if value is not None:
+                    if is_stop:
+                        page_stop += count
+                    else:
+                        page_meaningful += count
+            matching_total = page_meaningful + page_stop
             
             # Weight meaningful words more than stop words (configurable)
-            weighted_matches = matching_meaningful * MEANINGFUL_WORD_WEIGHT + matching_stop * STOP_WORD_WEIGHT
-            max_weighted = len(meaningful_words) * MEANINGFUL_WORD_WEIGHT + len(stop_words) * STOP_WORD_WEIGHT
+            weighted_matches = page_meaningful * MEANINGFUL_WORD_WEIGHT + page_stop * STOP_WORD_WEIGHT
             
             # Base score: weighted fraction of words matched
             if max_weighted > 0:
-                text_score = weighted_matches / max_weighted
+                score = weighted_matches / max_weighted
             else:
                 # All words are stop words - treat normally
-                text_score = matching_total / len(query_words)
+                score = matching_total / len(query_words)
             
             # Big bonus if page contains ALL words (especially meaningful ones)
             if matching_total == len(query_words):
-                if matching_meaningful == len(meaningful_words) and len(meaningful_words) > 0:
+                if page_meaningful == num_meaningful and num_meaningful > 0:
                     # Perfect match on meaningful words
-                    text_score = PERFECT_MATCH_BONUS_MIN + (1.0 - PERFECT_MATCH_BONUS_MIN) * text_score
+                    score = PERFECT_MATCH_BONUS_MIN + (1.0 - PERFECT_MATCH_BONUS_MIN) * score
                 else:
                     # All words matched but some are stop words
-                    text_score = ALL_WORDS_MATCH_BONUS_MIN + (1.0 - ALL_WORDS_MATCH_BONUS_MIN) * text_score
+                    score = ALL_WORDS_MATCH_BONUS_MIN + (1.0 - ALL_WORDS_MATCH_BONUS_MIN) * score
             else:
                 # Partial matches get lower scores
-                text_score = text_score * PARTIAL_MATCH_PENALTY
+                score = score * PARTIAL_MATCH_PENALTY
             
-            page_scores[url] = text_score
-        
-        if not page_scores:
-            return []
+            return score
         
-        # Normalize text scores to [0, 1] range
-        max_text_score = max(page_scores.values())
-        if max_text_score > 0:
-            for url in page_scores:
-                page_scores[url] /= max_text_score
-        
-        # Combine text scores with PageRank (weights are configurable above)
-        final_scores = {}
-        for url, text_score in page_scores.items():
-            pr_score = self.pagerank.get(url, 0.0)
-            # Normalize PageRank (assuming it's already in reasonable range)
-            final_scores[url] = TEXT_RELEVANCE_WEIGHT * text_score + PAGERANK_WEIGHT * pr_score
+        return terms, text_score
+    
+    def _bm25_terms(self, index, query_words, collection=None):
+        """
+        The query terms (see topk.py) and text score function of Okapi
+        BM25. A word's value in a page is its BM25 score, bounded per block
+        by the block's highest term frequency and shortest page.
+        """
+        collection = collection or CollectionStats.of(index)
+        num_pages = collection.num_docs
+        # Length normalization: norm = k1 * (1 - b + b * length / average length)
+        avg_length = collection.avg_doc_length or 1.0
+        norm_base = BM25_K1 * (1 - BM25_B)
+        norm_per_word = BM25_K1 * BM25_B / avg_length
         
-        # Sort by combined score
-        sorted_results = sorted(final_scores.items(), key=lambda x: x[1], reverse=True)
+        terms = []
+        for word, count in Counter(query_words).items():
+            postings = index.postings(word)
+            if postings is None:
+                continue
+            doc_ids, tfs, doc_lengths = postings
+            # Rare words count more
+            df = collection.doc_freq(word, doc_ids)
+            idf = math.log(1 + (num_pages - df + 0.5) / (df + 0.5))
+            weight = count * idf * (BM25_K1 + 1)
+            
+            def value(i, weight=weight, tfs=tfs, doc_lengths=doc_lengths):
+                tf = tfs[i]
+                norm = norm_base + norm_per_word * doc_lengths[i]
+                return weight * tf / (tf + norm)
+            
+            # Slightly loosened so rounding can never put a bound below a value
+            block_bounds = []
+            for start in range(0, len(doc_ids), BLOCK_SIZE):
+                tf = max(tfs[start:start + BLOCK_SIZE])
+                norm = norm_base + norm_per_word * min(doc_lengths[start:start + BLOCK_SIZE])
+                block_bounds.append(weight * tf / (tf + norm) * (1 + 1e-9))
+            terms.append(QueryTerm(doc_ids, max(block_bounds), block_bounds, value))
         
-        # Return top results with metadata
-        results = []
-        for url, score in sorted_results[:max_results]:
-            info = self.page_info.get(url, {})
-            results.append({
-                'url': url,
-                'title': info.get('title', url),
-                'snippet': info.get('snippet', ''),
-                'score': score,
-                'pagerank': self.pagerank.get(url, 0.0)
-            })
+        def text_score(values):
+            score = 0.0
+            for value in values:
+                if value is not None:
+                    score += value
+            return score
         
-        return results
+        return terms, text_score
+    
+    def _phrase_pages(self, index, phrase):
+        """The IDs of the pages containing the words of the phrase consecutively."""
+        # For each page, the positions at which the phrase could start given
+        # the words checked so far
+        starts = None
+        for offset, word in enumerate(phrase):
+            if word not in index:
+                return set()
+            if starts is None:
+                starts = {page_id: set(positions) for page_id, positions in index.positions(word)}
+                continue
+            next_starts = {}
+            for page_id, positions in index.positions(word):
+                page_starts = starts.get(page_id)
+                if page_starts:
+                    page_starts = page_starts.intersection(p - offset for p in positions)
+                    if page_starts:
+                        next_starts[page_id] = page_starts
+            starts = next_starts
+        return set(starts)
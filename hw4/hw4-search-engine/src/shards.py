@@ -0,0 +1,242 @@
+"""
+Document-partitioned index shards and a scatter-gather search over them.
+
+The pages are split into K shards by page ID: page p is page p // K of
+shard p % K. Each shard is a complete store of its own (see index_store.py)
+with its own lexicon, posting lists, page records, page texts and slice of
+the PageRank scores, so no single index has to hold the whole corpus:
+
+    data/shards/layout.json     # {"num_shards": K}
+    data/shards/<k>/            # the store of shard k (manifest.json, segments, ...)
+
+ShardedSearchEngine sends every query to all shards and merges their top-k
+lists. The shards are searched on a thread pool in one process, so the
+scatter is concurrent but not parallel: the threads hold the GIL except
+while waiting on disk reads of cold posting lists and in some NumPy
+operations, so a CPU-bound query takes a little longer with more shards.
+What sharding gains is that no shard is larger than its share of the
+corpus, so each can be built, held in memory and searched on its own.
+_scatter() is the one place that would change to search each shard in a
+process or on a host of its own; benchmarks/bench_shards.py reports the
+latency that would give (the time of the slowest shard).
+
+Scores must be the same as with one index, so:
+
+- BM25 uses the page count, average page length and document frequencies
+  of the whole collection, gathered from the shards first.
+- Text scores are normalized by the best possible text score of the query,
+  which follows from those statistics alone, so every shard ranks its pages
+  by final score in a single round.
+- Ties are broken by the lower (global) page ID, as within a shard.
+"""
+
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from .index_store import (IndexStore, SegmentedIndex, load_pagerank, load_sources,
+                          load_texts, read_generation)
+from .query_cache import DEFAULT_CACHE_SIZE
+from .search_util import CollectionStats, SearchEngine
+from . import search_util
+
+SHARDS_DIR = 'shards'
+LAYOUT_FILE = 'layout.json'
+DEFAULT_NUM_SHARDS = 4
+
+
+def shard_path(data_dir, shard):
+    return os.path.join(data_dir, SHARDS_DIR, str(shard))
+
+
+def read_num_shards(data_dir='data'):
+    """The number of shards the index is split into, or None if it is not sharded."""
+    try:
+        with open(os.path.join(data_dir, SHARDS_DIR, LAYOUT_FILE), 'r') as f:
+            return json.load(f)['num_shards']
+    except FileNotFoundError:
+        return None
+
+
+def build_shards(data_dir='data', num_shards=DEFAULT_NUM_SHARDS):
+    """Split the data files into num_shards shard stores, replacing any previous ones."""
+    urls, index, positions, page_info = load_sources(data_dir)
+    doc_lengths = positions['doc_lengths']
+    positions = positions['positions']
+
+    # One pass over the index, dealing each posting to its page's shard
+    shard_words = [[] for _ in range(num_shards)]
+    for word in sorted(index):
+        shard_postings = [[] for _ in range(num_shards)]
+        for page_id, page_positions in zip(index[word], positions[word]):
+            shard_postings[page_id % num_shards].append((page_id // num_shards, page_positions))
+        for words, postings in zip(shard_words, shard_postings):
+            if postings:
+                words.append((word, postings))
+
+    pagerank = load_pagerank(data_dir, urls)
+    texts = load_texts(data_dir)
+
+    # Texts are read as each shard is written, not all held in memory
+    def shard_docs(shard):
+        for page_id in range(shard, len(urls), num_shards):
+            url = urls[page_id]
+            info = page_info.get(url, {})
+            yield (page_id // num_shards, url, info.get('title', url), info.get('snippet', ''),
+                   doc_lengths[page_id], texts.get(page_id) if texts else None)
+
+    try:
+        for shard in range(num_shards):
+            store = IndexStore(data_dir, path=shard_path(data_dir, shard))
+            store.replace(shard_words[shard], shard_docs(shard), pagerank[shard::num_shards])
+            shard_words[shard] = None
+    finally:
+        if texts is not None:
+            texts.close()
+
+    # Switch to the new layout, then drop shards it no longer has
+    path = os.path.join(data_dir, SHARDS_DIR, LAYOUT_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'num_shards': num_shards}, f)
+    os.replace(path + '.tmp', path)
+    for name in os.listdir(os.path.join(data_dir, SHARDS_DIR)):
+        if name.isdigit() and int(name) >= num_shards:
+            shutil.rmtree(os.path.join(data_dir, SHARDS_DIR, name), ignore_errors=True)
+
+
+def sync_shards(data_dir='data', num_shards=DEFAULT_NUM_SHARDS, log=None):
+    """
+    Bring the shards in data_dir up to date with the JSON data files, as
+    sync_store() does for the single index: rebuild them if they changed or
+    were split into another number of shards, or only replace their
+    PageRank scores if just pagerank.json did.
+    """
+    stores = [IndexStore(data_dir, path=shard_path(data_dir, shard))
+              for shard in range(num_shards)]
+    if read_num_shards(data_dir) != num_shards or any(store.is_stale() for store in stores):
+        if log is not None:
+            log(f"Building the search index in {num_shards} shards...")
+        build_shards(data_dir, num_shards)
+    elif any(store.pagerank_is_stale() for store in stores):
+        if log is not None:
+            log("Updating the PageRank scores of the search index shards...")
+        with open(f'{data_dir}/urls.json', 'r') as f:
+            pagerank = load_pagerank(data_dir, json.load(f))
+        for shard, store in enumerate(stores):
+            store.set_pagerank(pagerank[shard::num_shards])
+
+
+class ShardSet:
+    """
+    The shards of a sharded index, each opened as a SegmentedIndex. Has the
+    attributes of a SegmentedIndex that describe the whole index.
+    """
+
+    def __init__(self, data_dir='data'):
+        num_shards = read_num_shards(data_dir)
+        self.shards = [SegmentedIndex(data_dir, path=shard_path(data_dir, shard))
+                       for shard in range(num_shards)]
+        self.generation = tuple(shard.generation for shard in self.shards)
+        self.num_docs = sum(shard.num_docs for shard in self.shards)
+        self.total_length = sum(shard.total_length for shard in self.shards)
+        self.avg_doc_length = self.total_length / self.num_docs if self.num_docs else 0.0
+
+    def __len__(self):
+        return len(self.shards)
+
+    @property
+    def num_segments(self):
+        return sum(shard.num_segments for shard in self.shards)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def read_generations(data_dir='data'):
+    """The generations of the shards' manifests, or None if the index is not sharded."""
+    num_shards = read_num_shards(data_dir)
+    if num_shards is None:
+        return None
+    return tuple(read_generation(data_dir, path=shard_path(data_dir, shard))
+                 for shard in range(num_shards))
+
+
+class ShardedSearchEngine(SearchEngine):
+    """
+    A SearchEngine over the shards of a document-partitioned index, which
+    are searched concurrently on a thread pool (serialized by the GIL; see
+    the module docstring). Returns the same results as a SearchEngine over
+    a single index of the same pages.
+
+    Args:
+        data_dir: Directory of the crawl results.
+        num_shards: Number of shards; they are (re)built if the index is
+                    missing, out of date or split into another number.
+        cache_size: As for SearchEngine.
+    """
+
+    def __init__(self, data_dir='data', num_shards=DEFAULT_NUM_SHARDS,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.num_shards = num_shards
+        self.executor = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix='shard')
+        super().__init__(data_dir, cache_size)
+
+    def _sync_index(self):
+        sync_shards(self.data_dir, self.num_shards,
+                    log=lambda message: print(message, file=sys.stderr))
+
+    def _open_index(self):
+        return ShardSet(self.data_dir)
+
+    def _latest_generation(self):
+        return read_generations(self.data_dir)
+
+    def _suggestions_path(self):
+        return os.path.join(self.data_dir, SHARDS_DIR, search_util.SUGGESTIONS_FILE)
+
+    def _suggestion_indexes(self, index):
+        return index.shards
+
+    def _scatter(self, function, *iterables):
+        """function applied to each shard's arguments concurrently, as a list."""
+        return list(self.executor.map(function, *iterables))
+
+    def _search(self, index, query_words, phrases, max_results):
+        shards = index.shards
+        num_shards = len(shards)
+
+        # 1. Collection statistics, which BM25 scores depend on
+        collection = [None] * num_shards
+        if search_util.TEXT_SCORER == 'bm25':
+            words = sorted(set(query_words))
+            doc_freqs = dict.fromkeys(words, 0)
+            for shard_freqs in self._scatter(
+                    lambda shard: [shard.doc_freq(word) for word in words], shards):
+                for word, df in zip(words, shard_freqs):
+                    doc_freqs[word] += df
+            collection = [CollectionStats(index.num_docs, index.avg_doc_length, doc_freqs)] * num_shards
+
+        # 2. Each shard's top pages, with text scores normalized by the best
+        # possible one, which only depends on the collection statistics
+        max_text_score = self._max_text_score(index, query_words, collection[0])
+
+        def rank_shard(shard, shard_collection):
+            accept = self._phrase_filter(shard, phrases)
+            if accept is not None and not accept:
+                return []
+            scoring = self._text_scoring(shard, query_words, accept, shard_collection)
+            if scoring is None:
+                return []
+            return self._ranking(shard, scoring, accept, max_text_score, max_results)
+
+        # 3. Merged by score, then global page ID
+        ranked = []
+        for shard_number, ranking in enumerate(self._scatter(rank_shard, shards, collection)):
+            ranked.extend((-score, page_id * num_shards + shard_number, shard_number, page_id)
+                          for score, page_id in ranking)
+        ranked.sort()
+        return [(self._result(shards[shard_number], -negative_score, page_id),
+                 shards[shard_number], page_id)
+                for negative_score, _, shard_number, page_id in ranked[:max_results]]
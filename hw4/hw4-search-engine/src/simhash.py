@@ -0,0 +1,101 @@
+"""
+Near-duplicate detection with SimHash.
+
+A page's SimHash is a 64-bit fingerprint of its text: every shingle (run of
+consecutive words) is hashed, and each bit of the fingerprint is set if that
+bit is set in the majority of the shingle hashes. Pages that share most of
+their shingles - mirrors, printer views, templated pages that differ in a
+date or a sidebar - get fingerprints that differ in only a few bits, while
+unrelated pages differ in about half of them.
+
+SimHashIndex finds a stored fingerprint within a small Hamming distance of a
+new one without comparing against every page. A 64-bit fingerprint is cut
+into max_distance + 1 bands; two fingerprints that differ in at most
+max_distance bits must agree exactly on at least one band, so only the
+fingerprints sharing a band value need to be checked.
+"""
+
+import hashlib
+from collections import Counter
+from itertools import islice
+
+FINGERPRINT_BITS = 64
+
+# Shorter pages are not fingerprinted: with few shingles, small edits flip
+# too many bits for the distance to mean anything
+MIN_WORDS = 20
+
+# Hashes are tallied per byte position with a Counter. To turn byte counts
+# into bit counts, each byte value maps to an int holding 8 counters of
+# 20 bits (5 hex digits) each, one per bit, so adding count * _BYTE_BITS[value]
+# updates all 8 bit counts at once
+_COUNTER_DIGITS = 5
+_BYTE_BITS = [int(''.join('0' * (_COUNTER_DIGITS - 1) + bit for bit in format(value, '08b')), 16)
+              for value in range(256)]
+_MAX_FEATURES = (1 << (4 * _COUNTER_DIGITS)) - 1
+
+
+def _feature_hash(feature):
+    return hashlib.blake2b(feature.encode('utf-8'), digest_size=FINGERPRINT_BITS // 8).digest()
+
+
+def simhash(words, shingle_size=3):
+    """
+    Compute the SimHash fingerprint of a list of words (e.g. tokenize()
+    output). Returns None if there are fewer than MIN_WORDS words.
+    """
+    if len(words) < MIN_WORDS:
+        return None
+
+    shingles = (' '.join(words[i:i + shingle_size])
+                for i in range(len(words) - shingle_size + 1))
+    hashes = b''.join(_feature_hash(shingle) for shingle in islice(shingles, _MAX_FEATURES))
+
+    num_bytes = FINGERPRINT_BITS // 8
+    num_features = len(hashes) // num_bytes
+    fingerprint = 0
+    for position in range(num_bytes):
+        byte_counts = Counter(hashes[position::num_bytes])
+        bit_counts = sum(_BYTE_BITS[value] * count for value, count in byte_counts.items())
+        digits = format(bit_counts, f'0{8 * _COUNTER_DIGITS}x')
+        for i in range(0, len(digits), _COUNTER_DIGITS):
+            count = int(digits[i:i + _COUNTER_DIGITS], 16)
+            fingerprint = (fingerprint << 1) | (2 * count > num_features)
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class SimHashIndex:
+    """
+    Maps fingerprints to keys (page IDs, in the crawler), and looks up the
+    key of any stored fingerprint within max_distance bits of a given one.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        self._band_bits = FINGERPRINT_BITS // num_bands
+        self._bands = [{} for _ in range(num_bands)]  # band value -> [(fingerprint, key)]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._bands[0].values())
+
+    def _band_values(self, fingerprint):
+        mask = (1 << self._band_bits) - 1
+        for i in range(len(self._bands)):
+            yield (fingerprint >> (i * self._band_bits)) & mask
+
+    def add(self, key, fingerprint):
+        for band, value in zip(self._bands, self._band_values(fingerprint)):
+            band.setdefault(value, []).append((fingerprint, key))
+
+    def find(self, fingerprint):
+        """Return the key of a stored near-duplicate fingerprint, or None."""
+        for band, value in zip(self._bands, self._band_values(fingerprint)):
+            for other, key in band.get(value, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return key
+        return None
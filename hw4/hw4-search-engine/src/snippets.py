@@ -0,0 +1,101 @@
+"""
+Query-dependent snippets.
+
+A result's snippet is the passage of about SNIPPET_LENGTH characters of its
+page's text (see doc_store.py) that contains the most distinct query words,
+and the most occurrences of them on ties. Stop words only count if the
+query has nothing else. The snippet comes with the spans of the query
+words in it, so that front ends can highlight them.
+
+Query words are found with a single regular expression over the text, and
+only the first MAX_MATCHES occurrences are considered, so the cost of a
+snippet is bounded by the length of the text (see MAX_TEXT_LENGTH in
+doc_store.py).
+"""
+
+import re
+from functools import lru_cache
+from itertools import islice
+from .stopwords import is_stop_word
+
+SNIPPET_LENGTH = 200
+MAX_MATCHES = 1000
+ELLIPSIS = '...'
+
+
+@lru_cache(maxsize=256)
+def _pattern(words):
+    """A regular expression matching the words (a sorted tuple) as whole tokens, in any case."""
+    # Longer words first, so that a word is not matched by its prefix
+    alternatives = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return re.compile(rf'\b(?:{alternatives})\b', re.IGNORECASE)
+
+
+def _best_window(matches, length):
+    """
+    (first, last) indexes of the run of matches that fits in length
+    characters with the most distinct words, then the most matches.
+    """
+    counts = {}
+    best = None
+    best_key = None
+    first = 0
+    for last, match in enumerate(matches):
+        word = match.group().lower()
+        counts[word] = counts.get(word, 0) + 1
+        # A run keeps at least its last match, even one longer than length
+        while first < last and match.end() - matches[first].start() > length:
+            word = matches[first].group().lower()
+            counts[word] -= 1
+            if not counts[word]:
+                del counts[word]
+            first += 1
+        key = (len(counts), last - first)
+        if best_key is None or key > best_key:
+            best, best_key = (first, last), key
+    return best
+
+
+def make_snippet(text, query_words, length=SNIPPET_LENGTH):
+    """
+    The snippet of text for a query, as (snippet, highlights), highlights
+    being the (start, end) spans of query words in the snippet. The
+    snippet starts and ends on word boundaries, with an ellipsis where the
+    text was cut.
+    """
+    if not text:
+        return '', ()
+    words = {word for word in query_words if not is_stop_word(word)} or set(query_words)
+    all_matches = (list(islice(_pattern(tuple(sorted(words))).finditer(text), MAX_MATCHES))
+                   if words else [])
+
+    matches = None
+    if all_matches:
+        first, last = _best_window(all_matches, length)
+        matches = all_matches[first:last + 1]
+        # Center the matches in the snippet (a match longer than the snippet is cut)
+        margin = max(0, (length - (matches[-1].end() - matches[0].start())) // 2)
+        start = max(0, matches[0].start() - margin)
+    else:
+        start = 0
+    end = min(len(text), start + length)
+    start = max(0, min(start, end - length))
+
+    # Cut on word boundaries, without cutting off a match
+    if start > 0 and not text[start - 1].isspace():
+        space = text.find(' ', start, matches[0].start() if matches else end)
+        if space != -1:
+            start = space + 1
+    if end < len(text) and not text[end].isspace():
+        space = text.rfind(' ', matches[-1].end() if matches else start, end)
+        if space != -1:
+            end = space
+    snippet = text[start:end].strip()
+    offset = start + (len(text[start:end]) - len(text[start:end].lstrip()))
+
+    prefix = ELLIPSIS if start > 0 else ''
+    suffix = ELLIPSIS if end < len(text) else ''
+    highlights = tuple((match.start() - offset + len(prefix), match.end() - offset + len(prefix))
+                       for match in all_matches if match.start() >= offset
+                       and match.end() <= offset + len(snippet))
+    return prefix + snippet + suffix, highlights
@@ -0,0 +1,175 @@
+"""
+Query autocompletion from the index vocabulary.
+
+Every word of the index gets a score from how many pages contain it and
+the best PageRank score among them. Both are normalized to [0, 1] and
+weighted like the text and PageRank parts of a search score:
+
+    TEXT_RELEVANCE_WEIGHT * log(1 + df) / log(1 + pages)
+        + PAGERANK_WEIGHT * best PageRank / highest PageRank
+
+The words are kept sorted (by UTF-8 bytes) in one buffer, so the words
+starting with a prefix are a range found by binary search. A short range
+is just scanned for its best words. Short prefixes have long ranges
+(thousands of words start with "s"), so the best words of every prefix
+whose range is longer than SCAN_LIMIT are precomputed, which bounds the
+work per lookup whatever the prefix.
+
+Computing the scores reads every posting list once, so they are saved in
+a file tagged with the generation of the index they were computed from
+(see SearchEngine.suggest()) and recomputed only when the index changes.
+"""
+
+import bisect
+import json
+import math
+import os
+import numpy as np
+from .stopwords import is_stop_word
+
+# Most completions returned for a prefix
+MAX_SUGGESTIONS = 10
+# Prefixes matching more words than this have their completions precomputed
+SCAN_LIMIT = 256
+
+
+class _Words:
+    """Sorted words in one UTF-8 buffer, as a sequence of bytes for bisect."""
+
+    def __init__(self, offsets, buffer):
+        self.offsets = offsets
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def word(self, i):
+        return self[i].decode('utf-8')
+
+
+def _pack(words):
+    """(offsets, buffer) of a list of bytes."""
+    offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in words], out=offsets[1:])
+    return offsets, b''.join(words)
+
+
+def _best(scores, start, end, n):
+    """The positions of the n best scores in scores[start:end], ties going to the lower position."""
+    candidates = np.arange(start, end)
+    if n < len(candidates):
+        part = scores[start:end]
+        cutoff = part[np.argpartition(-part, n - 1)[n - 1]]
+        candidates = candidates[part >= cutoff]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:n]]
+
+
+def word_statistics(indexes):
+    """
+    {word: (document frequency, best PageRank)} over the live pages of
+    one or more SegmentedIndex (e.g. the shards of a sharded index).
+    """
+    stats = {}
+    for index in indexes:
+        pagerank = np.frombuffer(index.pagerank, dtype=np.float64)
+        for word, page_ids in index.word_pages():
+            df, best = stats.get(word, (0, 0.0))
+            stats[word] = (df + len(page_ids), max(best, float(pagerank[page_ids].max())))
+    return stats
+
+
+def build_suggestions(path, indexes, generation, weights):
+    """
+    Compute the suggestions of the words of indexes and save them to path.
+    generation identifies the version of the index, and weights are the
+    (text, PageRank) weights of the scores.
+    """
+    stats = word_statistics(indexes)
+    words = sorted(word.encode('utf-8') for word in stats if not is_stop_word(word))
+    num_docs = sum(index.num_docs for index in indexes)
+    max_pagerank = max((index.max_pagerank for index in indexes), default=0.0) or 1.0
+    text_weight, pagerank_weight = weights
+    doc_freqs = np.array([stats[word.decode('utf-8')][0] for word in words], dtype=np.int64)
+    best_pageranks = np.array([stats[word.decode('utf-8')][1] for word in words], dtype=np.float64)
+    scores = (text_weight * np.log1p(doc_freqs) / math.log1p(max(num_docs, 1))
+              + pagerank_weight * best_pageranks / max_pagerank)
+
+    # Precompute the best completions of the prefixes with long ranges,
+    # going one byte deeper only inside ranges that are still long
+    prefixes = [b'']
+    completions = [_best(scores, 0, len(words), MAX_SUGGESTIONS)]
+    pending = [(0, len(words), 0)]  # ranges of words sharing their first `depth` bytes
+    while pending:
+        start, end, depth = pending.pop()
+        i = start
+        while i < end:
+            if len(words[i]) <= depth:
+                i += 1
+                continue
+            prefix = words[i][:depth + 1]
+            j = bisect.bisect_left(words, prefix + b'\xff', i, end)
+            if j - i > SCAN_LIMIT:
+                best = _best(scores, i, j, MAX_SUGGESTIONS)
+                prefixes.append(prefix)
+                completions.append(best)
+                pending.append((i, j, depth + 1))
+            i = j
+    completions = [np.pad(best, (0, MAX_SUGGESTIONS - len(best)), constant_values=-1)
+                   for best in completions]
+
+    word_offsets, word_buffer = _pack(words)
+    prefix_offsets, prefix_buffer = _pack(prefixes)
+    # Other processes may be saving the same suggestions
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, key=np.array(json.dumps([generation, list(weights)])),
+                 word_offsets=word_offsets, words=np.frombuffer(word_buffer, dtype=np.uint8),
+                 doc_freqs=doc_freqs, best_pageranks=best_pageranks, scores=scores,
+                 prefix_offsets=prefix_offsets,
+                 prefixes=np.frombuffer(prefix_buffer, dtype=np.uint8),
+                 completions=np.array(completions, dtype=np.int64).reshape(-1, MAX_SUGGESTIONS))
+    os.replace(temporary, path)
+
+
+class Suggester:
+    """The suggestions saved by build_suggestions() in path."""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            generation, weights = json.loads(str(data['key']))
+            self.generation = tuple(generation) if isinstance(generation, list) else generation
+            self.weights = tuple(weights)
+            self.words = _Words(data['word_offsets'], data['words'].tobytes())
+            self.doc_freqs = data['doc_freqs']
+            self.best_pageranks = data['best_pageranks']
+            self.scores = data['scores']
+            prefixes = _Words(data['prefix_offsets'].tolist(), data['prefixes'].tobytes())
+            completions = data['completions']
+        self._completions = {prefixes[i]: completions[i][completions[i] >= 0]
+                             for i in range(len(prefixes))}
+
+    def __len__(self):
+        return len(self.words)
+
+    def suggest(self, prefix, n=MAX_SUGGESTIONS):
+        """
+        Up to n (at most MAX_SUGGESTIONS) words starting with prefix, best
+        first, as (word, score, document frequency, best PageRank) tuples.
+        """
+        n = min(n, MAX_SUGGESTIONS)
+        prefix = prefix.lower().encode('utf-8')
+        if n <= 0:
+            return []
+        best = self._completions.get(prefix)
+        if best is None:
+            start = bisect.bisect_left(self.words, prefix)
+            end = bisect.bisect_left(self.words, prefix + b'\xff', start)
+            if start == end:
+                return []
+            best = _best(self.scores, start, end, n)
+        return [(self.words.word(i), float(self.scores[i]), int(self.doc_freqs[i]),
+                 float(self.best_pageranks[i])) for i in best[:n]]
@@ -0,0 +1,186 @@
+"""
+Document-at-a-time top-k query evaluation with MaxScore pruning.
+
+Instead of scoring every page that contains a query word and sorting them
+all, the posting lists of the query words are walked together in page ID
+order, keeping the k best pages so far in a heap. Every query word has an
+upper bound on how much it can add to a page's score, both over its whole
+posting list and per block of BLOCK_SIZE postings (block-max). Once the
+heap is full, its worst score is a threshold a page has to beat:
+
+- Words whose bounds together cannot lift a page past the threshold are
+  non-essential: their posting lists are no longer walked, only searched
+  (by bisection) for pages found in the other lists.
+- A page is dropped without computing its score as soon as the bounds of
+  the words it might still contain cannot lift it past the threshold.
+- When a single posting list is left to walk, whole blocks of it are
+  skipped if their bounds cannot beat the threshold.
+
+A query-independent prior (the PageRank score) can be part of the score;
+its bound for a block is its highest value over the block's pages.
+
+So only the postings of the words that decide the ranking are looked at
+one by one, and the work depends much less on how common the other words
+are. The results are the same as scoring every page: the k best pages,
+with ties broken by lower page ID.
+"""
+
+import bisect
+import heapq
+
+# Postings per block of a block-max upper bound
+BLOCK_SIZE = 64
+
+
+class QueryTerm:
+    """
+    The posting list of a query word, for top_k().
+
+    Args:
+        doc_ids: IDs of the pages containing the word, in ascending order.
+        upper_bound: The largest value the word can have in any page.
+        block_bounds: The largest value per block of BLOCK_SIZE postings
+                      (None if it is always upper_bound).
+        value: value(i) is the word's value in the page at doc_ids[i]
+               (None if it is always upper_bound).
+    """
+
+    __slots__ = ('doc_ids', 'upper_bound', 'block_bounds', 'value')
+
+    def __init__(self, doc_ids, upper_bound, block_bounds=None, value=None):
+        self.doc_ids = doc_ids
+        self.upper_bound = upper_bound
+        self.block_bounds = block_bounds
+        self.value = value
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def value_at(self, i):
+        return self.upper_bound if self.value is None else self.value(i)
+
+    def bound_at(self, i):
+        return self.upper_bound if self.block_bounds is None else self.block_bounds[i // BLOCK_SIZE]
+
+
+def top_k(terms, score, k, accept=None, prior=None, max_prior=None):
+    """
+    The k best pages containing any of the terms, as (score, page ID) pairs
+    from best to worst.
+
+    Args:
+        terms: QueryTerm of each query word.
+        score: score(values, prior) is the score of a page given the value
+               of each term in it (None for the terms it does not contain)
+               and its prior. Scores must not decrease when a term is added
+               or a value or the prior increases, so that scoring upper
+               bounds gives an upper bound.
+        accept: Optional set of the only page IDs that may be returned.
+        prior: Optional sequence of the prior of each page, by page ID
+               (the prior is 0.0 if not given).
+        max_prior: The highest prior, if known.
+    """
+    num_terms = len(terms)
+    if not num_terms or k <= 0:
+        return []
+
+    # Terms by increasing upper bound (longest posting lists first among
+    # equals), so the terms that are dropped first are the least useful
+    order = sorted(range(num_terms), key=lambda i: (terms[i].upper_bound, -len(terms[i])))
+    # bounds[j]: the best score of a page containing only terms order[:j]
+    if max_prior is None:
+        max_prior = max(prior, default=0.0) if prior is not None else 0.0
+    bounds = []
+    values = [None] * num_terms
+    for j in range(num_terms + 1):
+        bounds.append(score(values, max_prior))
+        if j < num_terms:
+            values[order[j]] = terms[order[j]].upper_bound
+
+    doc_id_lists = [term.doc_ids for term in terms]
+    list_lengths = [len(doc_ids) for doc_ids in doc_id_lists]
+    heap = []  # (score, -page ID) of the best pages so far, worst first
+    threshold = None
+    first_essential = 0
+    cursors = [0] * num_terms
+    checked_until = [0] * num_terms  # end of the last block that passed the block check
+    while True:
+        essential = order[first_essential:]
+        non_essential = order[:first_essential]
+
+        # The next page in the essential posting lists
+        doc_id = None
+        at_doc = []
+        for i in essential:
+            cursor = cursors[i]
+            if cursor < list_lengths[i]:
+                next_id = doc_id_lists[i][cursor]
+                if doc_id is None or next_id < doc_id:
+                    doc_id = next_id
+                    at_doc = [i]
+                elif next_id == doc_id:
+                    at_doc.append(i)
+        if doc_id is None:
+            break
+
+        # With one list left to walk, check its blocks before their pages
+        if threshold is not None and len(essential) == 1 and cursors[essential[0]] >= checked_until[essential[0]]:
+            i = essential[0]
+            cursor = cursors[i]
+            block_end = min((cursor // BLOCK_SIZE + 1) * BLOCK_SIZE, list_lengths[i])
+            values = [None] * num_terms
+            for j in non_essential:
+                values[j] = terms[j].upper_bound
+            values[i] = terms[i].bound_at(cursor)
+            prior_bound = (max(map(prior.__getitem__, doc_id_lists[i][cursor:block_end]))
+                           if prior is not None else 0.0)
+            if score(values, prior_bound) <= threshold:
+                cursors[i] = block_end
+                continue
+            checked_until[i] = block_end
+
+        if accept is None or doc_id in accept:
+            doc_prior = prior[doc_id] if prior is not None else 0.0
+            values = [None] * num_terms
+            for i in non_essential:
+                values[i] = terms[i].upper_bound
+            if threshold is not None:
+                # Quick check against the bounds of the blocks we are in
+                for i in at_doc:
+                    values[i] = terms[i].bound_at(cursors[i])
+                candidate = score(values, doc_prior) > threshold
+            else:
+                candidate = True
+
+            if candidate:
+                for i in at_doc:
+                    values[i] = terms[i].value_at(cursors[i])
+                # Look the page up in the non-essential lists, best first,
+                # while it can still make it into the heap
+                for i in reversed(non_essential):
+                    if threshold is not None and score(values, doc_prior) <= threshold:
+                        candidate = False
+                        break
+                    doc_ids = doc_id_lists[i]
+                    cursors[i] = bisect.bisect_left(doc_ids, doc_id, cursors[i])
+                    if cursors[i] < list_lengths[i] and doc_ids[cursors[i]] == doc_id:
+                        values[i] = terms[i].value_at(cursors[i])
+                    else:
+                        values[i] = None
+
+            if candidate:
+                page_score = score(values, doc_prior)
+                # Pages come in ID order, so a tie with the worst page loses
+                if len(heap) < k:
+                    heapq.heappush(heap, (page_score, -doc_id))
+                elif page_score > heap[0][0]:
+                    heapq.heapreplace(heap, (page_score, -doc_id))
+                if len(heap) == k and threshold != heap[0][0]:
+                    threshold = heap[0][0]
+                    while first_essential < num_terms and bounds[first_essential + 1] <= threshold:
+                        first_essential += 1
+
+        for i in at_doc:
+            cursors[i] += 1
+
+    return [(page_score, -negative_id) for page_score, negative_id in sorted(heap, reverse=True)]
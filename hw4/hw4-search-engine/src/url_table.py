@@ -0,0 +1,61 @@
+"""
+Interning of URLs into dense integer IDs.
+
+The crawler refers to pages by small integer IDs instead of URL strings, so
+each URL is stored once (in the table) while the graph and the posting lists
+are compact arrays of IDs. The saved data files use the same scheme:
+
+    data/urls.json    # [url, ...]: the URL of page ID i is urls[i]
+    data/graph.json   # [[target ID, ...], ...]: out-links of page ID i
+    data/index.json   # {word: [page ID, ...]}, IDs in ascending order
+"""
+
+import json
+
+
+class UrlTable:
+    def __init__(self, urls=()):
+        self.urls = []  # id -> url
+        self.ids = {}   # url -> id
+        for url in urls:
+            self.intern(url)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __contains__(self, url):
+        return url in self.ids
+
+    def __getitem__(self, url_id):
+        """The URL with the given ID."""
+        return self.urls[url_id]
+
+    def intern(self, url):
+        """Return the ID of a URL, assigning the next free ID if it is new."""
+        url_id = self.ids.get(url)
+        if url_id is None:
+            url_id = self.ids[url] = len(self.urls)
+            self.urls.append(url)
+        return url_id
+
+    def get(self, url):
+        """Return the ID of a URL, or None if it has not been interned."""
+        return self.ids.get(url)
+
+
+def load_urls(data_dir='data'):
+    """Load the URL table of the saved crawl results as a list (ID -> URL)."""
+    with open(f'{data_dir}/urls.json', 'r') as f:
+        return json.load(f)
+
+
+def load_graph(data_dir='data'):
+    """
+    Load the saved web graph with URLs instead of IDs, as a dict mapping
+    each URL to the list of URLs it links to.
+    """
+    urls = load_urls(data_dir)
+    with open(f'{data_dir}/graph.json', 'r') as f:
+        graph = json.load(f)
+    return {urls[source]: [urls[target] for target in targets]
+            for source, targets in enumerate(graph)}